@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from config.settings import settings
+
+
+class AimdController:
+    """
+    Размер пачки по схеме AIMD (additive increase / multiplicative decrease).
+
+    Пока bulk-запросы укладываются в целевую задержку, размер растёт на step. При отказе
+    Elasticsearch (429) или всплеске задержки размер уменьшается в decrease раз. Один и тот же
+    размер используют и извлечение (размер страницы в PostgreSQL), и загрузка (размер bulk-запроса),
+    поэтому при перегрузке кластера притормаживают обе стороны.
+    """
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int, step: int,
+                 target_latency: float, spike_factor: float = 2.0, decrease: float = 0.5,
+                 cooldown: float = 1.0):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.target_latency = target_latency
+        self.spike_factor = spike_factor
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.logger = logging.getLogger(__name__)
+
+        self._size = max(minimum, min(initial, maximum))
+        self._lock = threading.Lock()
+        self._last_latency = 0.0
+        self._increases = 0
+        self._decreases = 0
+        self._rejections = 0
+
+    @property
+    def size(self) -> int:
+        """Текущий размер пачки."""
+        return self._size
+
+    def observe(self, latency: float) -> None:
+        """
+        Учесть задержку успешного bulk-запроса.
+
+        :param latency: Время выполнения запроса в секундах
+        """
+        with self._lock:
+            self._last_latency = latency
+            if latency > self.target_latency * self.spike_factor:
+                self._shrink(f"задержка {latency:.2f} с")
+            elif latency <= self.target_latency and self._size < self.maximum:
+                self._size = min(self._size + self.step, self.maximum)
+                self._increases += 1
+
+    def reject(self, retry_after: float | None = None) -> float:
+        """
+        Учесть отказ Elasticsearch (429) и уменьшить размер пачки.
+
+        :param retry_after: Значение заголовка Retry-After в секундах, если он был
+        :return: Сколько секунд подождать перед повтором
+        """
+        with self._lock:
+            self._rejections += 1
+            self._shrink("отказ 429")
+        return self.cooldown if retry_after is None else retry_after
+
+    def pin(self, size: int) -> None:
+        """Зафиксировать размер пачки: границы сужаются до size (для бенчмарков)."""
+        with self._lock:
+            self.minimum = self.maximum = self._size = size
+
+    def metrics(self) -> dict[str, float]:
+        """Текущее состояние контроллера для метрик."""
+        return {
+            "size": self._size,
+            "last_latency_seconds": self._last_latency,
+            "increases": self._increases,
+            "decreases": self._decreases,
+            "rejections": self._rejections,
+        }
+
+    def _shrink(self, reason: str) -> None:
+        size = max(self.minimum, int(self._size * self.decrease))
+        if size != self._size:
+            self.logger.warning(f"Размер пачки {self.name} уменьшен с {self._size} до {size}: {reason}")
+            self._size = size
+        self._decreases += 1
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Значение заголовка Retry-After в секундах (дата HTTP не поддерживается)."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Общий размер пачки для извлечения и загрузки
+batch_size = AimdController(
+    "bulk",
+    initial=settings.elastic_chunk_size,
+    minimum=settings.elastic_chunk_size_min,
+    maximum=settings.elastic_chunk_size_max,
+    step=settings.elastic_chunk_size_step,
+    target_latency=settings.elastic_bulk_target_latency,
+)
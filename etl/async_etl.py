@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from functools import partial
+
+from adaptive import batch_size
+from dead_letters import DeadLetters, open_dead_letters
+from dimension_cache import DimensionCache
+from dimensions import AsyncDimensionsLoader, ensure_dimension_indices
+from doc_hashes import DocumentHashes, open_document_hashes
+from elastic import ElasticConnector, AsyncElasticConnector
+from transform import serialize
+from extractor import AsyncExtractor
+from full_reindex import load_catalogue
+from listener import ChangeListener
+from loader import AsyncElasticsearchLoader, generate_actions
+from metrics import measure
+from postgres import AsyncPostgresConnector
+from renames import KnownNames, open_known_names
+from config.settings import settings
+
+# Маркер окончания потока пачек между стадиями
+STOP = None
+
+logger = logging.getLogger(__name__)
+
+
+async def run_etl_async():
+    """ETL, в котором extract, transform и load работают одновременно.
+
+    Стадии связаны очередями ограниченного размера: пока загружается пачка в Elasticsearch,
+    из PostgreSQL уже читается следующая, а заполненная очередь притормаживает извлечение.
+    Изменения ищутся только по отметкам modified: очередь content.etl_outbox забирается
+    в транзакции до загрузки пачки, что не совмещается с пачками, ожидающими в очередях стадий.
+    """
+    if settings.etl_change_source == 'outbox':
+        raise Exception("Ошибка настроек: ETL_CHANGE_SOURCE=outbox не поддерживается в ETL_ASYNC=True")
+    es_connector = ElasticConnector()
+    es_connector.ensure_index(partial(load_catalogue, es_connector))
+    ensure_dimension_indices(es_connector)
+    es_connector.close()
+    listener = ChangeListener()
+    hashes = open_document_hashes()
+    dead_letters = open_dead_letters()
+    known_names = open_known_names()
+    dimension_cache = DimensionCache()
+    try:
+        while True:
+            await run_cycle(hashes, known_names, dimension_cache, dead_letters)
+            await asyncio.to_thread(listener.wait_for_changes)
+    finally:
+        if known_names is not None:
+            known_names.close()
+        dead_letters.close()
+        hashes.close()
+        listener.close()
+
+
+async def run_cycle(hashes: DocumentHashes, known_names: KnownNames | None = None,
+                    dimension_cache: DimensionCache | None = None, dead_letters: DeadLetters | None = None):
+    """Один проход ETL по всем изменениям; первыми повторяются фильмы из очереди недоставленных документов."""
+    extractor = AsyncExtractor(known_names, dimension_cache)
+    extracted = asyncio.Queue(maxsize=settings.etl_queue_size)
+    transformed = asyncio.Queue(maxsize=settings.etl_queue_size)
+
+    async with AsyncElasticConnector().connect() as es_client, AsyncPostgresConnector().connect() as pg_conn:
+        loader = AsyncElasticsearchLoader(es_client)
+        dimensions = AsyncDimensionsLoader(loader, pg_conn.cursor())
+        tasks = [
+            asyncio.create_task(extract_stage(extractor, extracted, dead_letters)),
+            asyncio.create_task(transform_stage(extractor, hashes, extracted, transformed)),
+            asyncio.create_task(load_stage(loader, extractor, hashes, transformed, dimensions, dead_letters)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            dimensions.close()
+        for index in (settings.elastic_index, settings.elastic_persons_index, settings.elastic_genres_index):
+            await loader.refresh(index)
+        logger.info(f"Размер пачки после цикла: {batch_size.metrics()}")
+
+
+async def extract_stage(extractor: AsyncExtractor, output: asyncio.Queue,
+                        dead_letters: DeadLetters | None = None) -> None:
+    """Чтение пачек из PostgreSQL."""
+    replay_ids = dead_letters.due() if dead_letters is not None else []
+    if replay_ids:
+        logger.info(f"Повтор недоставленных документов: {len(replay_ids)}")
+    async for batch in extractor.extract(replay_ids):
+        await output.put(batch)
+    await output.put(STOP)
+
+
+async def transform_stage(extractor: AsyncExtractor, hashes: DocumentHashes, input_queue: asyncio.Queue,
+                          output: asyncio.Queue) -> None:
+    """Сборка фильмов и отбор изменившихся документов."""
+    while (batch := await input_queue.get()) is not STOP:
+        documents, film_ids = [], []
+        if batch.rows:
+            # Сериализация нагружает процессор, а отбор по хешам читает SQLite: цикл событий в это время
+            # продолжает извлечение и загрузку
+            documents, film_ids = await asyncio.to_thread(transform_batch, extractor, hashes, batch.rows)
+        await output.put((documents, film_ids, batch))
+    await output.put(STOP)
+
+
+def transform_batch(extractor: AsyncExtractor, hashes: DocumentHashes, rows: list) -> tuple[list, list]:
+    """Изменившиеся документы пачки и id всех её фильмов."""
+    with measure("transform", "film_work") as measurement:
+        film_works = extractor.build_film_works(rows)
+        documents = hashes.changed(serialize(film_works))
+        measurement.items = len(film_works)
+    return documents, list(film_works)
+
+
+async def load_stage(loader: AsyncElasticsearchLoader, extractor: AsyncExtractor, hashes: DocumentHashes,
+                     input_queue: asyncio.Queue, dimensions: AsyncDimensionsLoader | None = None,
+                     dead_letters: DeadLetters | None = None) -> None:
+    """Загрузка в Elasticsearch и фиксация хешей и состояния после каждой пачки.
+
+    Персоны и жанры пачки обновляются до того, как сдвигается состояние.
+    """
+    index = settings.elastic_index
+    while (item := await input_queue.get()) is not STOP:
+        documents, film_ids, batch = item
+        renames = batch.renames
+        if renames:
+            if not await loader.apply_renames(renames, index):
+                raise Exception("Ошибка при частичном обновлении документов в Elasticsearch")
+            hashes.forget(renames.film_ids)
+
+        failed_ids = {}
+        if documents:
+            failed_ids = await loader.bulk_load(generate_actions(documents, index), index)
+            if failed_ids is None:
+                raise Exception("Ошибка при загрузке данных в Elasticsearch")
+            hashes.store(document for document in documents if document.id not in failed_ids)
+        if dead_letters is not None:
+            # Повторённые фильмы, удалённые из PostgreSQL, тоже убираются из очереди
+            dead_letters.record([*film_ids, *batch.replayed], failed_ids)
+
+        if dimensions is not None and (film_ids or batch.dimension_ids):
+            await dimensions.load(film_ids, batch.dimension_ids)
+
+        for key, value in batch.checkpoint.items():
+            extractor.state.set_state(key, value)
+            logger.info(f"Состояние {key} сдвинуто до {value}")
+        extractor.state.checkpoint()
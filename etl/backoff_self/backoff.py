@@ -1,7 +1,10 @@
+import asyncio
 import time
 from functools import wraps
 from random import uniform
 
+from metrics import BACKOFF_RETRIES
+
 
 def backoff(start_sleep_time: float = 0.1, factor: int = 2, border_sleep_time: float = 10, max_retries: int = 10, jitter: bool = True):
     """
@@ -33,8 +36,38 @@ def backoff(start_sleep_time: float = 0.1, factor: int = 2, border_sleep_time: f
                     if jitter:
                         sleep_time += uniform(-start_sleep_time, start_sleep_time)
 
+                    BACKOFF_RETRIES.inc(function=func.__qualname__)
                     time.sleep(max(start_sleep_time, sleep_time))
                     n += 1
         return inner
 
     return func_wrapper
+
+
+def async_backoff(start_sleep_time: float = 0.1, factor: int = 2, border_sleep_time: float = 10, max_retries: int = 10, jitter: bool = True):
+    """
+    Асинхронный вариант backoff для корутин. Формула и параметры те же, что и у backoff,
+    но ожидание выполняется через asyncio.sleep и не блокирует цикл событий.
+    """
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            n = 0
+            while n < max_retries:
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    sleep_time = start_sleep_time * (factor ** n)
+                    if sleep_time > border_sleep_time:
+                        sleep_time = border_sleep_time
+
+                    if jitter:
+                        sleep_time += uniform(-start_sleep_time, start_sleep_time)
+
+                    BACKOFF_RETRIES.inc(function=func.__qualname__)
+                    await asyncio.sleep(max(start_sleep_time, sleep_time))
+                    n += 1
+        return inner
+
+    return func_wrapper
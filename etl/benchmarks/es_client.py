@@ -0,0 +1,85 @@
+"""
+Бенчмарк подключения к Elasticsearch: пачек в секунду при новом клиенте и ping на каждую
+пачку (прежнее поведение ElasticConnector.connect) и при одном долгоживущем клиенте.
+
+Elasticsearch заменён локальной заглушкой benchmarks.fake_es, поэтому измеряется именно
+стоимость подключения и HTTP, а не индексации.
+
+Запуск из каталога etl: python -m benchmarks.es_client [--batches 300] [--batch-size 100]
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+
+from benchmarks.fake_es import FakeElastic
+from transform import Document, encoder
+
+
+def make_film(number: int) -> Document:
+    film = {
+        "id": f"00000000-0000-0000-0000-{number:012d}",
+        "imdb_rating": 7.5,
+        "genres": ["Drama", "Comedy"],
+        "title": f"Film {number}",
+        "description": "Synthetic film used by the benchmark",
+        "directors_names": ["Director"],
+        "actors_names": ["Actor One", "Actor Two"],
+        "writers_names": ["Writer"],
+        "directors": [{"id": "d", "name": "Director"}],
+        "actors": [{"id": "a1", "name": "Actor One"}, {"id": "a2", "name": "Actor Two"}],
+        "writers": [{"id": "w", "name": "Writer"}],
+    }
+    return Document(film["id"], encoder.encode(film).encode())
+
+
+def run(name: str, loader, batches: int, batch_size: int, index: str) -> None:
+    from loader import generate_actions
+
+    films = [make_film(number) for number in range(batch_size)]
+    start = time.perf_counter()
+    for _ in range(batches):
+        if loader.bulk_load(generate_actions(films, index), index) is None:
+            raise Exception("Ошибка при загрузке в заглушку Elasticsearch")
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {batches / elapsed:8.1f} пачек/с  {elapsed / batches * 1e3:7.2f} мс/пачка")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with FakeElastic() as fake:
+        os.environ.update(ELASTIC_HOST="127.0.0.1", ELASTIC_PORT=str(fake.port), ELASTIC_SCHEME="http")
+        from elasticsearch import Elasticsearch
+
+        from elastic import ElasticConnector
+        from loader import ElasticsearchLoader
+
+        class PerBatchConnector(ElasticConnector):
+            """Прежнее поведение: новый клиент, ping и закрытие на каждую пачку."""
+
+            @contextmanager
+            def connect(self):
+                client = Elasticsearch(hosts=[self.dsn], max_retries=5, retry_on_timeout=True,
+                                       retry_on_status=(502, 503, 504, 429))
+                try:
+                    if not client.ping():
+                        raise ConnectionError("Elasticsearch не доступен")
+                    yield client
+                finally:
+                    client.close()
+
+        index = "movies"
+        run("клиент и ping на каждую пачку", ElasticsearchLoader(PerBatchConnector()), args.batches,
+            args.batch_size, index)
+
+        connector = ElasticConnector()
+        run("общий клиент", ElasticsearchLoader(connector), args.batches, args.batch_size, index)
+        connector.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Заглушка Elasticsearch для бенчмарков: HTTP-сервер в отдельном потоке того же процесса.
+
+Отвечает на ping, проверку и создание индекса и на _bulk (все документы успешно
+проиндексированы). Ничего не хранит, только считает запросы и документы.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeElasticHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self._reply(200, b"")
+
+    def do_GET(self) -> None:
+        self._read_body()
+        self._reply(200, json.dumps({"version": {"number": "8.6.2"}, "tagline": "You Know, for Search"}).encode())
+
+    def do_PUT(self) -> None:
+        self.do_POST()
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        if "/_bulk" not in self.path:
+            self._reply(200, b'{"acknowledged": true}')
+            return
+
+        items = []
+        lines = body.splitlines()
+        for header in lines[::2]:
+            op_type, meta = next(iter(json.loads(header).items()))
+            items.append({op_type: {"_index": meta.get("_index"), "_id": meta.get("_id"), "status": 201}})
+        self.server.stats["bulk_requests"] += 1
+        self.server.stats["documents"] += len(items)
+        self.server.stats["bytes"] += len(body)
+        self._reply(200, json.dumps({"took": 1, "errors": False, "items": items}).encode())
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class FakeElastic:
+    """Запуск и остановка заглушки, счётчики запросов."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.server = ThreadingHTTPServer((host, port), FakeElasticHandler)
+        self.server.daemon_threads = True
+        self.server.stats = {"bulk_requests": 0, "documents": 0, "bytes": 0}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def stats(self) -> dict:
+        return self.server.stats
+
+    def __enter__(self) -> "FakeElastic":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
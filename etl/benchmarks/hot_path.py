@@ -0,0 +1,181 @@
+"""
+Бенчмарк горячего пути ETL на синтетических данных с результатами в JSON.
+
+Строки в форме выдачи SELECT_FILM_DATA (строка на каждую пару персона × жанр)
+генерируются в заданном масштабе и прогоняются по шагам цикла:
+
+- get_film_data - подстановка id в запрос и сборка фильмов из строк (курсор
+  отдаёт заранее сгенерированные строки, PostgreSQL не участвует);
+- transformation - словари документов;
+- serialize - JSON-байты _source;
+- generate_actions - действия bulk API по готовым документам;
+- bulk_load - ElasticsearchLoader.bulk_load в заглушку benchmarks.fake_es в том же процессе.
+
+Для каждого шага печатается и пишется в JSON среднее, минимальное и максимальное время
+на пачку и скорость в фильмах в секунду. С --baseline рядом выводится изменение
+относительно прошлого прогона, например сохранённого на предыдущем коммите.
+
+Запуск из каталога etl:
+    python -m benchmarks.hot_path [--films 1000] [--cast 20] [--genres 3] [--rounds 5]
+                                  [--output hot_path.json] [--baseline old.json]
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from adaptive import batch_size
+from benchmarks.fake_es import FakeElastic
+from benchmarks.transform import make_rows
+from elastic import ElasticConnector
+from extractor import SELECT_FILM_DATA, build_film_works, get_film_data
+from loader import ElasticsearchLoader, generate_actions
+from transform import serialize, transformation
+
+
+class RowsCursor:
+    """Курсор, который на любой запрос отдаёт заранее сгенерированные строки.
+
+    Он же изображает соединение и серверный курсор, которые открывает get_film_data.
+    """
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.position = 0
+
+    @property
+    def connection(self) -> "RowsCursor":
+        return self
+
+    def cursor(self, name: str | None = None, binary: bool = False) -> "RowsCursor":
+        return RowsCursor(self.rows)
+
+    def __enter__(self) -> "RowsCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, query, params=None, **kwargs) -> "RowsCursor":
+        self.position = 0
+        return self
+
+    def fetchall(self) -> list[dict]:
+        return self.rows
+
+    def fetchmany(self, size: int) -> list[dict]:
+        rows = self.rows[self.position:self.position + size]
+        self.position += size
+        return rows
+
+
+def timed(step: Callable[[], object], rounds: int) -> list[float]:
+    """Время каждого из rounds прогонов шага после одного прогрева, секунд."""
+    step()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        step()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summary(timings: list[float], films: int) -> dict:
+    mean = statistics.fmean(timings)
+    return {
+        "mean_ms": mean * 1e3,
+        "min_ms": min(timings) * 1e3,
+        "max_ms": max(timings) * 1e3,
+        "films_per_second": films / mean if mean else None,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(films: int, cast: int, genres: int, rounds: int, chunk_size: int) -> dict:
+    rows = make_rows(films, cast, genres)
+    cursor = RowsCursor(rows)
+    film_ids = [{"id": row["fw_id"]} for row in rows[::cast * genres]]
+    film_works = build_film_works(rows)
+    documents = serialize(film_works)
+
+    steps = {
+        "get_film_data": lambda: get_film_data(cursor, SELECT_FILM_DATA, film_ids, "film_work"),
+        "transformation": lambda: transformation(film_works),
+        "serialize": lambda: serialize(film_works),
+        "generate_actions": lambda: sum(1 for _ in generate_actions(documents, "movies")),
+    }
+    results = {name: summary(timed(step, rounds), films) for name, step in steps.items()}
+
+    # Размер bulk-запроса фиксируется, чтобы AIMD не менял его между прогонами
+    batch_size.pin(chunk_size)
+    with FakeElastic() as fake:
+        connector = ElasticConnector()
+        connector.dsn = f"http://127.0.0.1:{fake.port}"
+        loader = ElasticsearchLoader(connector)
+
+        def bulk_load() -> None:
+            if loader.bulk_load(generate_actions(documents, "movies"), "movies") is None:
+                raise Exception("Ошибка при загрузке в заглушку Elasticsearch")
+
+        results["bulk_load"] = summary(timed(bulk_load, rounds), films)
+        connector.close()
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {"films": films, "cast": cast, "genres": genres, "rounds": rounds, "rows": len(rows),
+                   "chunk_size": chunk_size},
+        "results": results,
+    }
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    params = report["params"]
+    print(f"Фильмов: {params['films']}, строк запроса: {params['rows']}, прогонов: {params['rounds']}")
+    for name, result in report["results"].items():
+        line = (f"{name:<18} {result['mean_ms']:9.1f} мс/пачка  (мин {result['min_ms']:.1f}, "
+                f"макс {result['max_ms']:.1f})  {result['films_per_second']:10.0f} фильмов/с")
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous:
+            change = (result["mean_ms"] / previous["mean_ms"] - 1) * 100
+            line += f"  {change:+6.1f}% к {baseline.get('commit') or 'базовому прогону'}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--cast", type=int, default=20)
+    parser.add_argument("--genres", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=500, help="размер bulk-запроса")
+    parser.add_argument("--output", default="hot_path.json", help="куда записать результаты")
+    parser.add_argument("--baseline", help="результаты прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    report = run_suite(args.films, args.cast, args.genres, args.rounds, args.chunk_size)
+    print_report(report, baseline)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Бенчмарк запросов извлечения к PostgreSQL: подстановка id на клиенте против подготовленных запросов.
+
+Режимы:
+
+- client - как было до перехода: ClientCursor, id подставляются в текст запроса списком
+  IN (...), поэтому у пачки другого размера другой текст, и PostgreSQL каждый раз
+  разбирает и планирует запрос заново;
+- prepared - как сейчас: один текст с параметром-массивом = ANY(%s::uuid[]), серверная
+  привязка, запрос готовится при первом выполнении, строки приходят в binary.
+
+Запросы (данные фильмов join и aggregate, id фильмов персон) выполняются на пачках id
+случайного размера, как у AIMD-пачек ETL. Для каждого запроса и режима печатается и пишется
+в JSON время на пачку (выполнение и чтение строк) и время планирования по EXPLAIN (ANALYZE):
+в режиме prepared это EXECUTE заранее подготовленного запроса.
+
+Запуск из каталога etl на базе с данными:
+    python -m benchmarks.pg_queries [--batches 50] [--min-size 50] [--max-size 500]
+                                    [--output pg_queries.json] [--baseline old.json]
+"""
+import argparse
+import json
+import platform
+import random
+import time
+from datetime import datetime, timezone
+
+from psycopg import ClientCursor, connect
+from psycopg.rows import dict_row
+
+from benchmarks.hot_path import git_commit, summary
+from extractor import SELECT_FILM_DATA, SELECT_FILM_DATA_AGGREGATED, get_select_film_work_ids
+from config.settings import settings
+
+ANY_IDS = "= ANY(%s::uuid[])"
+
+QUERIES = {
+    "film_data_join": (SELECT_FILM_DATA, "film_work"),
+    "film_data_aggregate": (SELECT_FILM_DATA_AGGREGATED, "film_work"),
+    "person_film_work_ids": (get_select_film_work_ids("person"), "person"),
+}
+
+
+def in_list(query: str, size: int) -> str:
+    """Прежняя форма запроса: список из size плейсхолдеров вместо параметра-массива."""
+    return query.replace(ANY_IDS, "IN (" + ",".join(["%s"] * size) + ")")
+
+
+def planning_ms(conn, query: str, params) -> float:
+    """Время планирования по EXPLAIN; EXPLAIN не принимает параметры, они подставляются на клиенте."""
+    with ClientCursor(conn) as cursor:
+        plan = cursor.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + query, params).fetchone()
+    return next(iter(plan.values()))[0]["Planning Time"]
+
+
+def run_client(conn, query: str, batches: list[list[str]]) -> tuple[list[float], list[float]]:
+    timings, planning = [], []
+    with ClientCursor(conn) as cursor:
+        for ids in batches:
+            started = time.perf_counter()
+            cursor.execute(in_list(query, len(ids)), ids).fetchall()
+            timings.append(time.perf_counter() - started)
+            planning.append(planning_ms(conn, in_list(query, len(ids)), ids))
+    return timings, planning
+
+
+def run_prepared(conn, query: str, batches: list[list[str]]) -> tuple[list[float], list[float]]:
+    timings, planning = [], []
+    with conn.cursor() as cursor:
+        cursor.execute("PREPARE pg_queries_bench (uuid[]) AS " + query.replace("%s", "$1").rstrip().rstrip(";"))
+        for ids in batches:
+            started = time.perf_counter()
+            cursor.execute(query, (ids,), prepare=True, binary=True).fetchall()
+            timings.append(time.perf_counter() - started)
+            planning.append(planning_ms(conn, "EXECUTE pg_queries_bench(%s::uuid[])", (ids,)))
+        cursor.execute("DEALLOCATE pg_queries_bench")
+    return timings, planning
+
+
+def id_batches(conn, table_name: str, count: int, min_size: int, max_size: int) -> list[list[str]]:
+    """Пачки id случайного размера из таблицы; одинаковые между прогонами благодаря seed."""
+    ids = [str(row["id"]) for row in conn.execute(f"SELECT id FROM content.{table_name} ORDER BY id")]
+    generator = random.Random(count)
+    return [generator.sample(ids, min(len(ids), generator.randint(min_size, max_size))) for _ in range(count)]
+
+
+def run_suite(batches: int, min_size: int, max_size: int) -> dict:
+    results = {}
+    with connect(**settings.postgres_dsl, row_factory=dict_row, autocommit=True) as conn:
+        for name, (query, table_name) in QUERIES.items():
+            ids = id_batches(conn, table_name, batches, min_size, max_size)
+            films = sum(len(part) for part in ids) / len(ids)
+            for mode, run in (("client", run_client), ("prepared", run_prepared)):
+                timings, planning = run(conn, query, ids)
+                result = summary(timings, films)
+                result["planning_ms"] = sum(planning) / len(planning)
+                results[f"{name}:{mode}"] = result
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {"batches": batches, "min_size": min_size, "max_size": max_size},
+        "results": results,
+    }
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    params = report["params"]
+    print(f"Пачек: {params['batches']}, размер пачки {params['min_size']}..{params['max_size']} id")
+    for name, result in report["results"].items():
+        line = (f"{name:<32} {result['mean_ms']:8.2f} мс/пачка  (мин {result['min_ms']:.2f}, "
+                f"макс {result['max_ms']:.2f})  планирование {result['planning_ms']:6.3f} мс")
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous:
+            change = (result["mean_ms"] / previous["mean_ms"] - 1) * 100
+            line += f"  {change:+6.1f}% к {baseline.get('commit') or 'базовому прогону'}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--min-size", type=int, default=50)
+    parser.add_argument("--max-size", type=int, default=500)
+    parser.add_argument("--output", default="pg_queries.json", help="куда записать результаты")
+    parser.add_argument("--baseline", help="результаты прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    report = run_suite(args.batches, args.min_size, args.max_size)
+    print_report(report, baseline)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
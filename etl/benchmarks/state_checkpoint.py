@@ -0,0 +1,70 @@
+"""
+Микробенчмарк стоимости сохранения состояния.
+
+Сравнивает прежнюю схему (чтение и перезапись JSON на каждый get_state/set_state)
+с State, который держит состояние в памяти и сохраняет его только на checkpoint,
+для JsonFileStorage и SqliteStorage.
+
+Запуск из каталога etl: python -m benchmarks.state_checkpoint [--pages 2000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from state import JsonFileStorage, SqliteStorage, State
+
+
+class PerCallState:
+    """Прежнее поведение State: каждое обращение идёт в хранилище."""
+
+    def __init__(self, storage) -> None:
+        self.storage = storage
+
+    def set_state(self, key, value) -> None:
+        state_storage = self.storage.retrieve_state()
+        state_storage[key] = value
+        self.storage.save_state(state_storage)
+
+    def get_state(self, key):
+        return self.storage.retrieve_state().get(key)
+
+    def checkpoint(self) -> None:
+        pass
+
+
+def simulate_page(state, table_name: str) -> None:
+    """Обращения к состоянию на одну страницу extract_persons_or_genres."""
+    modified = datetime.now(timezone.utc).isoformat()
+    state.get_state(f"temporary_{table_name}")
+    state.set_state(f"temporary_{table_name}", modified)
+    state.set_state(f"temporary_film_works_by_{table_name}", "-infinity")
+    state.get_state(f"temporary_film_works_by_{table_name}")
+    state.set_state(f"temporary_film_works_by_{table_name}", modified)
+    state.set_state(table_name, state.get_state(f"temporary_{table_name}"))
+    state.checkpoint()
+
+
+def run(name: str, state, pages: int) -> None:
+    start = time.perf_counter()
+    for page in range(pages):
+        simulate_page(state, ("person", "genre", "film_work")[page % 3])
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.3f} s  {elapsed / pages * 1e6:10.1f} мкс/страница")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        run("json, запись на каждый вызов", PerCallState(JsonFileStorage(os.path.join(directory, "legacy.json"))),
+            args.pages)
+        run("json, checkpoint", State(JsonFileStorage(os.path.join(directory, "state.json"))), args.pages)
+        run("sqlite, checkpoint", State(SqliteStorage(os.path.join(directory, "state.sqlite"))), args.pages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Микробенчмарк сборки и сериализации документов на синтетических фильмах.
+
+Сравнивает прежний путь (pydantic-модели, словари transformation и кодирование
+сериализатором клиента Elasticsearch) с записями на __slots__ и serialize, который
+сразу отдаёт JSON-байты _source. Для каждого пути печатаются время на пачку и пиковая
+память по tracemalloc.
+
+Запуск из каталога etl: python -m benchmarks.transform [--films 1000] [--cast 20] [--rounds 5]
+"""
+import argparse
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from elastic_transport import JsonSerializer
+from pydantic import BaseModel
+
+import extractor
+from extractor import build_film_works
+from transform import serialize, transformation
+
+
+class LegacyPerson(BaseModel):
+    id: str
+    name: str
+
+
+class LegacyGenre(BaseModel):
+    id: str
+    name: str
+
+
+class LegacyFilmWork(BaseModel):
+    id: str
+    title: str
+    description: Optional[str]
+    imdb_rating: Optional[float]
+    creation_date: Optional[datetime]
+    type: str
+    genres: List[LegacyGenre]
+    directors: List[LegacyPerson]
+    actors: List[LegacyPerson]
+    writers: List[LegacyPerson]
+    directors_names: List[str]
+    actors_names: List[str]
+    writers_names: List[str]
+    updated_at: Optional[datetime]
+
+
+@contextmanager
+def legacy_models():
+    """Прежние pydantic-модели в сборке фильмов."""
+    models = extractor.FilmWork, extractor.Person, extractor.Genre
+    extractor.FilmWork, extractor.Person, extractor.Genre = LegacyFilmWork, LegacyPerson, LegacyGenre
+    try:
+        yield
+    finally:
+        extractor.FilmWork, extractor.Person, extractor.Genre = models
+
+
+def make_rows(films: int, cast: int, genres: int = 3) -> list[dict]:
+    """Строки SELECT_FILM_DATA: по строке на каждую пару персона × жанр."""
+    now = datetime.now(timezone.utc)
+    roles = ("actor", "director", "writer")
+    genre_ids = [(str(uuid.uuid4()), f"Genre {number}") for number in range(genres)]
+    rows = []
+    for film in range(films):
+        film_id = uuid.uuid4()
+        for person in range(cast):
+            person_id = uuid.uuid4()
+            for genre_id, genre_name in genre_ids:
+                rows.append({
+                    "fw_id": film_id, "title": f"Film {film}", "description": "Synthetic film " * 10,
+                    "rating": 7.5, "type": "movie", "created": now, "modified": now,
+                    "role": roles[person % len(roles)], "id": person_id, "full_name": f"Person {film}-{person}",
+                    "g_id": genre_id, "name": genre_name,
+                })
+    return rows
+
+
+def legacy_path(rows: list[dict]) -> list[bytes]:
+    """Прежний путь: pydantic-модели, словари и кодирование сериализатором клиента."""
+    serializer = JsonSerializer()
+    with legacy_models():
+        film_works = build_film_works(rows)
+    return [serializer.dumps(document) for document in transformation(film_works)]
+
+
+def fast_path(rows: list[dict]) -> list[bytes]:
+    """Записи на __slots__ и JSON-байты _source без промежуточного списка словарей."""
+    return [document.source for document in serialize(build_film_works(rows))]
+
+
+def run(name: str, path, rows: list[dict], rounds: int) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        path(rows)
+    elapsed = (time.perf_counter() - start) / rounds
+
+    tracemalloc.start()
+    path(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {elapsed * 1e3:9.1f} мс/пачка  пик памяти {peak / 2 ** 20:8.1f} МиБ")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--cast", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.films, args.cast)
+    print(f"Фильмов: {args.films}, строк запроса: {len(rows)}")
+    run("pydantic + dict + json", legacy_path, rows, args.rounds)
+    run("__slots__ + bytes", fast_path, rows, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Сверка режимов ETL_FILM_QUERY: документы, собранные из join-запроса, из агрегированного
+запроса и из связей с кешем справочников (links), должны совпадать с точностью до порядка
+элементов в списках.
+
+Запуск из каталога etl: python -m checks.compare_film_queries
+"""
+import sys
+
+from transform import transformation
+from dimension_cache import DimensionCache
+from extractor import SELECT_FILM_DATA, SELECT_FILM_DATA_AGGREGATED, SELECT_FILMS, build_film_works, \
+    build_film_works_aggregated, build_film_works_linked, get_film_data
+from postgres import PostgresConnector
+
+BATCH_SIZE = 100
+
+
+def normalize(document: dict) -> dict:
+    """Документ с отсортированными списками для сравнения без учёта порядка."""
+    normalized = dict(document)
+    for key, value in document.items():
+        if isinstance(value, list):
+            normalized[key] = sorted(value, key=lambda item: sorted(item.items()) if isinstance(item, dict) else item)
+    return normalized
+
+
+def compare(cursor, film_works: list, dimension_cache: DimensionCache) -> list[str]:
+    """Id фильмов пачки, документы которых различаются между режимами."""
+    joined = transformation(get_film_data(cursor, SELECT_FILM_DATA, film_works, 'film_work',
+                                          build_film_works))
+    aggregated = transformation(get_film_data(cursor, SELECT_FILM_DATA_AGGREGATED, film_works, 'film_work',
+                                              build_film_works_aggregated))
+    linked = transformation(get_film_data(cursor, SELECT_FILMS, film_works, 'film_work',
+                                          build_film_works_linked, dimension_cache))
+    joined = {document["id"]: normalize(document) for document in joined}
+    aggregated = {document["id"]: normalize(document) for document in aggregated}
+    linked = {document["id"]: normalize(document) for document in linked}
+
+    return [film_id for film_id in joined.keys() | aggregated.keys() | linked.keys()
+            if not joined.get(film_id) == aggregated.get(film_id) == linked.get(film_id)]
+
+
+def main() -> int:
+    with PostgresConnector().connect() as pg_conn:
+        with pg_conn.cursor() as cursor:
+            film_works = cursor.execute("SELECT id FROM content.film_work ORDER BY id").fetchall()
+            dimension_cache = DimensionCache()
+            dimension_cache.refresh(cursor)
+            mismatched = []
+            for start in range(0, len(film_works), BATCH_SIZE):
+                mismatched += compare(cursor, film_works[start:start + BATCH_SIZE], dimension_cache)
+
+    for film_id in mismatched:
+        print(f"Документы фильма {film_id} различаются")
+    print(f"Проверено фильмов: {len(film_works)}, расхождений: {len(mismatched)}")
+    return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Проверка планов запросов извлечения: EXPLAIN каждого запроса ETL на данных базы и поиск
+последовательного чтения (Seq Scan) таблиц, в которых больше --min-rows строк.
+
+ETL выполняет запросы подготовленными (PREPARE при первом выполнении), и после нескольких
+выполнений PostgreSQL переходит на общий план, который не учитывает значения параметров.
+Поэтому каждый запрос готовится так же, с параметрами $1, $2, ..., и проверяется его общий
+план (plan_cache_mode = force_generic_plan) через EXPLAIN EXECUTE. План с подставленными
+значениями мог бы выбрать индекс, которым общий план не пользуется.
+
+Параметры берутся из самой базы: отметка modified - последняя в таблице (обычный цикл
+после первой загрузки), id - случайная пачка размером --batch. Маленькие таблицы
+PostgreSQL законно читает целиком, поэтому они не считаются ошибкой; по той же причине
+пачка должна быть малой долей таблицы: 100 id из тысячи фильмов дешевле прочитать подряд.
+
+Запуск из каталога etl: python -m checks.explain [--min-rows 1000] [--batch 10]
+Код выхода 1, если найдено последовательное чтение большой таблицы.
+"""
+import argparse
+import random
+import re
+import sys
+import uuid
+from typing import Iterator
+
+from psycopg import ClientCursor, connect
+from psycopg.rows import dict_row
+
+from dimension_cache import SELECT_FILM_GENRE_LINKS, SELECT_FILM_PERSON_LINKS, SELECT_NAMES_BY_IDS, \
+    SELECT_NAMES_MODIFIED
+from dimensions import PERSONS, GENRES
+from extractor import SELECT_FILM_DATA, SELECT_FILM_DATA_AGGREGATED, SELECT_FILMS, get_select_film_work_ids, \
+    get_select_modified
+from config.settings import settings
+
+# Первая страница изменений на последней отметке modified
+NIL_ID = uuid.UUID(int=0)
+
+
+def sample_ids(cursor, table_name: str, size: int) -> list[uuid.UUID]:
+    ids = [row["id"] for row in cursor.execute(f"SELECT id FROM content.{table_name}")]
+    return random.Random(size).sample(ids, min(size, len(ids)))
+
+
+def last_modified(cursor, table_name: str):
+    return cursor.execute(f"SELECT max(modified) as modified FROM content.{table_name}").fetchone()["modified"]
+
+
+def extractor_queries(cursor, batch: int) -> dict[str, tuple[str, tuple]]:
+    """Запросы ETL с параметрами: название -> (запрос, параметры)."""
+    film_ids = sample_ids(cursor, "film_work", batch)
+    queries = {}
+    for table_name in ("person", "genre", "film_work"):
+        queries[f"modified:{table_name}"] = (get_select_modified(table_name),
+                                             (last_modified(cursor, table_name), NIL_ID, batch))
+    for table_name in ("person", "genre"):
+        ids = sample_ids(cursor, table_name, batch)
+        queries[f"film_work_ids:{table_name}"] = (get_select_film_work_ids(table_name), (ids,))
+        queries[f"names_by_ids:{table_name}"] = (SELECT_NAMES_BY_IDS[table_name], (ids,))
+        queries[f"names_modified:{table_name}"] = (SELECT_NAMES_MODIFIED[table_name],
+                                                   (last_modified(cursor, table_name), NIL_ID, batch))
+    queries.update({
+        "film_data:join": (SELECT_FILM_DATA, (film_ids,)),
+        "film_data:aggregate": (SELECT_FILM_DATA_AGGREGATED, (film_ids,)),
+        "film_data:links": (SELECT_FILMS, (film_ids,)),
+        "links:person": (SELECT_FILM_PERSON_LINKS, (film_ids,)),
+        "links:genre": (SELECT_FILM_GENRE_LINKS, (film_ids,)),
+        "persons:by_ids": (PERSONS.select_by_ids, (sample_ids(cursor, "person", batch),)),
+        "persons:by_film_ids": (PERSONS.select_by_film_ids, (film_ids,)),
+        "genres:by_ids": (GENRES.select_by_ids, (sample_ids(cursor, "genre", batch),)),
+        "genres:by_film_ids": (GENRES.select_by_film_ids, (film_ids,)),
+    })
+    return queries
+
+
+def seq_scans(plan: dict) -> Iterator[str]:
+    """Таблицы, которые узлы плана читают последовательно."""
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def generic_plan(cursor, query: str, params: tuple) -> dict:
+    """
+    Общий план подготовленного запроса.
+
+    EXPLAIN не принимает параметры, поэтому значения для EXECUTE подставляются на клиенте;
+    на общий план они не влияют.
+    """
+    numbers = iter(range(1, len(params) + 1))
+    cursor.execute("PREPARE etl_explain AS " + re.sub("%s", lambda match: f"${next(numbers)}", query))
+    try:
+        plan = cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE etl_explain ({', '.join(['%s'] * len(params))})",
+                              params).fetchone()
+    finally:
+        cursor.execute("DEALLOCATE etl_explain")
+    return next(iter(plan.values()))[0]["Plan"]
+
+
+def table_rows(cursor, table_name: str) -> int:
+    return cursor.execute("SELECT reltuples::bigint as rows FROM pg_class WHERE oid = %s::regclass",
+                          (f"content.{table_name}",)).fetchone()["rows"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-rows", type=int, default=1000,
+                        help="таблицы меньшего размера можно читать последовательно")
+    parser.add_argument("--batch", type=int, default=10, help="размер пачки id и страницы изменений")
+    args = parser.parse_args()
+
+    failures = []
+    with connect(**settings.postgres_dsl, row_factory=dict_row, cursor_factory=ClientCursor) as pg_conn:
+        with pg_conn.cursor() as cursor:
+            cursor.execute("SET plan_cache_mode = force_generic_plan")
+            for name, (query, params) in extractor_queries(cursor, args.batch).items():
+                scans = [table_name for table_name in seq_scans(generic_plan(cursor, query, params))
+                         if table_rows(cursor, table_name) > args.min_rows]
+                print(f"{name:<34} {'Seq Scan: ' + ', '.join(scans) if scans else 'ok'}")
+                failures += [(name, table_name) for table_name in scans]
+
+    if failures:
+        print(f"Последовательное чтение таблиц больше {args.min_rows} строк: {len(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
-from pydantic import Field, AnyUrl
-from pydantic.v1 import BaseSettings
+from pydantic import AnyUrl
+from pydantic.v1 import BaseSettings, Field
 
 
 class Settings(BaseSettings):
@@ -21,18 +21,84 @@ class Settings(BaseSettings):
             'port': self.db_port
         }
 
+    # Готовить запросы на сервере и переиспользовать их планы (выключить за PgBouncer в режиме transaction)
+    postgres_prepared_statements: bool = Field(True, env="POSTGRES_PREPARED_STATEMENTS")
+
     # Elasticsearch настройки
     elastic_host: str = Field(..., env="ELASTIC_HOST")
     elastic_port: int = Field(..., env="ELASTIC_PORT")
     elastic_scheme: str = Field(..., env="ELASTIC_SCHEME")
 
+    # Пул HTTP-соединений клиента Elasticsearch
+    elastic_connections_per_node: int = Field(10, env="ELASTIC_CONNECTIONS_PER_NODE")
+    elastic_http_compress: bool = Field(False, env="ELASTIC_HTTP_COMPRESS")
+    elastic_request_timeout: float = Field(30.0, env="ELASTIC_REQUEST_TIMEOUT")
+    # С какого числа изменённых фильмов цикл грузит их в профиле массовой загрузки
+    elastic_bulk_profile_threshold: int = Field(10_000, env="ELASTIC_BULK_PROFILE_THRESHOLD")
+    # Число параллельных bulk-потоков и границы одного bulk-запроса: по документам и по байтам
+    elastic_bulk_workers: int = Field(1, env="ELASTIC_BULK_WORKERS", ge=1)
+    elastic_chunk_size: int = Field(500, env="ELASTIC_CHUNK_SIZE", ge=1)
+    elastic_max_chunk_bytes: int = Field(10 * 1024 * 1024, env="ELASTIC_MAX_CHUNK_BYTES", ge=1)
+    # Подстройка размера пачки (AIMD): ELASTIC_CHUNK_SIZE - начальный размер, рост на шаг,
+    # пока bulk-запрос быстрее целевой задержки, и уменьшение вдвое при 429 или всплеске задержки
+    elastic_chunk_size_min: int = Field(50, env="ELASTIC_CHUNK_SIZE_MIN", ge=1)
+    elastic_chunk_size_max: int = Field(5000, env="ELASTIC_CHUNK_SIZE_MAX", ge=1)
+    elastic_chunk_size_step: int = Field(50, env="ELASTIC_CHUNK_SIZE_STEP", ge=0)
+    elastic_bulk_target_latency: float = Field(1.0, env="ELASTIC_BULK_TARGET_LATENCY", gt=0)
+
     @property
     def elastic_dsn(self) -> AnyUrl:
         return f"{self.elastic_scheme}://{self.elastic_host}:{self.elastic_port}"
 
     # Общие настройки
     elastic_index: str = Field(..., env="ELASTIC_INDEX")
+    # Алиасы индексов персон и жанров
+    elastic_persons_index: str = Field("persons", env="ELASTIC_PERSONS_INDEX")
+    elastic_genres_index: str = Field("genres", env="ELASTIC_GENRES_INDEX")
     state_file_path: str = Field(..., env="STATE_FILE_PATH")
+    state_storage: str = Field("json", env="STATE_STORAGE", regex="^(json|sqlite)$")
+    # join - строка на каждую пару персона × жанр, aggregate - фильм целиком собирается в PostgreSQL,
+    # links - из PostgreSQL только связи фильмов, имена персон и жанров из кеша в памяти
+    etl_film_query: str = Field("join", env="ETL_FILM_QUERY", regex="^(join|aggregate|links)$")
+    etl_full_reindex_batch_size: int = Field(1000, env="ETL_FULL_REINDEX_BATCH_SIZE")
+    # Число процессов полной переиндексации фильмов (--workers переопределяет)
+    etl_full_reindex_workers: int = Field(1, env="ETL_FULL_REINDEX_WORKERS", ge=1)
+    # Сколько строк данных фильмов забирать из серверного курсора за раз
+    etl_film_rows_fetch_size: int = Field(2000, env="ETL_FILM_ROWS_FETCH_SIZE", ge=1)
+    # modified - поиск изменений по отметкам modified, outbox - очередь content.etl_outbox из триггеров
+    # (только синхронный режим: ETL_ASYNC=True с outbox не запускается)
+    etl_change_source: str = Field("modified", env="ETL_CHANGE_SOURCE", regex="^(modified|outbox)$")
+    # Ожидание изменений через LISTEN etl_changes: таймер на случай пропущенных уведомлений
+    # и окно, в которое собирается пачка уведомлений, прежде чем запустить цикл
+    etl_poll_interval: float = Field(15 * 60, env="ETL_POLL_INTERVAL")
+    etl_debounce: float = Field(1.0, env="ETL_DEBOUNCE")
+    etl_max_delay: float = Field(10.0, env="ETL_MAX_DELAY")
+    # Сколько id изменённых фильмов держать в памяти, прежде чем сбрасывать их на диск
+    etl_film_ids_spill_threshold: int = Field(1_000_000, env="ETL_FILM_IDS_SPILL_THRESHOLD")
+    # Хеши загруженных документов: неизменившиеся документы не отправляются в Elasticsearch
+    etl_skip_unchanged: bool = Field(True, env="ETL_SKIP_UNCHANGED")
+    etl_doc_hashes_path: str = Field("doc_hashes.sqlite", env="ETL_DOC_HASHES_PATH")
+    # Документы, не принятые Elasticsearch: повторяются в начале цикла не больше max_attempts раз
+    etl_dead_letters_path: str = Field("dead_letters.sqlite", env="ETL_DEAD_LETTERS_PATH")
+    etl_dead_letter_max_attempts: int = Field(5, env="ETL_DEAD_LETTER_MAX_ATTEMPTS", ge=1)
+    # Переименования персон и жанров применяются к документам скриптом update_by_query
+    etl_partial_updates: bool = Field(True, env="ETL_PARTIAL_UPDATES")
+
+    # Получатели документов фильмов через запятую: elasticsearch - индекс, file - файлы _bulk (NDJSON)
+    etl_sinks: str = Field("elasticsearch", env="ETL_SINKS", regex="^(elasticsearch|file)(,(elasticsearch|file))*$")
+    # Каталог файлов _bulk, сжатие gzip и размер сегмента до сжатия
+    # (несжатые сегменты --replay-bulk читает через mmap, сжатые - распаковкой потока)
+    etl_bulk_file_dir: str = Field("bulk", env="ETL_BULK_FILE_DIR")
+    etl_bulk_file_compress: bool = Field(True, env="ETL_BULK_FILE_COMPRESS")
+    etl_bulk_file_segment_bytes: int = Field(64 * 1024 * 1024, env="ETL_BULK_FILE_SEGMENT_BYTES", ge=1)
+
+    # HTTP-эндпоинт /metrics в текстовом формате Prometheus (ETL_METRICS_PORT=0 - выключен)
+    etl_metrics_host: str = Field("127.0.0.1", env="ETL_METRICS_HOST")
+    etl_metrics_port: int = Field(9108, env="ETL_METRICS_PORT", ge=0)
+
+    # Настройки асинхронного режима ETL
+    etl_async: bool = Field(False, env="ETL_ASYNC")
+    etl_queue_size: int = Field(4, env="ETL_QUEUE_SIZE")
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,113 @@
+import logging
+import os
+import sqlite3
+from typing import Iterable
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+CREATE_DEAD_LETTERS = (
+    'CREATE TABLE IF NOT EXISTS dead_letters '
+    '(index_name TEXT NOT NULL, id TEXT NOT NULL, reason TEXT NOT NULL, attempts INTEGER NOT NULL, '
+    'failed_at TEXT NOT NULL, PRIMARY KEY (index_name, id)) '
+    'WITHOUT ROWID'
+)
+
+
+class DeadLetters:
+    """Документы, не принятые Elasticsearch, в локальной базе SQLite.
+
+    Отметки modified сдвигаются и после пачки, часть документов которой Elasticsearch
+    отклонил, поэтому такие документы записываются сюда с причиной отказа и в начале
+    каждого цикла извлекаются из PostgreSQL заново и отправляются повторно (replay).
+    Каждый отказ увеличивает счётчик попыток; после max_attempts документ больше не
+    повторяется и остаётся в базе, пока его не загрузит обычный цикл или полная переиндексация.
+    """
+
+    def __init__(self, file_path: str, index: str, max_attempts: int) -> None:
+        self.index = index
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(file_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(CREATE_DEAD_LETTERS)
+
+    def add(self, failed: dict[str, str]) -> None:
+        """Записать отказы: id документа -> причина."""
+        if not failed:
+            return
+        exhausted = []
+        with self.conn:
+            for document_id, reason in failed.items():
+                attempts, = self.conn.execute(
+                    "INSERT INTO dead_letters (index_name, id, reason, attempts, failed_at) "
+                    "VALUES (?, ?, ?, 1, datetime('now')) "
+                    "ON CONFLICT (index_name, id) DO UPDATE SET reason = excluded.reason, "
+                    "attempts = attempts + 1, failed_at = excluded.failed_at RETURNING attempts",
+                    (self.index, document_id, reason)
+                ).fetchone()
+                if attempts == self.max_attempts:
+                    exhausted.append((document_id, reason))
+        for document_id, reason in exhausted:
+            logger.error(f"Документ {document_id} не принят после {self.max_attempts} попыток, "
+                         f"повторов больше не будет: {reason}")
+        logger.warning(f"В очередь недоставленных записано документов {self.index}: {len(failed)}")
+
+    def resolve(self, ids: Iterable[str]) -> None:
+        """Убрать документы, которые загружены или больше не существуют."""
+        ids = list(ids)
+        with self.conn:
+            # Не больше 999 параметров в одном запросе SQLite
+            for start in range(0, len(ids), 900):
+                part = ids[start:start + 900]
+                self.conn.execute(
+                    f'DELETE FROM dead_letters WHERE index_name = ? AND id IN ({",".join("?" * len(part))})',
+                    (self.index, *part)
+                )
+
+    def record(self, ids: Iterable[str], failed: dict[str, str]) -> None:
+        """Итог загрузки пачки: отказы записываются, остальные документы пачки убираются из очереди."""
+        self.resolve(document_id for document_id in ids if document_id not in failed)
+        self.add(failed)
+
+    def due(self) -> list[str]:
+        """Id документов, которые ещё можно повторить."""
+        return [row[0] for row in self.conn.execute(
+            'SELECT id FROM dead_letters WHERE index_name = ? AND attempts < ? ORDER BY failed_at',
+            (self.index, self.max_attempts)
+        )]
+
+    def replace(self, failed: dict[str, str]) -> None:
+        """Заменить очередь отказами полной переиндексации: прежние отказы относятся к старому индексу."""
+        with self.conn:
+            self.conn.execute('DELETE FROM dead_letters WHERE index_name = ?', (self.index,))
+        self.add(failed)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_dead_letters() -> DeadLetters:
+    """Очередь недоставленных документов индекса фильмов из настроек."""
+    return DeadLetters(settings.etl_dead_letters_path, settings.elastic_index, settings.etl_dead_letter_max_attempts)
+
+
+def dead_letters_depth() -> dict[tuple[str, str], int]:
+    """
+    Размер очереди недоставленных документов: (индекс, pending или exhausted) -> число документов.
+
+    Читается отдельным соединением, базу не создаёт.
+    """
+    if not os.path.exists(settings.etl_dead_letters_path):
+        return {}
+    conn = sqlite3.connect(settings.etl_dead_letters_path)
+    try:
+        conn.execute(CREATE_DEAD_LETTERS)
+        rows = conn.execute(
+            "SELECT index_name, CASE WHEN attempts < ? THEN 'pending' ELSE 'exhausted' END, count(*) "
+            "FROM dead_letters GROUP BY 1, 2",
+            (settings.etl_dead_letter_max_attempts,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {(index_name, state): count for index_name, state, count in rows}
@@ -0,0 +1,177 @@
+import logging
+import sys
+import uuid
+from datetime import datetime
+
+from adaptive import batch_size
+from models.models import Person, Genre
+from postgres import LAST_ID, get_results, get_results_async
+
+# Страница записей справочника после отметки (modified, id): записи с одинаковым modified
+# не перечитываются, а чтение идёт по индексу (modified, id), как у извлечения изменений
+SELECT_NAMES_MODIFIED = {
+    "person": "SELECT id, full_name as name, modified FROM content.person "
+              "WHERE (modified, id) > (%s, %s::uuid) ORDER BY modified, id LIMIT %s;",
+    "genre": "SELECT id, name, modified FROM content.genre "
+             "WHERE (modified, id) > (%s, %s::uuid) ORDER BY modified, id LIMIT %s;",
+}
+
+# Записи, на которые ссылаются связи, но которых ещё нет в кеше
+SELECT_NAMES_BY_IDS = {
+    "person": "SELECT id, full_name as name, modified FROM content.person WHERE id = ANY(%s::uuid[]);",
+    "genre": "SELECT id, name, modified FROM content.genre WHERE id = ANY(%s::uuid[]);",
+}
+
+SELECT_FILM_PERSON_LINKS = """
+    SELECT DISTINCT film_work_id, person_id, role
+    FROM content.person_film_work
+    WHERE film_work_id = ANY(%s::uuid[]);
+    """
+
+SELECT_FILM_GENRE_LINKS = """
+    SELECT DISTINCT film_work_id, genre_id
+    FROM content.genre_film_work
+    WHERE film_work_id = ANY(%s::uuid[]);
+    """
+
+# Поле фильма, в которое попадает персона с данной ролью
+ROLE_PERSONS = {"director": "directors", "actor": "actors", "writer": "writers"}
+
+RECORD_TYPES = {"person": Person, "genre": Genre}
+
+
+class DimensionCache:
+    """
+    Персоны и жанры в памяти процесса: id -> готовый объект Person или Genre.
+
+    Для режима ETL_FILM_QUERY=links: по фильмам из PostgreSQL читаются только связи
+    (film_work_id, person_id, role) и (film_work_id, genre_id), а имена берутся из кеша.
+    Имена интернируются, а объекты Person и Genre общие для всех фильмов, поэтому имя
+    персоны не передаётся и не создаётся заново на каждую строку join. Кеш загружается
+    целиком при первом обновлении (refresh) и дальше дочитывает записи после отметки
+    (modified, id). Обновляется он один раз за проход по фильмам, после сбора изменений:
+    запись, изменённая позже, попадёт в следующий цикл вместе со своими фильмами.
+    Изменённая запись заменяется новым объектом, уже собранные фильмы не меняются.
+    """
+
+    def __init__(self) -> None:
+        self.records: dict[str, dict[uuid.UUID, Person | Genre]] = {table_name: {} for table_name in RECORD_TYPES}
+        # Отметка (modified, id) последней прочитанной записи каждого справочника
+        self.modified: dict[str, tuple[datetime | str, uuid.UUID | str]] = {
+            table_name: ("-infinity", LAST_ID) for table_name in RECORD_TYPES
+        }
+        self.logger = logging.getLogger(__name__)
+
+    def refresh(self, cursor) -> None:
+        """Дочитать записи справочников, изменённые после отметки (modified, id)."""
+        for table_name in RECORD_TYPES:
+            while True:
+                limit = batch_size.size
+                data = self._select(cursor, SELECT_NAMES_MODIFIED[table_name],
+                                    (*self.modified[table_name], limit), table_name)
+                self._advance(table_name, data)
+                if len(data) < limit:
+                    break
+
+    async def refresh_async(self, cursor) -> None:
+        """Асинхронный вариант refresh."""
+        for table_name in RECORD_TYPES:
+            while True:
+                limit = batch_size.size
+                data = await self._select_async(cursor, SELECT_NAMES_MODIFIED[table_name],
+                                                (*self.modified[table_name], limit), table_name)
+                self._advance(table_name, data)
+                if len(data) < limit:
+                    break
+
+    def film_rows(self, cursor, film_rows: list[dict]) -> list[dict]:
+        """
+        Дополнить строки фильмов персонами и жанрами из кеша.
+
+        Кеш здесь не обновляется, только дочитываются записи, которых в нём ещё нет.
+
+        :param cursor: Курсор PostgreSQL
+        :param film_rows: Строки SELECT_FILMS
+        :return: Строки фильмов с полями genres, directors, actors и writers
+        """
+        if not film_rows:
+            return film_rows
+
+        ids = [str(film_row["fw_id"]) for film_row in film_rows]
+        person_links = self._select(cursor, SELECT_FILM_PERSON_LINKS, (ids,), "person")
+        genre_links = self._select(cursor, SELECT_FILM_GENRE_LINKS, (ids,), "genre")
+        for table_name, missing in self._missing(person_links, genre_links).items():
+            self._store(table_name, self._select(cursor, SELECT_NAMES_BY_IDS[table_name], (missing,), table_name))
+        return self._link(film_rows, person_links, genre_links)
+
+    async def film_rows_async(self, cursor, film_rows: list[dict]) -> list[dict]:
+        """Асинхронный вариант film_rows."""
+        if not film_rows:
+            return film_rows
+
+        ids = [str(film_row["fw_id"]) for film_row in film_rows]
+        person_links = await self._select_async(cursor, SELECT_FILM_PERSON_LINKS, (ids,), "person")
+        genre_links = await self._select_async(cursor, SELECT_FILM_GENRE_LINKS, (ids,), "genre")
+        for table_name, missing in self._missing(person_links, genre_links).items():
+            self._store(table_name, await self._select_async(cursor, SELECT_NAMES_BY_IDS[table_name], (missing,),
+                                                             table_name))
+        return self._link(film_rows, person_links, genre_links)
+
+    def _advance(self, table_name: str, data: list) -> None:
+        """Положить страницу обновления в кеш и сдвинуть отметку (modified, id)."""
+        self._store(table_name, data)
+        if data:
+            self.modified[table_name] = (data[-1]["modified"], data[-1]["id"])
+
+    def _store(self, table_name: str, data: list) -> None:
+        """Положить записи в кеш."""
+        records = self.records[table_name]
+        record_type = RECORD_TYPES[table_name]
+        for db_part in data:
+            record_id = db_part["id"]
+            records[record_id] = record_type(id=str(record_id), name=sys.intern(db_part["name"]))
+        if data:
+            self.logger.info(f"Кеш {table_name}: обновлено записей {len(data)}, всего {len(records)}")
+
+    def _missing(self, person_links: list, genre_links: list) -> dict[str, list[str]]:
+        """Id персон и жанров из связей, которых нет в кеше."""
+        missing = {
+            "person": {str(link["person_id"]) for link in person_links
+                       if link["person_id"] not in self.records["person"]},
+            "genre": {str(link["genre_id"]) for link in genre_links
+                      if link["genre_id"] not in self.records["genre"]},
+        }
+        return {table_name: list(ids) for table_name, ids in missing.items() if ids}
+
+    def _link(self, film_rows: list[dict], person_links: list, genre_links: list) -> list[dict]:
+        """Разложить персоны и жанры из кеша по фильмам."""
+        films = {}
+        for film_row in film_rows:
+            film_row = dict(film_row, genres=[], directors=[], actors=[], writers=[])
+            films[film_row["fw_id"]] = film_row
+
+        persons, genres = self.records["person"], self.records["genre"]
+        for link in person_links:
+            persons_field = ROLE_PERSONS.get(link["role"])
+            person = persons.get(link["person_id"])
+            if persons_field and person is not None:
+                films[link["film_work_id"]][persons_field].append(person)
+        for link in genre_links:
+            genre = genres.get(link["genre_id"])
+            if genre is not None:
+                films[link["film_work_id"]]["genres"].append(genre)
+        return list(films.values())
+
+    @staticmethod
+    def _select(cursor, query: str, params, table_name: str) -> list:
+        data, err = get_results(cursor, query, params, table_name)
+        if err:
+            raise Exception("Ошибка при получении данных из БД")
+        return data
+
+    @staticmethod
+    async def _select_async(cursor, query: str, params, table_name: str) -> list:
+        data, err = await get_results_async(cursor, query, params, table_name)
+        if err:
+            raise Exception("Ошибка при получении данных из БД")
+        return data
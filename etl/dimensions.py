@@ -0,0 +1,297 @@
+import logging
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Iterable
+
+from elasticsearch.helpers import scan, async_scan
+from psycopg import IsolationLevel
+
+from adaptive import batch_size
+from doc_hashes import DocumentHashes
+from film_ids import FilmIdSet
+from index_schema import PERSONS_SCHEMA, GENRES_SCHEMA
+from loader import ElasticsearchLoader, AsyncElasticsearchLoader, generate_actions
+from postgres import PostgresConnector, get_results, get_results_async
+from transform import Document, encoder
+from config.settings import settings
+
+# Персоны с id фильмов по каждой роли
+PERSON_DATA = """
+    SELECT
+        p.id,
+        p.full_name,
+        COALESCE(array_agg(DISTINCT pfw.film_work_id::text) FILTER (WHERE pfw.role = 'director'),
+                 ARRAY[]::text[]) as director_film_ids,
+        COALESCE(array_agg(DISTINCT pfw.film_work_id::text) FILTER (WHERE pfw.role = 'actor'),
+                 ARRAY[]::text[]) as actor_film_ids,
+        COALESCE(array_agg(DISTINCT pfw.film_work_id::text) FILTER (WHERE pfw.role = 'writer'),
+                 ARRAY[]::text[]) as writer_film_ids
+    FROM content.person p
+    LEFT JOIN content.person_film_work pfw ON pfw.person_id = p.id
+    """
+
+SELECT_PERSONS = PERSON_DATA + """
+    WHERE p.id = ANY(%s::uuid[])
+    GROUP BY p.id;
+    """
+
+SELECT_ALL_PERSONS = PERSON_DATA + """
+    GROUP BY p.id;
+    """
+
+GENRE_DATA = """
+    SELECT id, name, description
+    FROM content.genre
+    """
+
+SELECT_GENRES = GENRE_DATA + """
+    WHERE id = ANY(%s::uuid[]);
+    """
+
+SELECT_ALL_GENRES = GENRE_DATA + ";"
+
+# Персоны и жанры фильмов: их документы зависят от связей с фильмами
+SELECT_FILM_PERSON_IDS = """
+    SELECT DISTINCT person_id as id
+    FROM content.person_film_work
+    WHERE film_work_id = ANY(%s::uuid[]);
+    """
+
+SELECT_FILM_GENRE_IDS = """
+    SELECT DISTINCT genre_id as id
+    FROM content.genre_film_work
+    WHERE film_work_id = ANY(%s::uuid[]);
+    """
+
+ROLE_FILM_IDS = ["director_film_ids", "actor_film_ids", "writer_film_ids"]
+
+logger = logging.getLogger(__name__)
+
+
+def person_document(row: dict) -> dict:
+    """Документ индекса persons."""
+    return {
+        "id": str(row["id"]),
+        "full_name": row["full_name"],
+        "director_film_ids": row["director_film_ids"],
+        "actor_film_ids": row["actor_film_ids"],
+        "writer_film_ids": row["writer_film_ids"],
+    }
+
+
+def genre_document(row: dict) -> dict:
+    """Документ индекса genres."""
+    return {
+        "id": str(row["id"]),
+        "name": row["name"],
+        "description": row["description"] or None,
+    }
+
+
+@dataclass(frozen=True)
+class Dimension:
+    """Индекс персон или жанров: таблица, запросы, схема и сборка документа."""
+    table_name: str
+    alias: str
+    schema: dict
+    select_by_ids: str
+    select_all: str
+    select_by_film_ids: str
+    build_document: Callable[[dict], dict]
+
+    def documents(self, rows: list, ids: list[str]) -> list[Document]:
+        """Документы по строкам запроса; записи, которых больше нет в PostgreSQL, удаляются."""
+        documents = [Document(str(row["id"]), encoder.encode(self.build_document(row)).encode()) for row in rows]
+        found = {document.id for document in documents}
+        return documents + [Document(record_id, None) for record_id in ids if record_id not in found]
+
+
+PERSONS = Dimension("person", settings.elastic_persons_index, PERSONS_SCHEMA, SELECT_PERSONS, SELECT_ALL_PERSONS,
+                    SELECT_FILM_PERSON_IDS, person_document)
+GENRES = Dimension("genre", settings.elastic_genres_index, GENRES_SCHEMA, SELECT_GENRES, SELECT_ALL_GENRES,
+                   SELECT_FILM_GENRE_IDS, genre_document)
+DIMENSIONS = [PERSONS, GENRES]
+
+
+def referencing_persons_query(film_ids: list[str]) -> dict:
+    """Персоны, в документах которых есть эти фильмы: так находятся и удалённые связи."""
+    return {"bool": {"should": [{"terms": {field: film_ids}} for field in ROLE_FILM_IDS]}}
+
+
+def open_dimension_hashes() -> dict[str, DocumentHashes]:
+    """Хеши документов индексов персон и жанров."""
+    return {dimension.table_name: DocumentHashes(settings.etl_doc_hashes_path, dimension.alias,
+                                                 settings.etl_skip_unchanged)
+            for dimension in DIMENSIONS}
+
+
+def open_dimension_ids() -> dict[str, FilmIdSet]:
+    """Множества id изменённых персон и жанров за цикл."""
+    return {dimension.table_name: FilmIdSet(settings.etl_film_ids_spill_threshold) for dimension in DIMENSIONS}
+
+
+def close_dimension_ids(dimension_ids: dict[str, FilmIdSet]) -> None:
+    for ids in dimension_ids.values():
+        ids.close()
+
+
+class DimensionsLoader:
+    """Загрузка персон и жанров, затронутых изменениями, в индексы persons и genres.
+
+    Персона перестраивается, если изменилась её запись или любой из её фильмов (в том
+    числе фильм, из которого её убрали: такие находятся по индексу persons). Жанр -
+    если изменилась его запись или его фильм. Неизменившиеся документы отсекаются хешами.
+    """
+
+    def __init__(self, loader: ElasticsearchLoader):
+        self.loader = loader
+        self.hashes = open_dimension_hashes()
+
+    def load(self, film_id_batches: Iterable[list[str]], changed: dict[str, FilmIdSet]) -> None:
+        """
+        Обновить документы персон и жанров.
+
+        :param film_id_batches: Пачки id изменённых фильмов
+        :param changed: Изменённые записи по таблицам person и genre (open_dimension_ids);
+            дополняются персонами и жанрами изменённых фильмов
+        """
+        with PostgresConnector().connect() as pg_conn:
+            with pg_conn.cursor() as cursor:
+                for part_ids in film_id_batches:
+                    for dimension in DIMENSIONS:
+                        changed[dimension.table_name].update(
+                            db_part["id"] for db_part in select_ids(cursor, dimension.select_by_film_ids, part_ids,
+                                                                        dimension.table_name))
+                    changed[PERSONS.table_name].update(self._referencing_persons(part_ids))
+
+                for dimension in DIMENSIONS:
+                    for part_ids in changed[dimension.table_name].batches(lambda: batch_size.size):
+                        self._load_part(cursor, dimension, part_ids)
+
+    def close(self) -> None:
+        for hashes in self.hashes.values():
+            hashes.close()
+
+    def _referencing_persons(self, film_ids: list[str]) -> list[str]:
+        with self.loader.es.connect() as es_client:
+            return [hit["_id"] for hit in scan(es_client, index=PERSONS.alias, _source=False,
+                                               query={"query": referencing_persons_query(film_ids)})]
+
+    def _load_part(self, cursor, dimension: Dimension, ids: list[str]) -> None:
+        rows = select_ids(cursor, dimension.select_by_ids, ids, dimension.table_name)
+        hashes = self.hashes[dimension.table_name]
+        documents = hashes.changed(dimension.documents(rows, ids))
+        if not documents:
+            return
+
+        failed_ids = self.loader.bulk_load(generate_actions(documents, dimension.alias), dimension.alias)
+        if failed_ids is None:
+            raise Exception(f"Ошибка при загрузке данных в Elasticsearch ({dimension.alias})")
+        hashes.store(document for document in documents if document.id not in failed_ids)
+        logger.info(f"Обновлено документов {dimension.alias}: {len(documents)}")
+
+
+class AsyncDimensionsLoader:
+    """Асинхронный вариант DimensionsLoader: персоны и жанры обновляются после каждой пачки фильмов."""
+
+    def __init__(self, loader: AsyncElasticsearchLoader, cursor):
+        self.loader = loader
+        self.cursor = cursor
+        self.hashes = open_dimension_hashes()
+
+    async def load(self, film_ids: list[str], changed: dict[str, list[str]]) -> None:
+        """Обновить персоны и жанры пачки фильмов и изменённые записи person и genre."""
+        changed = {table_name: set(ids) for table_name, ids in changed.items()}
+        for dimension in DIMENSIONS:
+            ids = changed.setdefault(dimension.table_name, set())
+            if film_ids:
+                ids.update(str(db_part["id"]) for db_part in
+                           await select_ids_async(self.cursor, dimension.select_by_film_ids, film_ids,
+                                                  dimension.table_name))
+        if film_ids:
+            changed[PERSONS.table_name].update(await self._referencing_persons(film_ids))
+
+        for dimension in DIMENSIONS:
+            ids = list(changed[dimension.table_name])
+            for start in range(0, len(ids), batch_size.size):
+                await self._load_part(dimension, ids[start:start + batch_size.size])
+
+    def close(self) -> None:
+        for hashes in self.hashes.values():
+            hashes.close()
+
+    async def _referencing_persons(self, film_ids: list[str]) -> list[str]:
+        return [hit["_id"] async for hit in async_scan(self.loader.es_client, index=PERSONS.alias, _source=False,
+                                                       query={"query": referencing_persons_query(film_ids)})]
+
+    async def _load_part(self, dimension: Dimension, ids: list[str]) -> None:
+        rows = await select_ids_async(self.cursor, dimension.select_by_ids, ids, dimension.table_name)
+        hashes = self.hashes[dimension.table_name]
+        documents = hashes.changed(dimension.documents(rows, ids))
+        if not documents:
+            return
+
+        failed_ids = await self.loader.bulk_load(generate_actions(documents, dimension.alias), dimension.alias)
+        if failed_ids is None:
+            raise Exception(f"Ошибка при загрузке данных в Elasticsearch ({dimension.alias})")
+        hashes.store(document for document in documents if document.id not in failed_ids)
+
+
+def select_ids(cursor, query: str, ids: list[str], table_name: str) -> list:
+    """Запрос с параметром - массивом id."""
+    data, err = get_results(cursor, query, (ids,), table_name)
+    if err:
+        raise Exception("Ошибка при получении данных из БД")
+    return data
+
+
+async def select_ids_async(cursor, query: str, ids: list[str], table_name: str) -> list:
+    """Асинхронный вариант select_ids."""
+    data, err = await get_results_async(cursor, query, (ids,), table_name)
+    if err:
+        raise Exception("Ошибка при получении данных из БД")
+    return data
+
+
+def ensure_dimension_indices(es_connector, reload: bool = False) -> None:
+    """
+    Подготовить версии индексов персон и жанров под их алиасами (см. ElasticConnector.ensure_index).
+
+    :param reload: Перезагрузить документы из PostgreSQL, даже если версия индекса не изменилась
+    """
+    for dimension in DIMENSIONS:
+        built = es_connector.ensure_index(partial(load_dimension_catalogue, es_connector, dimension),
+                                          dimension.alias, dimension.schema)
+        if reload and not built:
+            load_dimension_catalogue(es_connector, dimension, dimension.alias)
+
+
+def load_dimension_catalogue(es_connector, dimension: Dimension, index: str) -> None:
+    """Загрузка всех персон или жанров в индекс (при сборке новой версии и полной переиндексации)."""
+    loader = ElasticsearchLoader(es_connector)
+    hashes = DocumentHashes(settings.etl_doc_hashes_path, dimension.alias, settings.etl_skip_unchanged)
+    try:
+        hashes.discard_staged()
+        with PostgresConnector().connect() as pg_conn:
+            pg_conn.isolation_level = IsolationLevel.REPEATABLE_READ
+            with pg_conn.cursor(name=f"full_reindex_{dimension.table_name}") as cursor, loader.bulk_profile(index):
+                cursor.execute(dimension.select_all)
+                failed_ids = loader.bulk_load(generate_actions(stream_documents(cursor, dimension, hashes), index),
+                                              index)
+
+        if failed_ids is None:
+            hashes.discard_staged()
+            raise Exception(f"Ошибка при загрузке данных в Elasticsearch ({index})")
+        hashes.publish(failed_ids)
+    finally:
+        hashes.close()
+    logger.info(f"Полная загрузка {index} завершена")
+
+
+def stream_documents(cursor, dimension: Dimension, hashes: DocumentHashes | None = None) -> Iterable[Document]:
+    """Документы персон или жанров из серверного курсора, пачка за пачкой; хеши накапливаются через stage."""
+    while rows := cursor.fetchmany(settings.etl_full_reindex_batch_size):
+        documents = dimension.documents(rows, [])
+        if hashes is not None:
+            hashes.stage(documents)
+        yield from documents
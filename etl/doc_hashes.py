@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Iterable
+
+from elasticsearch import helpers
+
+from elastic import ElasticConnector
+from transform import Document, encoder
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def document_hash(source: bytes) -> bytes:
+    """Хеш каноничных JSON-байтов документа."""
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
+class DocumentHashes:
+    """Хеши документов, уже загруженных в индекс, в локальной базе SQLite.
+
+    Документ отправляется в Elasticsearch, только если его хеш отличается от сохранённого:
+    пересохранённый фильм или правка жанра, не меняющая документ, не дают bulk-запросов.
+    Хеши записываются через store только после успешной загрузки, поэтому упавшая пачка
+    при следующем цикле будет отправлена снова. При enabled=False документы не отбираются,
+    но хеши всё равно ведутся, чтобы после включения они соответствовали индексу.
+    """
+
+    def __init__(self, file_path: str, index: str, enabled: bool = True) -> None:
+        self.index = index
+        self.enabled = enabled
+        # Асинхронный ETL отбирает документы в потоке (asyncio.to_thread), а хеши пишет в цикле событий:
+        # соединение общее, обращения к нему идут по очереди под замком
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS doc_hashes '
+            '(index_name TEXT NOT NULL, id TEXT NOT NULL, hash BLOB NOT NULL, PRIMARY KEY (index_name, id)) '
+            'WITHOUT ROWID'
+        )
+
+    def changed(self, documents: Iterable[Document]) -> list[Document]:
+        """Документы, которых нет в индексе или которые изменились с последней загрузки."""
+        documents = list(documents)
+        if not self.enabled or not documents:
+            return documents
+
+        stored = {}
+        ids = [document.id for document in documents]
+        # Не больше 999 параметров в одном запросе SQLite
+        for start in range(0, len(ids), 900):
+            part = ids[start:start + 900]
+            with self._lock:
+                stored.update(self.conn.execute(
+                    f'SELECT id, hash FROM doc_hashes WHERE index_name = ? AND id IN ({",".join("?" * len(part))})',
+                    (self.index, *part)
+                ))
+
+        changed = [document for document in documents if self._is_changed(document, stored.get(document.id))]
+        if len(changed) < len(documents):
+            logger.info(f"Без изменений, не отправлено документов: {len(documents) - len(changed)}")
+        return changed
+
+    def store(self, documents: Iterable[Document]) -> None:
+        """Запомнить хеши загруженных документов."""
+        self._store(self.index, documents)
+
+    def stage(self, documents: Iterable[Document]) -> None:
+        """
+        Запомнить хеши документов полной загрузки индекса.
+
+        Они хранятся отдельно и заменяют текущие хеши только в publish, после успешной
+        загрузки: если загрузка прервётся, хеши неотправленных документов не останутся.
+        """
+        self._store(self._staging, documents)
+
+    def stage_hashes(self, hashes: Iterable[tuple[str, bytes]]) -> None:
+        """Как stage, но по готовым парам (id, хеш), посчитанным в другом процессе."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO doc_hashes (index_name, id, hash) VALUES (?, ?, ?) '
+                'ON CONFLICT (index_name, id) DO UPDATE SET hash = excluded.hash',
+                ((self._staging, document_id, hash_value) for document_id, hash_value in hashes)
+            )
+
+    def publish(self, failed_ids: Iterable[str] = ()) -> None:
+        """Заменить хеши индекса накопленными через stage, кроме не принятых Elasticsearch документов."""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM doc_hashes WHERE index_name = ?', (self.index,))
+            self.conn.execute('UPDATE doc_hashes SET index_name = ? WHERE index_name = ?', (self.index, self._staging))
+            self.conn.executemany('DELETE FROM doc_hashes WHERE index_name = ? AND id = ?',
+                                  ((self.index, film_id) for film_id in failed_ids))
+
+    def discard_staged(self) -> None:
+        """Забыть хеши, накопленные через stage."""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM doc_hashes WHERE index_name = ?', (self._staging,))
+
+    def forget(self, film_ids: Iterable[str]) -> None:
+        """Забыть хеши документов, изменённых в индексе в обход serialize (скриптом)."""
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM doc_hashes WHERE index_name = ? AND id = ?',
+                                  ((self.index, film_id) for film_id in film_ids))
+
+    def clear(self) -> None:
+        """Забыть все хеши индекса."""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM doc_hashes WHERE index_name = ?', (self.index,))
+
+    @staticmethod
+    def _is_changed(document: Document, stored: bytes | None) -> bool:
+        if document.source is None:
+            # Удалять нужно только загруженный документ
+            return stored is not None
+        return stored != document_hash(document.source)
+
+    @property
+    def _staging(self) -> str:
+        return f"{self.index}:staging"
+
+    def _store(self, index_name: str, documents: Iterable[Document]) -> None:
+        documents = list(documents)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO doc_hashes (index_name, id, hash) VALUES (?, ?, ?) '
+                'ON CONFLICT (index_name, id) DO UPDATE SET hash = excluded.hash',
+                ((index_name, document.id, document_hash(document.source))
+                 for document in documents if document.source is not None)
+            )
+            self.conn.executemany('DELETE FROM doc_hashes WHERE index_name = ? AND id = ?',
+                                  ((index_name, document.id) for document in documents if document.source is None))
+
+    def rebuild(self, es_client) -> int:
+        """
+        Пересобрать хеши по документам, которые сейчас лежат в индексе.
+
+        Нужно, если индекс меняли в обход ETL или база хешей потеряна. _source
+        кодируется так же, как при загрузке, поэтому хеши совпадают с хешами serialize.
+
+        :return: Число документов в индексе
+        """
+        self.clear()
+        loaded = 0
+        batch = []
+        for hit in helpers.scan(es_client, index=self.index, query={"query": {"match_all": {}}}):
+            batch.append(Document(hit["_id"], encoder.encode(hit["_source"]).encode()))
+            if len(batch) >= 1000:
+                self.store(batch)
+                loaded += len(batch)
+                batch = []
+        self.store(batch)
+        loaded += len(batch)
+        logger.info(f"Хеши документов {self.index} пересобраны по индексу: {loaded}")
+        return loaded
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_document_hashes() -> DocumentHashes:
+    """База хешей документов индекса фильмов из настроек."""
+    return DocumentHashes(settings.etl_doc_hashes_path, settings.elastic_index, settings.etl_skip_unchanged)
+
+
+def rebuild_index_hashes(es_connector: ElasticConnector, index: str) -> None:
+    """Пересобрать хеши документов индекса или алиаса index по его содержимому."""
+    hashes = DocumentHashes(settings.etl_doc_hashes_path, index, settings.etl_skip_unchanged)
+    try:
+        with es_connector.connect() as es_client:
+            hashes.rebuild(es_client)
+    finally:
+        hashes.close()
+
+
+def run_rebuild_hashes():
+    """Пересборка базы хешей документов по текущему содержимому индекса (--rebuild-hashes)."""
+    es_connector = ElasticConnector()
+    try:
+        rebuild_index_hashes(es_connector, settings.elastic_index)
+    finally:
+        es_connector.close()
@@ -1,177 +1,211 @@
 import logging
-from contextlib import contextmanager
+import re
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 
-from backoff_self.backoff import backoff
+from backoff_self.backoff import backoff, async_backoff
+from index_schema import MOVIES_SCHEMA, schema_meta, versioned_name
 from config.settings import settings
 
+# Суффикс версии индекса - первые 8 символов хеша схемы
+VERSION_PATTERN = re.compile(r"[0-9a-f]{8}")
+# Как часто опрашивать задачу _reindex или _update_by_query, секунд
+REINDEX_POLL_INTERVAL = 5
+
+
+def wait_for_task(client, task_id: str) -> dict:
+    """Дождаться завершения фоновой задачи Elasticsearch и вернуть её статус."""
+    while not (status := client.tasks.get(task_id=task_id))["completed"]:
+        time.sleep(REINDEX_POLL_INTERVAL)
+    return status
+
 
 class ElasticConnector:
-    """Подключение к Elasticsearch."""
+    """Подключение к Elasticsearch.
+
+    Владеет одним долгоживущим клиентом с пулом HTTP-соединений, который разделяют
+    загрузчик и управление индексом. Клиент потокобезопасен. Доступность кластера
+    проверяется ping лениво: при первом обращении и после ошибки.
+    """
 
     def __init__(self):
         self.index = settings.elastic_index
         self.client = None
         self.dsn = settings.elastic_dsn
         self.logger = logging.getLogger(__name__)
+        self._healthy = False
+        self._lock = threading.Lock()
 
     @backoff(start_sleep_time=1, factor=2, border_sleep_time=30, max_retries=10, jitter=True)
     def _connect(self):
         """Метод для подключения с backoff."""
-        self.client = Elasticsearch(
+        if self.client is None:
+            self.client = Elasticsearch(
+                hosts=[self.dsn],
+                max_retries=5,
+                retry_on_timeout=True,
+                retry_on_status=(502, 503, 504, 429),
+                connections_per_node=settings.elastic_connections_per_node,
+                http_compress=settings.elastic_http_compress,
+                request_timeout=settings.elastic_request_timeout
+            )
+        if not self.client.ping():
+            raise ConnectionError("Elasticsearch не доступен")
+        self._healthy = True
+        return self.client
+
+    @contextmanager
+    def connect(self):
+        """Контекстный менеджер, выдающий общий клиент Elasticsearch."""
+        with self._lock:
+            if not self._healthy:
+                self._connect()
+                self.logger.info("Подключение с Elasticsearch установлено")
+        try:
+            yield self.client
+        except Exception:
+            self._healthy = False
+            self.logger.exception("Ошибка в Elasticsearch")
+            raise
+
+    def close(self) -> None:
+        """Закрыть клиент и его пул соединений."""
+        if self.client:
+            self.client.close()
+            self.client = None
+            self._healthy = False
+            self.logger.info("Соединение с Elasticsearch закрыто")
+
+    def ensure_index(self, build_from_postgres: Callable[[str], None], alias: str | None = None,
+                     schema: dict = MOVIES_SCHEMA) -> bool:
+        """
+        Подготовить версию индекса под алиасом (по умолчанию индекс фильмов settings.elastic_index).
+
+        Имя версии - алиас и хеш схемы индекса (например, movies_8b202374). Если алиас уже
+        указывает на эту версию, ничего не делается. Иначе новая версия строится рядом,
+        пока чтение идёт в старую: через _reindex, если маппинг не изменился (поменялись
+        только анализаторы), иначе из PostgreSQL через build_from_postgres. Затем алиас
+        атомарно переключается на новую версию, а старые версии удаляются.
+
+        :param build_from_postgres: Загрузка каталога из PostgreSQL в индекс с указанным именем
+        :param alias: Алиас индекса
+        :param schema: Настройки и маппинг индекса
+        :return: True, если новая версия была загружена из PostgreSQL
+        """
+        alias = alias or self.index
+        version = versioned_name(alias, schema)
+        with self.connect() as client:
+            current = self._alias_indices(client, alias)
+            if version in current:
+                return False
+
+            # Версия, не попавшая под алиас, осталась от прерванной сборки
+            if client.indices.exists(index=version):
+                client.indices.delete(index=version)
+            client.indices.create(
+                index=version,
+                settings=schema["settings"],
+                mappings={**schema["mappings"], "_meta": schema_meta(schema)}
+            )
+            self.logger.info(f"Создана версия индекса {version}")
+            source = self._reindex_source(client, current, schema)
+
+        if source:
+            self._server_reindex(source, version)
+        else:
+            build_from_postgres(version)
+        self._switch_alias(alias, version)
+        return source is None
+
+    @staticmethod
+    def _alias_indices(client, alias: str) -> list[str]:
+        """Индексы под алиасом; индекс со старой схемой, названный как алиас, тоже считается."""
+        if client.indices.exists_alias(name=alias):
+            return list(client.indices.get_alias(name=alias))
+        if client.indices.exists(index=alias):
+            return [alias]
+        return []
+
+    @staticmethod
+    def _reindex_source(client, current: list[str], schema: dict) -> str | None:
+        """Текущая версия, из которой можно скопировать документы через _reindex."""
+        mapping_hash = schema_meta(schema)["mapping_hash"]
+        for name in current:
+            meta = next(iter(client.indices.get_mapping(index=name).values()))["mappings"].get("_meta", {})
+            if meta.get("mapping_hash") == mapping_hash:
+                return name
+        return None
+
+    def _server_reindex(self, source: str, dest: str) -> None:
+        """Копирование документов между версиями на стороне Elasticsearch."""
+        with self.connect() as client:
+            task = client.reindex(source={"index": source}, dest={"index": dest}, wait_for_completion=False)
+            self.logger.info(f"Запущен _reindex {source} -> {dest}, задача {task['task']}")
+            status = wait_for_task(client, task["task"])
+
+        failures = status.get("error") or status.get("response", {}).get("failures")
+        if failures:
+            raise Exception(f"Ошибка при _reindex {source} -> {dest}: {failures}")
+        self.logger.info(f"_reindex {source} -> {dest} завершён: {status['response'].get('total')} документов")
+
+    def _switch_alias(self, alias: str, version: str) -> None:
+        """Атомарно переключить алиас на версию и удалить остальные версии."""
+        with self.connect() as client:
+            current = self._alias_indices(client, alias)
+            actions = [{"add": {"index": version, "alias": alias}}]
+            for name in current:
+                if name == alias:
+                    actions.insert(0, {"remove_index": {"index": name}})
+                else:
+                    actions.insert(0, {"remove": {"index": name, "alias": alias}})
+            client.indices.update_aliases(actions=actions)
+            self.logger.info(f"Алиас {alias} переключён на {version}")
+
+            stale = [name for name in client.indices.get(index=f"{alias}_*")
+                     if name != version and VERSION_PATTERN.fullmatch(name.removeprefix(f"{alias}_"))]
+            if stale:
+                client.indices.delete(index=",".join(stale))
+                self.logger.info(f"Удалены старые версии индекса: {', '.join(stale)}")
+
+
+class AsyncElasticConnector:
+    """Асинхронное подключение к Elasticsearch."""
+
+    def __init__(self):
+        self.index = settings.elastic_index
+        self.client = None
+        self.dsn = settings.elastic_dsn
+        self.logger = logging.getLogger(__name__)
+
+    @async_backoff(start_sleep_time=1, factor=2, border_sleep_time=30, max_retries=10, jitter=True)
+    async def _connect(self):
+        """Метод для подключения с backoff."""
+        self.client = AsyncElasticsearch(
             hosts=[self.dsn],
             max_retries=5,
             retry_on_timeout=True,
             retry_on_status=(502, 503, 504, 429)
         )
-        if not self.client.ping():
+        if not await self.client.ping():
+            await self.client.close()
             raise ConnectionError("Elasticsearch не доступен")
         return self.client
 
-    @contextmanager
-    def connect(self):
-        """Контекстный менеджер для подключения к Elasticsearch."""
+    @asynccontextmanager
+    async def connect(self):
+        """Асинхронный контекстный менеджер для подключения к Elasticsearch."""
         try:
-            self._connect()
-            self.logger.info("Подключение с Elasticsearch установлено")
+            await self._connect()
+            self.logger.info("Асинхронное подключение с Elasticsearch установлено")
             yield self.client
         except Exception:
             self.logger.exception("Ошибка в Elasticsearch")
             raise
         finally:
             if self.client:
-                self.client.close()
-                self.logger.info("Соединение с Elasticsearch закрыто")
-
-    def create_index_if_not_exists(self) -> None:
-        """Создать индекс если он не существует."""
-        with self.connect() as client:
-            try:
-                if not client.indices.exists(index=self.index):
-                    client.indices.create(
-                        index=self.index,
-                        body={
-                              "settings": {
-                                "refresh_interval": "1s",
-                                "analysis": {
-                                  "filter": {
-                                    "english_stop": {
-                                      "type":       "stop",
-                                      "stopwords":  "_english_"
-                                    },
-                                    "english_stemmer": {
-                                      "type": "stemmer",
-                                      "language": "english"
-                                    },
-                                    "english_possessive_stemmer": {
-                                      "type": "stemmer",
-                                      "language": "possessive_english"
-                                    },
-                                    "russian_stop": {
-                                      "type":       "stop",
-                                      "stopwords":  "_russian_"
-                                    },
-                                    "russian_stemmer": {
-                                      "type": "stemmer",
-                                      "language": "russian"
-                                    }
-                                  },
-                                  "analyzer": {
-                                    "ru_en": {
-                                      "tokenizer": "standard",
-                                      "filter": [
-                                        "lowercase",
-                                        "english_stop",
-                                        "english_stemmer",
-                                        "english_possessive_stemmer",
-                                        "russian_stop",
-                                        "russian_stemmer"
-                                      ]
-                                    }
-                                  }
-                                }
-                              },
-                              "mappings": {
-                                "dynamic": "strict",
-                                "properties": {
-                                  "id": {
-                                    "type": "keyword"
-                                  },
-                                  "imdb_rating": {
-                                    "type": "float"
-                                  },
-                                  "genres": {
-                                    "type": "keyword"
-                                  },
-                                  "title": {
-                                    "type": "text",
-                                    "analyzer": "ru_en",
-                                    "fields": {
-                                      "raw": {
-                                        "type":  "keyword"
-                                      }
-                                    }
-                                  },
-                                  "description": {
-                                    "type": "text",
-                                    "analyzer": "ru_en"
-                                  },
-                                  "directors_names": {
-                                    "type": "text",
-                                    "analyzer": "ru_en"
-                                  },
-                                  "actors_names": {
-                                    "type": "text",
-                                    "analyzer": "ru_en"
-                                  },
-                                  "writers_names": {
-                                    "type": "text",
-                                    "analyzer": "ru_en"
-                                  },
-                                  "directors": {
-                                    "type": "nested",
-                                    "dynamic": "strict",
-                                    "properties": {
-                                      "id": {
-                                        "type": "keyword"
-                                      },
-                                      "name": {
-                                        "type": "text",
-                                        "analyzer": "ru_en"
-                                      }
-                                    }
-                                  },
-                                  "actors": {
-                                    "type": "nested",
-                                    "dynamic": "strict",
-                                    "properties": {
-                                      "id": {
-                                        "type": "keyword"
-                                      },
-                                      "name": {
-                                        "type": "text",
-                                        "analyzer": "ru_en"
-                                      }
-                                    }
-                                  },
-                                  "writers": {
-                                    "type": "nested",
-                                    "dynamic": "strict",
-                                    "properties": {
-                                      "id": {
-                                        "type": "keyword"
-                                      },
-                                      "name": {
-                                        "type": "text",
-                                        "analyzer": "ru_en"
-                                      }
-                                    }
-                                  }
-                                }
-                              }
-                        })
-                    self.logger.info(f"Created index {self.index}")
-            except Exception:
-                self.logger.exception("Failed to create index")
-                raise
+                await self.client.close()
+                self.logger.info("Асинхронное соединение с Elasticsearch закрыто")
@@ -1,60 +1,163 @@
 import logging
-import time
+from contextlib import nullcontext
+from functools import partial
 
 from dotenv import load_dotenv
 
+from adaptive import batch_size
+from dead_letters import DeadLetters, open_dead_letters
+from dimension_cache import DimensionCache
+from dimensions import DimensionsLoader, ensure_dimension_indices, open_dimension_ids, close_dimension_ids
+from doc_hashes import DocumentHashes, open_document_hashes
 from elastic import ElasticConnector
 from extractor import Extractor
-from loader import ElasticsearchLoader, generate_actions
+from film_ids import FilmIdSet
+from full_reindex import load_catalogue
+from listener import ChangeListener
+from loader import ElasticsearchLoader
+from metrics import measure, start_metrics_server
 from models.models import FilmWork
+from renames import open_known_names
+from sinks import ElasticsearchSink, Sink, open_sink
+from transform import serialize
 from config.settings import settings
 
 
 def run_etl():
     es_connector = ElasticConnector()
-    es_connector.create_index_if_not_exists()
+    es_connector.ensure_index(partial(load_catalogue, es_connector))
+    ensure_dimension_indices(es_connector)
     loader = ElasticsearchLoader(es_connector)
     new_index = settings.elastic_index
-    while True:
-        start_etl_time = time.time()
-        extractor = Extractor()
-        for table_name in ['person', 'genre']:
-            for extracted_data in extractor.extract_persons_or_genres(table_name):
-                transformed_data = transformation(extracted_data)
-                actions = generate_actions(transformed_data, new_index)
-                success = loader.bulk_load(actions, new_index)
-                if not success:
-                    raise Exception("Ошибка при загрузке данных в Elasticsearch")
-
-        for extracted_data in extractor.extract_film_works():
-            transformed_data = transformation(extracted_data)
-            actions = generate_actions(transformed_data, new_index)
-            success = loader.bulk_load(actions, new_index)
-            if not success:
-                raise Exception("Ошибка при загрузке данных в Elasticsearch")
-        time.sleep(15 * 60 - (time.time() - start_etl_time))
-
-
-def transformation(film_works: dict[str, FilmWork]) -> list[dict]:
-    """Преобразование данных перед загрузкой в Elasticsearch."""
-    return [{
-        "id": film.id,
-        "imdb_rating": film.imdb_rating,
-        "genres": [genre.name for genre in film.genres],
-        "title": film.title,
-        "description": film.description,
-        "directors_names": film.directors_names,
-        "actors_names": film.actors_names,
-        "writers_names": film.writers_names,
-        "directors": [{"id": d.id, "name": d.name} for d in film.directors],
-        "actors": [{"id": a.id, "name": a.name} for a in film.actors],
-        "writers": [{"id": w.id, "name": w.name} for w in film.writers],
-    } for film in film_works.values()]
+    loader.restore_settings(new_index)
+    listener = ChangeListener()
+    hashes = open_document_hashes()
+    dead_letters = open_dead_letters()
+    known_names = open_known_names()
+    dimensions = DimensionsLoader(loader)
+    dimension_cache = DimensionCache()
+    sink = open_sink(loader)
+    try:
+        while True:
+            extractor = Extractor(known_names, dimension_cache)
+            replay_dead_letters(extractor, sink, new_index, hashes, dead_letters)
+
+            if settings.etl_change_source == 'outbox':
+                for extracted_data in extractor.extract_outbox():
+                    load(sink, extracted_data, new_index, hashes, dead_letters)
+                    load_dimensions(dimensions, [list(extracted_data)])
+            else:
+                run_modified_cycle(extractor, loader, new_index, hashes, dimensions, dead_letters, sink)
+            sink.flush()
+
+            # Одно обновление индексов за цикл вместо refresh на каждый bulk-запрос
+            for index in (new_index, settings.elastic_persons_index, settings.elastic_genres_index):
+                loader.refresh(index)
+            logging.info(f"Размер пачки после цикла: {batch_size.metrics()}")
+            listener.wait_for_changes()
+    finally:
+        sink.close()
+        if known_names is not None:
+            known_names.close()
+        dimensions.close()
+        dead_letters.close()
+        hashes.close()
+        listener.close()
+        es_connector.close()
+
+
+def run_modified_cycle(extractor: Extractor, loader: ElasticsearchLoader, index: str,
+                       hashes: DocumentHashes, dimensions: DimensionsLoader | None = None,
+                       dead_letters: DeadLetters | None = None, sink: Sink | None = None) -> None:
+    """Цикл по отметкам modified: сбор изменённых фильмов, загрузка каждого один раз.
+
+    Документы фильмов уходят в sink (по умолчанию в Elasticsearch через loader),
+    переименования применяются в Elasticsearch.
+
+    Затем обновляются персоны и жанры изменённых фильмов и изменённые записи person и genre;
+    отметки фиксируются после загрузки всех индексов.
+    """
+    sink = sink or ElasticsearchSink(loader)
+    film_ids = FilmIdSet(settings.etl_film_ids_spill_threshold)
+    dimension_ids = open_dimension_ids()
+    try:
+        watermarks, renames = extractor.collect_changed_film_ids(film_ids, dimension_ids)
+        logging.info(f"Изменено фильмов: {len(film_ids)}, повторов убрано: {film_ids.duplicates}")
+
+        if renames:
+            logging.info(f"Переименовано персон: {len(renames.persons)}, жанров: {len(renames.genres)}, "
+                         f"затронуто фильмов: {len(renames.film_ids)}")
+            if not loader.apply_renames(renames, index):
+                raise Exception("Ошибка при частичном обновлении документов в Elasticsearch")
+            hashes.forget(renames.film_ids)
+
+        large_load = len(film_ids) >= settings.elastic_bulk_profile_threshold
+        with loader.bulk_profile(index) if large_load else nullcontext():
+            for extracted_data in extractor.extract_film_works_by_ids(film_ids):
+                load(sink, extracted_data, index, hashes, dead_letters)
+
+        if dimensions is not None:
+            dimensions.load(film_ids.batches(lambda: batch_size.size), dimension_ids)
+    finally:
+        close_dimension_ids(dimension_ids)
+        film_ids.close()
+
+    extractor.commit_watermarks(watermarks)
+
+
+def load(sink: Sink, film_works: dict[str, FilmWork], index: str,
+         hashes: DocumentHashes, dead_letters: DeadLetters | None = None) -> None:
+    """Преобразование пачки фильмов и запись изменившихся документов в получатели.
+
+    Не принятые получателями документы попадают в очередь недоставленных, остальные фильмы
+    пачки из неё убираются.
+    """
+    # Фильмы пачки уже посчитаны при сборке (get_film_data_by_ids), здесь только время сериализации
+    with measure("transform", "film_work"):
+        documents = hashes.changed(serialize(film_works))
+    failed_ids = {}
+    if documents:
+        failed_ids = sink.write(documents, index)
+        hashes.store(document for document in documents if document.id not in failed_ids)
+    if dead_letters is not None:
+        dead_letters.record(film_works, failed_ids)
+
+
+def replay_dead_letters(extractor: Extractor, sink: Sink, index: str, hashes: DocumentHashes,
+                        dead_letters: DeadLetters) -> None:
+    """Повтор документов из очереди недоставленных: фильмы заново читаются из PostgreSQL пачками."""
+    due = dead_letters.due()
+    if not due:
+        return
+    logging.info(f"Повтор недоставленных документов: {len(due)}")
+
+    film_ids = FilmIdSet(settings.etl_film_ids_spill_threshold)
+    film_ids.update(due)
+    found = set()
+    try:
+        for extracted_data in extractor.extract_film_works_by_ids(film_ids):
+            load(sink, extracted_data, index, hashes, dead_letters)
+            found.update(extracted_data)
+    finally:
+        film_ids.close()
+
+    # Фильмы, удалённые из PostgreSQL, повторять нечего
+    dead_letters.resolve(film_id for film_id in due if film_id not in found)
+
+
+def load_dimensions(dimensions: DimensionsLoader, film_id_batches: list[list[str]]) -> None:
+    """Обновление персон и жанров пачки фильмов из очереди изменений."""
+    dimension_ids = open_dimension_ids()
+    try:
+        dimensions.load(film_id_batches, dimension_ids)
+    finally:
+        close_dimension_ids(dimension_ids)
 
 
 if __name__ == '__main__':
     load_dotenv()
-    logging.basicConfig(level=logging.INFO, filename="logs/etl.log", filemode="w",
+    logging.basicConfig(level=logging.INFO, filename="logs/etl.log", filemode="a",
                         format="%(asctime)s %(name)s %(levelname)s %(message)s")
 
+    start_metrics_server()
     run_etl()
@@ -1,194 +1,597 @@
 import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Iterable, Iterator
 
+import psycopg
+
+from adaptive import batch_size
 from models.models import FilmWork, Person, Genre
-from postgres import PostgresConnector, get_results, \
-    get_film_works_by_persons_or_genres_modified, get_modified
-from state import JsonFileStorage, State
+from dimension_cache import DimensionCache
+from film_ids import FilmIdSet
+from metrics import Measurement, measure
+from renames import NAME_COLUMNS, KnownNames, Renames
+from postgres import LAST_ID, PostgresConnector, AsyncPostgresConnector, get_results, get_results_async, \
+    get_modified
+from state import State, get_storage
 from config.settings import settings
 
 
+SELECT_FILM_DATA = """
+    SELECT
+        fw.id as fw_id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified,
+        pfw.role,
+        p.id,
+        p.full_name,
+        g.id as g_id,
+        g.name
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE fw.id = ANY(%s::uuid[])
+    ORDER BY fw.id;
+    """
+
+
+# Фильмы с жанрами и персонами, собранными в json-массивы на стороне PostgreSQL
+FILM_DATA_AGGREGATED = """
+    SELECT
+        fw.id as fw_id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified,
+        COALESCE(g.genres, '[]') as genres,
+        COALESCE(p.directors, '[]') as directors,
+        COALESCE(p.actors, '[]') as actors,
+        COALESCE(p.writers, '[]') as writers
+    FROM content.film_work fw
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('id', fg.id, 'name', fg.name) ORDER BY fg.name, fg.id) as genres
+        FROM (
+            SELECT DISTINCT g.id, g.name
+            FROM content.genre_film_work gfw
+            JOIN content.genre g ON g.id = gfw.genre_id
+            WHERE gfw.film_work_id = fw.id
+        ) fg
+    ) g ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT
+            json_agg(json_build_object('id', fp.id, 'name', fp.full_name) ORDER BY fp.full_name, fp.id)
+                FILTER (WHERE fp.role = 'director') as directors,
+            json_agg(json_build_object('id', fp.id, 'name', fp.full_name) ORDER BY fp.full_name, fp.id)
+                FILTER (WHERE fp.role = 'actor') as actors,
+            json_agg(json_build_object('id', fp.id, 'name', fp.full_name) ORDER BY fp.full_name, fp.id)
+                FILTER (WHERE fp.role = 'writer') as writers
+        FROM (
+            SELECT DISTINCT pfw.role, p.id, p.full_name
+            FROM content.person_film_work pfw
+            JOIN content.person p ON p.id = pfw.person_id
+            WHERE pfw.film_work_id = fw.id
+        ) fp
+    ) p ON TRUE
+    """
+
+SELECT_FILM_DATA_AGGREGATED = FILM_DATA_AGGREGATED + """
+    WHERE fw.id = ANY(%s::uuid[]);
+    """
+
+# Только поля фильмов: персоны и жанры режима links берутся из кеша справочников
+SELECT_FILMS = """
+    SELECT
+        fw.id as fw_id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified
+    FROM content.film_work fw
+    WHERE fw.id = ANY(%s::uuid[])
+    ORDER BY fw.id;
+    """
+
+# Весь каталог для полной переиндексации
+SELECT_ALL_FILM_DATA = FILM_DATA_AGGREGATED + ";"
+
+
+# Забрать пачку записей из очереди изменений, пропуская заблокированные другими ETL
+CLAIM_OUTBOX = """
+    DELETE FROM content.etl_outbox
+    WHERE id IN (
+        SELECT id
+        FROM content.etl_outbox
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING film_work_id;
+    """
+
+
 class Extractor:
     """Извлечение данных из PostgreSQL"""
 
-    def __init__(self):
-        storage = JsonFileStorage(settings.state_file_path)
+    def __init__(self, known_names: KnownNames | None = None, dimension_cache: DimensionCache | None = None):
+        storage = get_storage(settings.state_storage, settings.state_file_path)
 
         self.state = State(storage)
         self.logger = logging.getLogger(__name__)
         self.pg_connector = PostgresConnector()
-
-        self.select_data_by_modified = """
-                SELECT
-                    fw.id as fw_id, 
-                    fw.title, 
-                    fw.description, 
-                    fw.rating, 
-                    fw.type, 
-                    fw.created, 
-                    fw.modified, 
-                    pfw.role, 
-                    p.id, 
-                    p.full_name,
-                    g.id as g_id,
-                    g.name
-                FROM content.film_work fw
-                LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-                LEFT JOIN content.person p ON p.id = pfw.person_id
-                LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-                LEFT JOIN content.genre g ON g.id = gfw.genre_id
-                WHERE fw.id IN ({0});
-                """
-
-    def extract_persons_or_genres(self, table_name: str):
-        """Извлечение новых данных из таблицы person или genre"""
-        select_modified = get_select_modified(table_name)
-
-        select_film_works_by_modified = f"""
-            SELECT fw.id, fw.modified
-            FROM content.film_work fw
-            LEFT JOIN content.{table_name}_film_work tfw ON tfw.film_work_id = fw.id
-            WHERE tfw.{table_name}_id IN ({{0}}) AND fw.modified > %s
-            ORDER BY fw.modified
-            LIMIT 100;
-            """
-
+        # Известные имена персон и жанров; если заданы, переименования идут частичным обновлением
+        self.known_names = known_names
+
+        self.select_data_by_modified, self.build_film_works = FILM_DATA_QUERIES[settings.etl_film_query]
+        # Имена персон и жанров для режима links; кеш живёт дольше одного цикла, если передан снаружи
+        self.dimension_cache = None
+        if settings.etl_film_query == "links":
+            self.dimension_cache = dimension_cache or DimensionCache()
+
+    def collect_changed_film_ids(self, film_ids: FilmIdSet,
+                                 dimension_ids: dict[str, FilmIdSet] | None = None) -> tuple[dict[str, str], Renames]:
+        """
+        Фаза сбора изменений: id фильмов, затронутых изменениями в person, genre и film_work.
+
+        Отметки modified в состояние не пишутся, а возвращаются: их нужно зафиксировать
+        через commit_watermarks после загрузки всех собранных фильмов.
+
+        Если заданы известные имена, переименованные персоны и жанры не добавляют фильмы
+        в film_ids, а возвращаются для частичного обновления документов.
+
+        :param film_ids: Множество, в которое добавляются id фильмов
+        :param dimension_ids: Множества по таблицам person и genre, в которые добавляются id
+            изменённых записей (для индексов персон и жанров)
+        :return: Новые отметки modified по таблицам и переименования
+        """
+        watermarks = {}
+        renames = Renames()
+        with self.pg_connector.connect() as pg_conn:
+            with pg_conn.cursor() as cursor:
+                for table_name in ['person', 'genre', 'film_work']:
+                    for data in self._iter_modified(cursor, table_name):
+                        watermarks[table_name] = data[-1]['modified'].isoformat()
+                        watermarks[f'{table_name}_id'] = str(data[-1]['id'])
+                        if table_name == 'film_work':
+                            film_ids.update(db_part["id"] for db_part in data)
+                            continue
+
+                        if dimension_ids is not None:
+                            dimension_ids[table_name].update(str(db_part["id"]) for db_part in data)
+                        if self.known_names is not None:
+                            renamed, data = self.known_names.split(table_name, data, renames)
+                            if renamed:
+                                renames.film_ids.update(
+                                    str(film_id) for film_id in self._get_film_work_ids(cursor, renamed, table_name))
+                        if data:
+                            film_ids.update(self._get_film_work_ids(cursor, data, table_name))
+        return watermarks, renames
+
+    def extract_film_works_by_ids(self, film_ids: FilmIdSet):
+        """Фаза загрузки: данные фильмов из собранного множества, пачками текущего размера batch_size"""
+        with self.pg_connector.connect() as pg_conn:
+            with pg_conn.cursor() as cursor:
+                if film_ids and self.dimension_cache is not None:
+                    self.dimension_cache.refresh(cursor)
+                for film_works_ids in film_ids.batches(lambda: batch_size.size):
+                    yield get_film_data_by_ids(cursor, self.select_data_by_modified, film_works_ids, 'film_work',
+                                               self.build_film_works, self.dimension_cache)
+
+    def extract_outbox(self):
+        """
+        Забор изменений из очереди content.etl_outbox.
+
+        Пачка id удаляется из очереди в той же транзакции, в которой читаются данные фильмов,
+        а транзакция фиксируется, только когда потребитель запросит следующую пачку, то есть
+        после загрузки текущей. Если загрузка упала, записи возвращаются в очередь.
+        Заблокированные другими процессами записи пропускаются (SKIP LOCKED).
+        """
         with self.pg_connector.connect() as pg_conn:
             with pg_conn.cursor() as cursor:
-                modified = self.state.get_state(table_name)
-                self.state.set_state(f'temporary_{table_name}', modified)
-
                 while True:
-                    data, err = get_modified(cursor, self.state, select_modified, table_name)
-                    if err:
-                        return
-
-                    if not data:
-                        break
-
-                    last_modified = data[-1]['modified'].isoformat()
-                    self.state.set_state(f'temporary_{table_name}', last_modified)
-                    logging.info(f"Взяли результаты из {table_name} по {last_modified}")
-
-                    part_ids = [str(db_part["id"]) for db_part in data]
-
-                    temporary_select = select_film_works_by_modified.format(",".join(["%s"] * len(part_ids)))
-                    self.state.set_state(f'temporary_film_works_by_{table_name}', "-infinity")
-                    while True:
-                        data, err = get_film_works_by_persons_or_genres_modified(cursor, self.state, temporary_select, part_ids, table_name)
+                    with pg_conn.transaction():
+                        data, err = get_results(cursor, CLAIM_OUTBOX, (batch_size.size,), 'etl_outbox')
                         if err:
                             return
                         if not data:
                             break
 
-                        last_modified = data[-1]['modified'].isoformat()
-                        self.state.set_state(f'temporary_film_works_by_{table_name}', last_modified)
-
-                        yield get_film_data(cursor, self.select_data_by_modified, data, table_name)
-
-                    self.state.set_state(table_name, self.state.get_state(f"temporary_{table_name}"))
-
-    def extract_film_works(self, table_name: str = 'film_work'):
-        """Извлечение новых данных из таблицы person или genre"""
+                        film_works_ids = list({str(db_part["film_work_id"]) for db_part in data})
+                        # Изменение персоны или жанра попадает в очередь в той же транзакции, поэтому
+                        # кеш обновляется после каждого забора, а не один раз за цикл
+                        if self.dimension_cache is not None:
+                            self.dimension_cache.refresh(cursor)
+                        logging.info(f"Забрали из очереди изменений {len(data)} записей, фильмов: {len(film_works_ids)}")
+                        yield get_film_data_by_ids(cursor, self.select_data_by_modified, film_works_ids, 'etl_outbox',
+                                                   self.build_film_works, self.dimension_cache)
+
+    def commit_watermarks(self, watermarks: dict[str, str]) -> None:
+        """Зафиксировать отметки modified после загрузки."""
+        for table_name, modified in watermarks.items():
+            self.state.set_state(table_name, modified)
+            self.logger.info(f"Состояние {table_name} сдвинуто до {modified}")
+        self.state.checkpoint()
+
+    def _iter_modified(self, cursor, table_name: str):
+        """Страницы изменённых записей таблицы начиная с сохранённой отметки (modified, id)"""
         select_modified = get_select_modified(table_name)
+        self.state.set_state(f'temporary_{table_name}', self.state.get_state(table_name))
+        self.state.set_state(f'temporary_{table_name}_id', self.state.get_state(f'{table_name}_id'))
+
+        while True:
+            data, err = get_modified(cursor, self.state, select_modified, table_name, batch_size.size)
+            if err:
+                return
+
+            if not data:
+                break
+
+            last_modified = data[-1]['modified'].isoformat()
+            self.state.set_state(f'temporary_{table_name}', last_modified)
+            self.state.set_state(f'temporary_{table_name}_id', str(data[-1]['id']))
+            logging.info(f"Взяли результаты из {table_name} по {last_modified}")
+            yield data
+
+    @staticmethod
+    def _get_film_work_ids(cursor, data: list, table_name: str) -> list:
+        """Id фильмов, связанных с пачкой записей person или genre"""
+        part_ids = [str(db_part["id"]) for db_part in data]
+        film_works, err = get_results(cursor, get_select_film_work_ids(table_name), (part_ids,), table_name)
+        if err:
+            raise Exception("Ошибка при получении данных из БД")
+        return [film_work["id"] for film_work in film_works]
+
+
+@dataclass
+class ExtractedBatch:
+    """Строки фильмов для transform и отметки состояния, которые нужно зафиксировать после загрузки.
+
+    Вместо строк пачка может нести переименования для частичного обновления документов
+    или id изменённых записей person и genre для индексов персон и жанров, а пачка
+    повтора - id фильмов из очереди недоставленных документов.
+    """
+    rows: list
+    checkpoint: dict[str, str] = field(default_factory=dict)
+    renames: Renames | None = None
+    dimension_ids: dict[str, list[str]] = field(default_factory=dict)
+    replayed: list[str] = field(default_factory=list)
 
-        with self.pg_connector.connect() as pg_conn:
-            with pg_conn.cursor() as cursor:
-                modified = self.state.get_state(table_name)
-                self.state.set_state(f'temporary_{table_name}', modified)
-
-                while True:
-                    data, err = get_modified(cursor, self.state, select_modified, table_name)
-                    if err:
-                        return
 
-                    if not data:
-                        break
+class AsyncExtractor:
+    """Асинхронное извлечение данных из PostgreSQL.
 
-                    last_modified = data[-1]['modified'].isoformat()
-                    self.state.set_state(f'temporary_{table_name}', last_modified)
-                    logging.info(f"Взяли результаты из {table_name} по {last_modified}")
+    Состояние не пишется при извлечении: отметки modified отдаются вместе с пачкой
+    и фиксируются стадией загрузки, когда пачка уже попала в Elasticsearch.
+    """
 
-                    yield get_film_data(cursor, self.select_data_by_modified, data, table_name)
+    def __init__(self, known_names: KnownNames | None = None, dimension_cache: DimensionCache | None = None):
+        storage = get_storage(settings.state_storage, settings.state_file_path)
 
-                    self.state.set_state(table_name, self.state.get_state(f"temporary_{table_name}"))
+        self.state = State(storage)
+        self.logger = logging.getLogger(__name__)
+        self.pg_connector = AsyncPostgresConnector()
+        # Известные имена персон и жанров; если заданы, переименования идут частичным обновлением
+        self.known_names = known_names
+
+        self.select_data_by_modified, self.build_film_works = FILM_DATA_QUERIES[settings.etl_film_query]
+        # Имена персон и жанров для режима links; кеш живёт дольше одного цикла, если передан снаружи
+        self.dimension_cache = None
+        if settings.etl_film_query == "links":
+            self.dimension_cache = dimension_cache or DimensionCache()
+
+    async def extract(self, replay_ids: list[str] = ()) -> AsyncIterator[ExtractedBatch]:
+        """Извлечение изменений по одному соединению
+
+        Сначала собираются id фильмов, затронутых изменениями в person, genre и film_work,
+        затем каждый фильм читается один раз, даже если он изменился сразу в нескольких таблицах.
+        Отметки modified отдаются последней пачкой, после всех фильмов, персон и жанров.
+
+        :param replay_ids: Id фильмов из очереди недоставленных документов, они читаются первыми
+        """
+        async with self.pg_connector.connect() as pg_conn:
+            async with pg_conn.cursor() as cursor:
+                if replay_ids and self.dimension_cache is not None:
+                    await self.dimension_cache.refresh_async(cursor)
+                start = 0
+                while start < len(replay_ids):
+                    part = replay_ids[start:start + batch_size.size]
+                    start += len(part)
+                    rows = await self._get_film_rows(cursor, [{"id": film_id} for film_id in part], 'film_work')
+                    yield ExtractedBatch(rows, replayed=part)
+
+                film_ids = FilmIdSet(settings.etl_film_ids_spill_threshold)
+                dimension_ids = {table_name: FilmIdSet(settings.etl_film_ids_spill_threshold)
+                                 for table_name in ('person', 'genre')}
+                try:
+                    watermarks, renames = await self.collect_changed_film_ids(cursor, film_ids, dimension_ids)
+                    logging.info(f"Изменено фильмов: {len(film_ids)}, повторов убрано: {film_ids.duplicates}")
+                    if renames:
+                        yield ExtractedBatch([], renames=renames)
+
+                    # Кеш обновляется после сбора: запись, изменённая позже, попадёт в следующий цикл
+                    if film_ids and self.dimension_cache is not None:
+                        await self.dimension_cache.refresh_async(cursor)
+                    for part in film_ids.batches(lambda: batch_size.size):
+                        rows = await self._get_film_rows(cursor, [{"id": film_id} for film_id in part], 'film_work')
+                        yield ExtractedBatch(rows)
+
+                    for table_name, ids in dimension_ids.items():
+                        for part in ids.batches(lambda: batch_size.size):
+                            yield ExtractedBatch([], dimension_ids={table_name: part})
+                finally:
+                    film_ids.close()
+                    for ids in dimension_ids.values():
+                        ids.close()
+
+                yield ExtractedBatch([], watermarks)
+
+    async def collect_changed_film_ids(self, cursor, film_ids: FilmIdSet,
+                                       dimension_ids: dict[str, FilmIdSet]) -> tuple[dict[str, str], Renames]:
+        """Асинхронный вариант Extractor.collect_changed_film_ids на курсоре cursor."""
+        watermarks = {}
+        renames = Renames()
+        for table_name in ['person', 'genre', 'film_work']:
+            async for data in self._iter_modified(cursor, table_name):
+                watermarks[table_name] = data[-1]['modified'].isoformat()
+                watermarks[f'{table_name}_id'] = str(data[-1]['id'])
+                if table_name == 'film_work':
+                    film_ids.update(db_part["id"] for db_part in data)
+                    continue
+
+                dimension_ids[table_name].update(str(db_part["id"]) for db_part in data)
+                if self.known_names is not None:
+                    renamed, data = self.known_names.split(table_name, data, renames)
+                    if renamed:
+                        renames.film_ids.update(
+                            str(film_id) for film_id in await self._get_film_work_ids(cursor, renamed, table_name))
+                if data:
+                    film_ids.update(await self._get_film_work_ids(cursor, data, table_name))
+        return watermarks, renames
+
+    async def _iter_modified(self, cursor, table_name: str) -> AsyncIterator[list]:
+        """Страницы изменённых записей таблицы начиная с сохранённой отметки (modified, id)"""
+        select_modified = get_select_modified(table_name)
+        modified = parse_modified(self.state.get_state(table_name))
+        last_id = self.state.get_state(f'{table_name}_id') or LAST_ID
+
+        while True:
+            data, err = await get_results_async(cursor, select_modified, (modified, last_id, batch_size.size),
+                                                table_name)
+            if err:
+                return
+
+            if not data:
+                break
+
+            modified, last_id = data[-1]['modified'], data[-1]['id']
+            logging.info(f"Взяли результаты из {table_name} по {modified.isoformat()}")
+            yield data
+
+    @staticmethod
+    async def _get_film_work_ids(cursor, data: list, table_name: str) -> list:
+        """Id всех фильмов, связанных с пачкой записей person или genre"""
+        part_ids = [str(db_part["id"]) for db_part in data]
+        film_works, err = await get_results_async(cursor, get_select_film_work_ids(table_name), (part_ids,),
+                                                  table_name)
+        if err:
+            raise Exception("Ошибка при получении данных из БД")
+        return [film_work["id"] for film_work in film_works]
+
+    async def _get_film_rows(self, cursor, data: list, table_name: str) -> list:
+        """Получение строк SELECT_FILM_DATA по пачке id фильмов"""
+        film_works_ids = [str(db_part["id"]) for db_part in data]
+        rows, err = await get_results_async(cursor, self.select_data_by_modified, (film_works_ids,), table_name)
+        if err:
+            raise Exception("Ошибка при получении данных из БД")
+        if self.dimension_cache is not None:
+            return await self.dimension_cache.film_rows_async(cursor, rows)
+        return rows
+
+
+def parse_modified(modified: str | None) -> datetime | str:
+    """Отметка modified из состояния в параметр запроса"""
+    if modified is None:
+        return "-infinity"
+    return datetime.fromisoformat(modified)
 
 
 def get_select_modified(table_name: str) -> str:
     """
     Запрос для получения изменённых записей в указанной таблице.
 
+    Страницы идут по ключу (modified, id): записи с одной отметкой modified на границе
+    страницы не пропускаются, а запрос читает индекс (modified, id) по порядку.
+
     :param table_name: Название таблицы
-    :return: SQL запрос
+    :return: SQL запрос с параметрами отметки modified, id последней записи на ней и размера страницы
     """
+    name = f", {NAME_COLUMNS[table_name]} as name" if table_name in NAME_COLUMNS else ""
     return f"""
-            SELECT id, modified
+            SELECT id, modified{name}
             FROM content.{table_name}
-            WHERE modified > %s
-            ORDER BY modified
-            LIMIT 100;
+            WHERE (modified, id) > (%s, %s::uuid)
+            ORDER BY modified, id
+            LIMIT %s;
+            """
+
+
+def get_select_film_work_ids(table_name: str) -> str:
+    """
+    Запрос для получения id всех фильмов, связанных с записями таблицы person или genre.
+
+    :param table_name: Название таблицы
+    :return: SQL запрос с параметром - массивом id
+    """
+    return f"""
+            SELECT DISTINCT tfw.film_work_id as id
+            FROM content.{table_name}_film_work tfw
+            WHERE tfw.{table_name}_id = ANY(%s::uuid[]);
             """
 
 
-def get_film_data(cursor, query: str, data: list, table_name: str) -> dict[str, FilmWork]:
+def get_film_data(cursor, query: str, data: list, table_name: str, builder=None,
+                  dimension_cache: DimensionCache | None = None) -> dict[str, FilmWork]:
     """Функция для получения информации по фильмам"""
     film_works_ids = [str(db_part["id"]) for db_part in data]
-    temporary_select = query.format(",".join(["%s"] * len(film_works_ids)))
-    data, err = get_results(cursor, temporary_select, film_works_ids, table_name)
-    if err:
+    return get_film_data_by_ids(cursor, query, film_works_ids, table_name, builder, dimension_cache)
+
+
+def get_film_data_by_ids(cursor, query: str, film_works_ids: list[str], table_name: str,
+                         builder=None, dimension_cache: DimensionCache | None = None) -> dict[str, FilmWork]:
+    """
+    Функция для получения информации по фильмам с указанными id.
+
+    Строки читаются серверным курсором на соединении cursor порциями по
+    etl_film_rows_fetch_size и сразу собираются в фильмы, поэтому в памяти не бывает
+    всего развёрнутого join пачки: только порция строк и уже собранные фильмы.
+    С кешем справочников (режим links) строки фильмов дополняются персонами и жанрами из кеша.
+    Чтение порций строк замеряется как extract, а в transform остаётся только сборка фильмов.
+
+    :param query: Запрос с параметром - массивом id фильмов
+    """
+    try:
+        with cursor.connection.cursor(name="film_data", binary=True) as server_cursor:
+            with measure("extract", table_name):
+                server_cursor.execute(query, (film_works_ids,))
+            if dimension_cache is not None:
+                rows = dimension_cache.film_rows(cursor, list(fetch_rows(server_cursor, table_name)))
+                with measure("transform", "film_work") as measurement:
+                    film_works = (builder or build_film_works)(rows)
+                    measurement.items = len(film_works)
+            else:
+                with measure("transform", "film_work") as measurement:
+                    film_works = (builder or build_film_works)(fetch_rows(server_cursor, table_name, measurement))
+                    measurement.items = len(film_works)
+    except psycopg.Error:
+        logging.exception(f"Ошибка при получении данных из-за изменений в {table_name}")
         raise Exception("Ошибка при получении данных из БД")
+    return film_works
+
 
-    # Собираем данные для будущего transform
+def fetch_rows(cursor, table_name: str, outer: Measurement | None = None) -> Iterator[dict]:
+    """
+    Строки серверного курсора порциями по etl_film_rows_fetch_size.
+
+    Каждая порция замеряется как extract; если строки читаются внутри другого замера
+    (outer), время чтения из него исключается.
+    """
+    while True:
+        with measure("extract", table_name) as fetch:
+            rows = cursor.fetchmany(settings.etl_film_rows_fetch_size)
+            fetch.items = len(rows)
+        if outer is not None:
+            outer.excluded += fetch.elapsed
+        if not rows:
+            return
+        yield from rows
+
+
+# Поля FilmWork, в которые попадает персона с данной ролью
+ROLE_FIELDS = {
+    "director": ("directors", "directors_names"),
+    "actor": ("actors", "actors_names"),
+    "writer": ("writers", "writers_names"),
+}
+
+
+def new_film_work(row: dict) -> FilmWork:
+    """Фильм без жанров и персон по строке запроса"""
+    return FilmWork(
+        id=str(row["fw_id"]),
+        title=row["title"],
+        description=row["description"],
+        imdb_rating=row["rating"],
+        creation_date=row["created"],
+        type=row["type"],
+        genres=[],
+        directors=[],
+        actors=[],
+        writers=[],
+        directors_names=[],
+        actors_names=[],
+        writers_names=[],
+        updated_at=row["modified"]
+    )
+
+
+def build_film_works(data: Iterable[dict]) -> dict[str, FilmWork]:
+    """Сборка фильмов из строк запроса SELECT_FILM_DATA (строка на каждую пару персона × жанр)"""
+    return {film.id: film for film in iter_film_works(data)}
+
+
+def iter_film_works(data: Iterable[dict]) -> Iterator[FilmWork]:
+    """
+    Фильмы из строк SELECT_FILM_DATA, упорядоченных по fw_id.
+
+    Фильм отдаётся, как только пришла первая строка следующего фильма, поэтому
+    строки и множество уже добавленных персон держатся только для одного фильма.
+    """
+    film = None
+    # Уже добавленные в фильм жанры и персоны: ('genre', id) и (role, id)
+    film_seen = set()
+    for film_work in data:
+        if film is None or film.id != str(film_work["fw_id"]):
+            if film is not None:
+                yield film
+            film = new_film_work(film_work)
+            film_seen = set()
+
+        genre_key = ("genre", film_work["g_id"])
+        if film_work["g_id"] and genre_key not in film_seen:
+            film_seen.add(genre_key)
+            film.genres.append(Genre(id=str(film_work["g_id"]), name=film_work["name"]))
+
+        role = film_work["role"]
+        person_key = (role, film_work["id"])
+        if film_work["full_name"] and role in ROLE_FIELDS and person_key not in film_seen:
+            film_seen.add(person_key)
+            persons_field, names_field = ROLE_FIELDS[role]
+            getattr(film, persons_field).append(Person(id=str(film_work["id"]), name=film_work["full_name"]))
+            getattr(film, names_field).append(film_work["full_name"])
+    if film is not None:
+        yield film
+
+
+def build_film_works_aggregated(data: Iterable[dict]) -> dict[str, FilmWork]:
+    """Сборка фильмов из строк запроса SELECT_FILM_DATA_AGGREGATED (одна строка на фильм)"""
     to_transform = {}
     for film_work in data:
-        film_work_id = str(film_work["fw_id"])
-        current_role = film_work["role"]
-        if film_work["full_name"]:
-            to_write_role = Person(id=str(film_work["id"]),
-                                   name=film_work["full_name"]
-                                   )
-        to_write_genre = Genre(id=str(film_work["g_id"]),
-                               name=film_work["name"]
-                               )
-        if film_work_id in to_transform:
-            for genre in to_transform[film_work_id].genres:
-                if genre.name == film_work["name"]:
-                    break
-            else:
-                to_transform[film_work_id].genres.append(to_write_genre)
-
-            if film_work["full_name"] and current_role == 'writer' and film_work["full_name"] not in to_transform[
-                film_work_id].writers_names:
-                to_transform[film_work_id].writers.append(to_write_role)
-                to_transform[film_work_id].writers_names.append(film_work["full_name"])
-            elif film_work["full_name"] and current_role == 'actor' and film_work["full_name"] not in to_transform[
-                film_work_id].actors_names:
-                to_transform[film_work_id].actors.append(to_write_role)
-                to_transform[film_work_id].actors_names.append(film_work["full_name"])
-            elif film_work["full_name"] and current_role == 'director' and film_work["full_name"] not in to_transform[
-                film_work_id].directors_names:
-                to_transform[film_work_id].directors.append(to_write_role)
-                to_transform[film_work_id].directors_names.append(film_work["full_name"])
-        else:
-            role = {"director": [], "actor": [], "writer": []}
-            role[current_role] = [to_write_role]
-
-            role_names = {"director": [], "actor": [], "writer": []}
-            role_names[current_role] = [film_work["full_name"]]
-
-            to_transform[film_work_id] = FilmWork(
-                id=film_work_id,
-                title=film_work["title"],
-                description=film_work["description"],
-                imdb_rating=film_work["rating"],
-                creation_date=film_work["created"],
-                type=film_work["type"],
-                genres=[to_write_genre],
-                directors=role["director"],
-                actors=role["actor"],
-                writers=role["writer"],
-                directors_names=role_names["director"],
-                actors_names=role_names["director"],
-                writers_names=role_names["director"],
-                updated_at=film_work["modified"]
-            )
+        film = new_film_work(film_work)
+        film.genres = [Genre(**genre) for genre in film_work["genres"]]
+        for persons_field, names_field in ROLE_FIELDS.values():
+            persons = [Person(**person) for person in film_work[persons_field]]
+            setattr(film, persons_field, persons)
+            setattr(film, names_field, [person.name for person in persons])
+        to_transform[film.id] = film
+    return to_transform
+
+
+def build_film_works_linked(data: Iterable[dict]) -> dict[str, FilmWork]:
+    """Сборка фильмов из строк DimensionCache.film_rows: персоны и жанры уже взяты из кеша"""
+    to_transform = {}
+    for film_work in data:
+        film = new_film_work(film_work)
+        film.genres = film_work["genres"]
+        for persons_field, names_field in ROLE_FIELDS.values():
+            persons = film_work[persons_field]
+            setattr(film, persons_field, persons)
+            setattr(film, names_field, [person.name for person in persons])
+        to_transform[film.id] = film
     return to_transform
+
+
+# Запрос и сборщик фильмов для каждого режима ETL_FILM_QUERY
+FILM_DATA_QUERIES = {
+    "join": (SELECT_FILM_DATA, build_film_works),
+    "aggregate": (SELECT_FILM_DATA_AGGREGATED, build_film_works_aggregated),
+    "links": (SELECT_FILMS, build_film_works_linked),
+}
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import tempfile
+import uuid
+from typing import Callable, Iterable, Iterator
+
+
+class FilmIdSet:
+    """Множество id фильмов, изменённых за цикл ETL.
+
+    Id хранятся в памяти как 16 байт UUID. Когда их становится больше spill_threshold,
+    они сбрасываются во временную базу SQLite, которая и отвечает за уникальность.
+    """
+
+    def __init__(self, spill_threshold: int) -> None:
+        self.spill_threshold = spill_threshold
+        self.added = 0
+        self._ids: set[bytes] = set()
+        self._spill_path = None
+        self._spill = None
+
+    def add(self, film_id) -> None:
+        """Добавить id фильма."""
+        self.added += 1
+        self._ids.add(uuid.UUID(str(film_id)).bytes)
+        if len(self._ids) > self.spill_threshold:
+            self._flush()
+
+    def update(self, film_ids: Iterable) -> None:
+        """Добавить несколько id фильмов."""
+        for film_id in film_ids:
+            self.add(film_id)
+
+    @property
+    def duplicates(self) -> int:
+        """Сколько добавленных id оказались повторами."""
+        return self.added - len(self)
+
+    def __len__(self) -> int:
+        if self._spill is None:
+            return len(self._ids)
+        self._flush()
+        return self._spill.execute('SELECT count(*) FROM film_ids').fetchone()[0]
+
+    def batches(self, size: int | Callable[[], int]) -> Iterator[list[str]]:
+        """
+        Уникальные id фильмов пачками по size.
+
+        :param size: Размер пачки или функция, возвращающая размер следующей пачки
+        """
+        next_size = size if callable(size) else lambda: size
+        if self._spill is None:
+            ids = list(self._ids)
+            start = 0
+            while start < len(ids):
+                end = start + next_size()
+                yield [str(uuid.UUID(bytes=film_id)) for film_id in ids[start:end]]
+                start = end
+            return
+
+        self._flush()
+        cursor = self._spill.execute('SELECT id FROM film_ids')
+        while rows := cursor.fetchmany(next_size()):
+            yield [str(uuid.UUID(bytes=row[0])) for row in rows]
+
+    def close(self) -> None:
+        """Удалить временную базу, если она создавалась."""
+        self._ids.clear()
+        if self._spill is not None:
+            self._spill.close()
+            os.unlink(self._spill_path)
+            self._spill = None
+
+    def _flush(self) -> None:
+        """Сбросить id из памяти во временную базу."""
+        if self._spill is None:
+            fd, self._spill_path = tempfile.mkstemp(prefix='etl-film-ids-', suffix='.sqlite')
+            os.close(fd)
+            self._spill = sqlite3.connect(self._spill_path)
+            self._spill.execute('PRAGMA journal_mode=OFF')
+            self._spill.execute('PRAGMA synchronous=OFF')
+            self._spill.execute('CREATE TABLE film_ids (id BLOB PRIMARY KEY) WITHOUT ROWID')
+        with self._spill:
+            self._spill.executemany('INSERT OR IGNORE INTO film_ids (id) VALUES (?)',
+                                    ((film_id,) for film_id in self._ids))
+        self._ids.clear()
@@ -0,0 +1,268 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from typing import Iterable, Iterator
+
+from psycopg import IsolationLevel, sql
+
+from dead_letters import open_dead_letters
+from dimensions import ensure_dimension_indices
+from doc_hashes import DocumentHashes, document_hash, open_document_hashes
+from elastic import ElasticConnector
+from transform import Document, serialize
+from extractor import FILM_DATA_AGGREGATED, SELECT_ALL_FILM_DATA, build_film_works_aggregated
+from loader import ElasticsearchLoader, generate_actions
+from metrics import measure
+from postgres import PostgresConnector
+from renames import open_known_names
+from state import State, get_storage
+from config.settings import settings
+
+# Отметки modified, до которых каталог будет загружен полной переиндексацией
+SELECT_WATERMARKS = """
+    SELECT
+        (SELECT max(modified) FROM content.person) as person,
+        (SELECT max(modified) FROM content.genre) as genre,
+        (SELECT max(modified) FROM content.film_work) as film_work;
+    """
+
+# Фильмы одного диапазона id для параллельной переиндексации; None - диапазон без границы
+SELECT_FILM_DATA_RANGE = FILM_DATA_AGGREGATED + """
+    WHERE (%(lower)s::uuid IS NULL OR fw.id >= %(lower)s::uuid)
+      AND (%(upper)s::uuid IS NULL OR fw.id < %(upper)s::uuid);
+    """
+# Сколько диапазонов id приходится на один процесс параллельной переиндексации
+PARTITIONS_PER_WORKER = 4
+
+logger = logging.getLogger(__name__)
+
+
+def run_full_reindex(workers: int | None = None):
+    """Полная переиндексация каталога из PostgreSQL (--full-reindex).
+
+    Если схема индекса изменилась, каталог грузится в новую версию индекса, которая
+    затем подменяет старую под алиасом. Иначе документы перезаписываются в текущей версии.
+    Так же перезагружаются индексы персон и жанров.
+
+    :param workers: Число процессов загрузки фильмов (по умолчанию etl_full_reindex_workers)
+    """
+    es_connector = ElasticConnector()
+    if not es_connector.ensure_index(partial(load_catalogue, es_connector, workers=workers)):
+        load_catalogue(es_connector, settings.elastic_index, workers)
+    ensure_dimension_indices(es_connector, reload=True)
+    es_connector.close()
+
+
+def load_catalogue(es_connector: ElasticConnector, index: str, workers: int | None = None) -> None:
+    """Загрузка всего каталога в индекс из PostgreSQL.
+
+    Фильмы читаются через серверный курсор пачками по etl_full_reindex_batch_size,
+    поэтому память не растёт с размером каталога. На время загрузки у индекса отключены
+    refresh и реплики (профиль массовой загрузки). Отметки modified берутся из того же
+    снимка REPEATABLE READ и записываются в состояние только после успешной загрузки.
+    Отправляются все документы, а хеши документов и очередь недоставленных документов
+    после загрузки заменяются целиком.
+
+    При workers > 1 снимок экспортируется через pg_export_snapshot, и каталог делится
+    на диапазоны id фильмов, которые параллельно загружают процессы (load_partition).
+    Каждый процесс импортирует тот же снимок, поэтому все диапазоны видят одно состояние базы.
+    Хеши в базу SQLite пишет только основной процесс: процессы пула отдают их файлами.
+    """
+    workers = workers or settings.etl_full_reindex_workers
+    loader = ElasticsearchLoader(es_connector)
+    state = State(get_storage(settings.state_storage, settings.state_file_path))
+    hashes = open_document_hashes()
+    dead_letters = open_dead_letters()
+
+    try:
+        hashes.discard_staged()
+        with PostgresConnector().connect() as pg_conn:
+            pg_conn.isolation_level = IsolationLevel.REPEATABLE_READ
+            with pg_conn.cursor() as cursor:
+                watermarks = cursor.execute(SELECT_WATERMARKS).fetchone()
+                seed_known_names(cursor)
+
+            if workers > 1:
+                # Снимок действует, пока открыта эта транзакция, то есть до конца загрузки
+                snapshot = pg_conn.execute("SELECT pg_export_snapshot() as snapshot").fetchone()["snapshot"]
+                with loader.bulk_profile(index):
+                    failed_ids = load_partitions(snapshot, index, workers, hashes)
+            else:
+                with pg_conn.cursor(name="full_reindex") as cursor, loader.bulk_profile(index):
+                    cursor.execute(SELECT_ALL_FILM_DATA)
+                    failed_ids = loader.bulk_load(generate_actions(stream_documents(cursor, hashes), index), index)
+                if failed_ids is None:
+                    raise Exception("Ошибка при загрузке данных в Elasticsearch")
+        hashes.publish(failed_ids)
+        dead_letters.replace(failed_ids)
+    except Exception:
+        hashes.discard_staged()
+        raise
+    finally:
+        dead_letters.close()
+        hashes.close()
+
+    for table_name, modified in watermarks.items():
+        if modified is not None:
+            state.set_state(table_name, modified.isoformat())
+            # Снимок содержит все записи с этой отметкой: id последней записи не нужен (LAST_ID)
+            state.set_state(f"{table_name}_id", None)
+            logger.info(f"Состояние {table_name} сдвинуто до {modified.isoformat()}")
+    state.checkpoint()
+    logger.info(f"Полная переиндексация {index} завершена")
+
+
+def partition_bounds(partitions: int) -> list[tuple[str | None, str | None]]:
+    """Равные диапазоны пространства UUID: [нижняя граница, верхняя граница), None - без границы."""
+    step = 2 ** 128 // partitions
+    bounds = [str(uuid.UUID(int=number * step)) for number in range(1, partitions)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def load_partitions(snapshot: str, index: str, workers: int, hashes: DocumentHashes) -> dict[str, str]:
+    """
+    Загрузка диапазонов id фильмов пулом процессов.
+
+    Диапазонов в PARTITIONS_PER_WORKER раз больше, чем процессов: процесс, которому
+    достались короткие диапазоны, берёт следующие, и загрузка не ждёт самый длинный.
+    Хеши документов каждого диапазона записываются в staging здесь, по мере готовности диапазонов.
+
+    :return: Id документов, не принятых Elasticsearch, с причиной отказа
+    """
+    failed_ids = {}
+    loaded = 0
+    context = multiprocessing.get_context("spawn")
+    # Файлы хешей диапазонов удаляются вместе с каталогом, даже если загрузка упала
+    with tempfile.TemporaryDirectory(prefix='etl-hashes-') as spool_dir, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                initargs=worker_logging()) as pool:
+        futures = [pool.submit(load_partition, snapshot, index, lower, upper, spool_dir)
+                   for lower, upper in partition_bounds(workers * PARTITIONS_PER_WORKER)]
+        try:
+            for future in as_completed(futures):
+                partition_loaded, partition_failed, spool_path = future.result()
+                hashes.stage_hashes(read_hash_spool(spool_path))
+                os.unlink(spool_path)
+                loaded += partition_loaded
+                failed_ids.update(partition_failed)
+                logger.info(f"Полная переиндексация: загружено фильмов {loaded}")
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return failed_ids
+
+
+def load_partition(snapshot: str, index: str, lower: str | None, upper: str | None,
+                   spool_dir: str) -> tuple[int, dict[str, str], str]:
+    """
+    Загрузка одного диапазона id фильмов в процессе пула.
+
+    Процесс открывает свои соединения с PostgreSQL и Elasticsearch и импортирует снимок
+    (SET TRANSACTION SNAPSHOT - первый запрос транзакции). Хеши документов он не пишет
+    в базу SQLite, а складывает в файл каталога spool_dir (HashSpool), который разбирает основной процесс.
+
+    :return: Число загруженных фильмов, id документов, не принятых Elasticsearch, с причиной отказа
+        и путь к файлу хешей
+    """
+    es_connector = ElasticConnector()
+    loader = ElasticsearchLoader(es_connector)
+    spool = HashSpool(spool_dir)
+    loaded = 0
+
+    def counted(documents: Iterator[Document]) -> Iterator[Document]:
+        nonlocal loaded
+        for document in documents:
+            loaded += 1
+            yield document
+
+    try:
+        with PostgresConnector().connect() as pg_conn:
+            pg_conn.isolation_level = IsolationLevel.REPEATABLE_READ
+            with pg_conn.cursor() as cursor:
+                # SET не принимает параметры, id снимка подставляется в текст запроса
+                cursor.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(snapshot))
+            with pg_conn.cursor(name="full_reindex_partition") as cursor:
+                cursor.execute(SELECT_FILM_DATA_RANGE, {"lower": lower, "upper": upper})
+                documents = counted(stream_documents(cursor, spool))
+                failed_ids = loader.bulk_load(generate_actions(documents, index), index)
+                if failed_ids is None:
+                    raise Exception(f"Ошибка при загрузке диапазона {lower}..{upper} в Elasticsearch")
+        return loaded, failed_ids, spool.path
+    finally:
+        spool.close()
+        es_connector.close()
+
+
+class HashSpool:
+    """Хеши документов диапазона во временном файле: строка "id<TAB>хеш в hex" на документ.
+
+    Заменяет DocumentHashes в stream_documents процесса пула.
+    """
+
+    def __init__(self, directory: str) -> None:
+        fd, self.path = tempfile.mkstemp(suffix='.tsv', dir=directory)
+        self.file = os.fdopen(fd, "w", encoding="ascii")
+
+    def stage(self, documents: Iterable[Document]) -> None:
+        self.file.writelines(f"{document.id}\t{document_hash(document.source).hex()}\n"
+                             for document in documents if document.source is not None)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_hash_spool(path: str) -> Iterator[tuple[str, bytes]]:
+    """Пары (id, хеш) из файла HashSpool."""
+    with open(path, encoding="ascii") as file:
+        for line in file:
+            document_id, hash_hex = line.rstrip("\n").split("\t")
+            yield document_id, bytes.fromhex(hash_hex)
+
+
+def worker_logging() -> tuple[int, str | None, str | None]:
+    """Уровень, файл и формат логов основного процесса для процессов пула."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, logging.FileHandler):
+            return root.level, handler.baseFilename, handler.formatter._fmt if handler.formatter else None
+    return root.level, None, None
+
+
+def init_worker(level: int, filename: str | None, log_format: str | None) -> None:
+    """Настройка логов процесса пула так же, как в основном процессе."""
+    logging.basicConfig(level=level, filename=filename, filemode="a", format=log_format)
+
+
+def seed_known_names(cursor) -> None:
+    """Запомнить имена персон и жанров из того же снимка, что и загружаемый каталог."""
+    known_names = open_known_names()
+    if known_names is None:
+        return
+    try:
+        known_names.seed(cursor)
+    finally:
+        known_names.close()
+
+
+def stream_documents(cursor, hashes: DocumentHashes | HashSpool | None = None) -> Iterator[Document]:
+    """Документы фильмов из серверного курсора, пачка за пачкой; хеши накапливаются через stage."""
+    loaded = 0
+    while True:
+        with measure("extract", "film_work") as measurement:
+            rows = cursor.fetchmany(settings.etl_full_reindex_batch_size)
+            measurement.items = len(rows)
+        if not rows:
+            break
+        with measure("transform", "film_work") as measurement:
+            documents = serialize(build_film_works_aggregated(rows))
+            measurement.items = len(documents)
+        if hashes is not None:
+            hashes.stage(documents)
+        yield from documents
+        loaded += len(rows)
+        logger.info(f"Полная переиндексация: обработано фильмов {loaded}")
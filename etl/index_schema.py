@@ -0,0 +1,205 @@
+import hashlib
+import json
+
+# Анализатор ru_en для полнотекстового поиска на русском и английском
+ANALYSIS = {
+    "filter": {
+        "english_stop": {
+            "type": "stop",
+            "stopwords": "_english_"
+        },
+        "english_stemmer": {
+            "type": "stemmer",
+            "language": "english"
+        },
+        "english_possessive_stemmer": {
+            "type": "stemmer",
+            "language": "possessive_english"
+        },
+        "russian_stop": {
+            "type": "stop",
+            "stopwords": "_russian_"
+        },
+        "russian_stemmer": {
+            "type": "stemmer",
+            "language": "russian"
+        }
+    },
+    "analyzer": {
+        "ru_en": {
+            "tokenizer": "standard",
+            "filter": [
+                "lowercase",
+                "english_stop",
+                "english_stemmer",
+                "english_possessive_stemmer",
+                "russian_stop",
+                "russian_stemmer"
+            ]
+        }
+    }
+}
+
+INDEX_SETTINGS = {
+    "refresh_interval": "1s",
+    "analysis": ANALYSIS,
+}
+
+MOVIES_MAPPINGS = {
+    "dynamic": "strict",
+    "properties": {
+        "id": {
+            "type": "keyword"
+        },
+        "imdb_rating": {
+            "type": "float"
+        },
+        "genres": {
+            "type": "keyword"
+        },
+        "title": {
+            "type": "text",
+            "analyzer": "ru_en",
+            "fields": {
+                "raw": {
+                    "type": "keyword"
+                }
+            }
+        },
+        "description": {
+            "type": "text",
+            "analyzer": "ru_en"
+        },
+        "directors_names": {
+            "type": "text",
+            "analyzer": "ru_en"
+        },
+        "actors_names": {
+            "type": "text",
+            "analyzer": "ru_en"
+        },
+        "writers_names": {
+            "type": "text",
+            "analyzer": "ru_en"
+        },
+        "directors": {
+            "type": "nested",
+            "dynamic": "strict",
+            "properties": {
+                "id": {
+                    "type": "keyword"
+                },
+                "name": {
+                    "type": "text",
+                    "analyzer": "ru_en"
+                }
+            }
+        },
+        "actors": {
+            "type": "nested",
+            "dynamic": "strict",
+            "properties": {
+                "id": {
+                    "type": "keyword"
+                },
+                "name": {
+                    "type": "text",
+                    "analyzer": "ru_en"
+                }
+            }
+        },
+        "writers": {
+            "type": "nested",
+            "dynamic": "strict",
+            "properties": {
+                "id": {
+                    "type": "keyword"
+                },
+                "name": {
+                    "type": "text",
+                    "analyzer": "ru_en"
+                }
+            }
+        }
+    }
+}
+
+MOVIES_SCHEMA = {
+    "settings": INDEX_SETTINGS,
+    "mappings": MOVIES_MAPPINGS,
+}
+
+# Персоны с id фильмов по каждой роли: фильмы персоны читаются одним документом
+PERSONS_MAPPINGS = {
+    "dynamic": "strict",
+    "properties": {
+        "id": {
+            "type": "keyword"
+        },
+        "full_name": {
+            "type": "text",
+            "analyzer": "ru_en",
+            "fields": {
+                "raw": {
+                    "type": "keyword"
+                }
+            }
+        },
+        "director_film_ids": {
+            "type": "keyword"
+        },
+        "actor_film_ids": {
+            "type": "keyword"
+        },
+        "writer_film_ids": {
+            "type": "keyword"
+        }
+    }
+}
+
+PERSONS_SCHEMA = {
+    "settings": INDEX_SETTINGS,
+    "mappings": PERSONS_MAPPINGS,
+}
+
+GENRES_MAPPINGS = {
+    "dynamic": "strict",
+    "properties": {
+        "id": {
+            "type": "keyword"
+        },
+        "name": {
+            "type": "text",
+            "analyzer": "ru_en",
+            "fields": {
+                "raw": {
+                    "type": "keyword"
+                }
+            }
+        },
+        "description": {
+            "type": "text",
+            "analyzer": "ru_en"
+        }
+    }
+}
+
+GENRES_SCHEMA = {
+    "settings": INDEX_SETTINGS,
+    "mappings": GENRES_MAPPINGS,
+}
+
+
+def schema_hash(part: dict) -> str:
+    """Стабильный хеш части схемы индекса."""
+    return hashlib.sha256(json.dumps(part, sort_keys=True).encode()).hexdigest()
+
+
+def versioned_name(alias: str, schema: dict) -> str:
+    """Имя версии индекса: алиас и хеш всей схемы, например movies_1a2b3c4d."""
+    return f"{alias}_{schema_hash(schema)[:8]}"
+
+
+def schema_meta(schema: dict) -> dict:
+    """_meta маппинга версии: по mapping_hash видно, можно ли переиндексировать через _reindex."""
+    return {"schema_hash": schema_hash(schema), "mapping_hash": schema_hash(schema["mappings"])}
@@ -0,0 +1,78 @@
+import logging
+import time
+
+import psycopg
+from psycopg import connect
+
+from backoff_self.backoff import backoff
+from config.settings import settings
+
+# Канал, в который триггеры миграции 0005_etl_notify шлют имена изменённых таблиц
+CHANNEL = 'etl_changes'
+
+
+class ChangeListener:
+    """Ожидание изменений в схеме content через LISTEN/NOTIFY.
+
+    Держит отдельное соединение в режиме autocommit, поэтому уведомления, пришедшие
+    во время цикла ETL, не теряются и будят следующий цикл сразу после текущего.
+    """
+
+    def __init__(self):
+        self.dsl = settings.postgres_dsl
+        self.poll_interval = settings.etl_poll_interval
+        self.debounce = settings.etl_debounce
+        self.max_delay = settings.etl_max_delay
+        self.conn = None
+        self.logger = logging.getLogger(__name__)
+
+    @backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+    def _listen(self):
+        """Соединение с подпиской на канал с повторными попытками"""
+        self.conn = connect(**self.dsl, autocommit=True)
+        self.conn.execute(f"LISTEN {CHANNEL}")
+        self.logger.info(f"Подписка на {CHANNEL} установлена")
+        return self.conn
+
+    def close(self) -> None:
+        """Закрыть соединение с подпиской."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def wait_for_changes(self) -> set[str]:
+        """
+        Ждать изменений не дольше etl_poll_interval.
+
+        После первого уведомления продолжает собирать следующие, пока они приходят чаще,
+        чем раз в etl_debounce секунд, но не дольше etl_max_delay.
+
+        :return: Имена изменённых таблиц; пустое множество, если сработал таймер
+        """
+        try:
+            if self.conn is None:
+                self._listen()
+
+            tables = self._receive(self.poll_interval)
+            if not tables:
+                self.logger.info("Уведомлений не было, запуск по таймеру")
+                return tables
+
+            deadline = time.monotonic() + self.max_delay
+            while (remaining := deadline - time.monotonic()) > 0:
+                burst = self._receive(min(self.debounce, remaining))
+                if not burst:
+                    break
+                tables |= burst
+
+            self.logger.info(f"Изменения в таблицах: {', '.join(sorted(tables))}")
+            return tables
+        except psycopg.OperationalError:
+            self.logger.exception(f"Потеряно соединение с подпиской на {CHANNEL}")
+            self.close()
+            time.sleep(self.debounce)
+            return set()
+
+    def _receive(self, timeout: float) -> set[str]:
+        """Уведомления, пришедшие за timeout секунд (до первого)."""
+        return {notify.payload for notify in self.conn.notifies(timeout=timeout, stop_after=1)}
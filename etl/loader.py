@@ -1,9 +1,91 @@
+import asyncio
 import logging
+import queue
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from itertools import islice
 
-from elasticsearch import helpers
-from typing import Iterator
+from elasticsearch import ApiError, helpers
+from typing import AsyncIterator, Iterable, Iterator
 
-from backoff_self.backoff import backoff
+from adaptive import batch_size, parse_retry_after
+from backoff_self.backoff import backoff, async_backoff
+from elastic import REINDEX_POLL_INTERVAL, wait_for_task
+from metrics import BULK_ERRORS, measure
+from renames import Renames
+from config.settings import settings
+from transform import Document
+
+# Настройки индекса на время массовой загрузки
+BULK_PROFILE_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+# Признак конца очереди документов bulk-потока
+STOP = object()
+# Сколько раз повторять документы, отклонённые Elasticsearch с кодом 429
+MAX_REJECTED_RETRIES = 5
+# Статусы, которые повторяет сам клиент; 429 на bulk-запросы повторяет загрузчик с учётом Retry-After
+BULK_RETRY_ON_STATUS = (502, 503, 504)
+
+
+def lane_for(action: dict, workers: int) -> int:
+    """
+    Номер bulk-потока для действия.
+
+    Поток выбирается по _id, поэтому все изменения одного документа идут через один поток
+    и применяются в том порядке, в котором пришли.
+    """
+    return zlib.crc32(str(action["_id"]).encode()) % workers
+
+
+def bulk_options(refresh: bool, chunk_size: int) -> dict:
+    """
+    Параметры streaming_bulk для одной пачки: границы bulk-запроса по документам и по байтам.
+    Повторы при 429 streaming_bulk не делает, их ведёт загрузчик вместе с подстройкой размера пачки.
+    """
+    return {
+        "raise_on_error": False,
+        "max_retries": 0,
+        "chunk_size": chunk_size,
+        "max_chunk_bytes": settings.elastic_max_chunk_bytes,
+        "refresh": refresh,
+    }
+
+
+def retry_after(error: ApiError) -> float | None:
+    """Пауза из заголовка Retry-After ответа 429."""
+    return parse_retry_after(error.meta.headers.get("retry-after"))
+
+
+async def as_async(actions: Iterable[dict] | AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Обычный или асинхронный итератор действий как асинхронный."""
+    if hasattr(actions, "__aiter__"):
+        async for action in actions:
+            yield action
+    else:
+        for action in actions:
+            yield action
+
+
+def split_rejected(chunk: list[dict], results: list[tuple[bool, dict]], retry: bool, logger,
+                   failed_ids: dict[str, str]) -> list[dict]:
+    """
+    Разобрать ответы на пачку: ошибки документов записываются в лог и в failed_ids
+    вместе с причиной, а отклонённые с кодом 429 возвращаются для повтора, если retry.
+    """
+    rejected = []
+    for action, (ok, item) in zip(chunk, results):
+        if ok:
+            continue
+        result = next(iter(item.values()))
+        status = result.get("status")
+        if retry and status == 429:
+            rejected.append(action)
+        else:
+            logger.error(f"Добавление прервано. Не внесён элемент: {item}")
+            failed_ids[action["_id"]] = str(result.get("error") or f"status {status}")
+            BULK_ERRORS.inc(index=action.get("_index", ""), status=str(status))
+    return rejected
 
 
 class ElasticsearchLoader:
@@ -12,47 +94,347 @@ class ElasticsearchLoader:
         self.logger = logging.getLogger(__name__)
 
     @backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
-    def bulk_load(self, actions: Iterator[dict], index: str) -> bool:
+    def bulk_load(self, actions: Iterator[dict], index: str, refresh: bool = False) -> dict[str, str] | None:
         """
         Массовая загрузка данных в Elasticsearch с обработкой ошибок
 
         :param actions: Итератор действий для bulk-запроса
         :param index: Название индекса
+        :param refresh: Обновлять индекс после каждого bulk-запроса
+        :return: Id документов, не принятых Elasticsearch, с причиной отказа; None, если загрузка прервана
+        """
+        failed_ids = {}
+        try:
+            with self.es.connect() as es_client:
+                if settings.elastic_bulk_workers == 1:
+                    self._stream(es_client, actions, index, refresh, failed_ids)
+                else:
+                    self._stream_parallel(es_client, actions, index, refresh, settings.elastic_bulk_workers,
+                                          failed_ids)
+
+            return failed_ids
+        except Exception:
+            self.logger.exception("Ошибка при bulk-загрузке")
+            return None
+
+    def _stream(self, es_client, actions: Iterable[dict], index: str, refresh: bool,
+                failed_ids: dict[str, str]) -> None:
+        """Последовательная загрузка пачками текущего размера batch_size: один bulk-запрос в полёте."""
+        actions = iter(actions)
+        while chunk := list(islice(actions, batch_size.size)):
+            self._send_chunk(es_client, chunk, index, refresh, failed_ids)
+
+    def _send_chunk(self, es_client, chunk: list[dict], index: str, refresh: bool,
+                    failed_ids: dict[str, str]) -> None:
+        """Отправить пачку, повторяя отклонённое с кодом 429 после паузы и уменьшения пачки."""
+        with measure("load", index) as measurement:
+            measurement.items = len(chunk)
+            self._send_with_retries(es_client, chunk, index, refresh, failed_ids)
+
+    def _send_with_retries(self, es_client, chunk: list[dict], index: str, refresh: bool,
+                           failed_ids: dict[str, str]) -> None:
+        for attempt in range(MAX_REJECTED_RETRIES + 1):
+            retry = attempt < MAX_REJECTED_RETRIES
+            started = time.monotonic()
+            try:
+                results = list(helpers.streaming_bulk(es_client.options(retry_on_status=BULK_RETRY_ON_STATUS),
+                                                      chunk, index=index, **bulk_options(refresh, len(chunk))))
+            except ApiError as error:
+                if error.meta.status != 429 or not retry:
+                    raise
+                time.sleep(batch_size.reject(retry_after(error)))
+                continue
+
+            batch_size.observe(time.monotonic() - started)
+            chunk = split_rejected(chunk, results, retry, self.logger, failed_ids)
+            if not chunk:
+                return
+            time.sleep(batch_size.reject())
+
+    def _stream_parallel(self, es_client, actions: Iterator[dict], index: str, refresh: bool,
+                         workers: int, failed_ids: dict[str, str]) -> None:
+        """
+        Параллельная загрузка: действия раскладываются по workers потокам по _id,
+        каждый поток ведёт свой streaming_bulk, так что в полёте до workers bulk-запросов.
+        Отказы каждый поток собирает отдельно, в failed_ids они сводятся после завершения потоков.
+        """
+        lanes = [queue.Queue(maxsize=settings.elastic_chunk_size) for _ in range(workers)]
+        lanes_failed_ids = [{} for _ in range(workers)]
+        errors = []
+
+        def run_lane(lane: queue.Queue, lane_failed_ids: dict[str, str]) -> None:
+            drained = False
+
+            def lane_actions() -> Iterator[dict]:
+                nonlocal drained
+                while (action := lane.get()) is not STOP:
+                    yield action
+                drained = True
+
+            try:
+                self._stream(es_client, lane_actions(), index, refresh, lane_failed_ids)
+            except Exception as error:
+                errors.append(error)
+                # Разбираем очередь до конца, чтобы не заблокировать раскладку действий
+                while not drained and lane.get() is not STOP:
+                    pass
+
+        threads = [threading.Thread(target=run_lane, args=(lane, lane_failed_ids), name=f"bulk-lane-{number}")
+                   for number, (lane, lane_failed_ids) in enumerate(zip(lanes, lanes_failed_ids))]
+        for thread in threads:
+            thread.start()
+        try:
+            for action in actions:
+                lanes[lane_for(action, workers)].put(action)
+        finally:
+            for lane in lanes:
+                lane.put(STOP)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        for lane_failed_ids in lanes_failed_ids:
+            failed_ids.update(lane_failed_ids)
+
+    def refresh(self, index: str) -> None:
+        """Сделать загруженные документы видимыми для поиска."""
+        with self.es.connect() as es_client:
+            es_client.indices.refresh(index=index)
+
+    @backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+    def apply_renames(self, renames: Renames, index: str) -> bool:
+        """
+        Переименования персон и жанров в документах индекса через update_by_query.
+
+        Меняются только вложенные персоны, массивы *_names и genres, документы целиком
+        из PostgreSQL не перечитываются. Конфликт версий прерывает задачу, и она повторяется.
+
         :return: Статус выполнения (True - успех, False - есть ошибки)
         """
         try:
             with self.es.connect() as es_client:
-                for ok, item in helpers.streaming_bulk(
-                        es_client,
-                        actions,
-                        index=index,
-                        raise_on_error=False,
-                        max_retries=2,
-                        initial_backoff=1,
-                        chunk_size=500,
-                        refresh=True
-                ):
-                    if not ok:
-                        self.logger.error(f"Добавление прервано. Не внесён элемент: {item}")
+                for request in renames.requests():
+                    task = es_client.update_by_query(index=index, wait_for_completion=False, slices="auto",
+                                                     **request)
+                    status = wait_for_task(es_client, task["task"])
+                    log_update_by_query(self.logger, status)
 
             return True
+        except Exception:
+            self.logger.exception("Ошибка при частичном обновлении документов")
+            return False
+
+    @contextmanager
+    def bulk_profile(self, index: str):
+        """
+        Профиль массовой загрузки: на время блока у индекса отключаются refresh и реплики.
+
+        Исходные настройки сохраняются в _meta маппинга индекса и возвращаются при выходе
+        из блока, в том числе при ошибке. Если прошлая загрузка была прервана, не успев их
+        вернуть, они восстанавливаются при следующем вызове restore_settings или bulk_profile.
+        """
+        original = self.restore_settings(index)
+        with self.es.connect() as es_client:
+            self._put_meta(es_client, index, original)
+            es_client.indices.put_settings(index=index, settings=BULK_PROFILE_SETTINGS)
+        self.logger.info(f"Индекс {index} переведён в профиль массовой загрузки, исходные настройки: {original}")
+        try:
+            yield
+        finally:
+            self.restore_settings(index)
+
+    def restore_settings(self, index: str) -> dict:
+        """
+        Вернуть настройки индекса, сохранённые bulk_profile, и обновить индекс.
+
+        :return: Текущие (восстановленные) значения настроек из BULK_PROFILE_SETTINGS
+        """
+        with self.es.connect() as es_client:
+            saved = self._get_meta(es_client, index)
+            if saved is None:
+                return self._get_settings(es_client, index)
+
+            es_client.indices.put_settings(index=index, settings=saved)
+            es_client.indices.refresh(index=index)
+            self._put_meta(es_client, index, None)
+        self.logger.info(f"Настройки индекса {index} восстановлены: {saved}")
+        return saved
+
+    @staticmethod
+    def _get_settings(es_client, index: str) -> dict:
+        """Текущие значения настроек, которые меняет профиль массовой загрузки."""
+        response = es_client.indices.get_settings(index=index, name=list(BULK_PROFILE_SETTINGS),
+                                                  flat_settings=True, include_defaults=True)
+        index_settings = next(iter(response.values()))
+        values = {**index_settings.get("defaults", {}), **index_settings["settings"]}
+        return {name: values[name] for name in BULK_PROFILE_SETTINGS}
+
+    @staticmethod
+    def _get_meta(es_client, index: str) -> dict | None:
+        """Настройки, сохранённые профилем массовой загрузки в _meta маппинга."""
+        response = es_client.indices.get_mapping(index=index)
+        mapping = next(iter(response.values()))["mappings"]
+        return mapping.get("_meta", {}).get("bulk_profile")
+
+    @staticmethod
+    def _put_meta(es_client, index: str, saved: dict | None) -> None:
+        """Сохранить (или убрать при None) исходные настройки в _meta маппинга."""
+        response = es_client.indices.get_mapping(index=index)
+        meta = dict(next(iter(response.values()))["mappings"].get("_meta", {}))
+        if saved is None:
+            meta.pop("bulk_profile", None)
+        else:
+            meta["bulk_profile"] = saved
+        es_client.indices.put_mapping(index=index, meta=meta)
+
+
+class AsyncElasticsearchLoader:
+    def __init__(self, es_client):
+        self.es_client = es_client
+        self.logger = logging.getLogger(__name__)
+
+    @async_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+    async def bulk_load(self, actions: Iterator[dict], index: str, refresh: bool = False) -> dict[str, str] | None:
+        """
+        Асинхронная массовая загрузка данных в Elasticsearch с обработкой ошибок
+
+        :param actions: Итератор действий для bulk-запроса
+        :param index: Название индекса
+        :param refresh: Обновлять индекс после каждого bulk-запроса
+        :return: Id документов, не принятых Elasticsearch, с причиной отказа; None, если загрузка прервана
+        """
+        failed_ids = {}
+        try:
+            if settings.elastic_bulk_workers == 1:
+                await self._stream(actions, index, refresh, failed_ids)
+            else:
+                await self._stream_parallel(actions, index, refresh, settings.elastic_bulk_workers, failed_ids)
+
+            return failed_ids
         except Exception:
             self.logger.exception("Ошибка при bulk-загрузке")
+            return None
+
+    async def _stream(self, actions: Iterable[dict] | AsyncIterator[dict], index: str, refresh: bool,
+                      failed_ids: dict[str, str]) -> None:
+        """Последовательная загрузка пачками текущего размера batch_size: один bulk-запрос в полёте."""
+        chunk = []
+        async for action in as_async(actions):
+            chunk.append(action)
+            if len(chunk) >= batch_size.size:
+                await self._send_chunk(chunk, index, refresh, failed_ids)
+                chunk = []
+        if chunk:
+            await self._send_chunk(chunk, index, refresh, failed_ids)
+
+    async def _send_chunk(self, chunk: list[dict], index: str, refresh: bool, failed_ids: dict[str, str]) -> None:
+        """Отправить пачку, повторяя отклонённое с кодом 429 после паузы и уменьшения пачки."""
+        with measure("load", index) as measurement:
+            measurement.items = len(chunk)
+            await self._send_with_retries(chunk, index, refresh, failed_ids)
+
+    async def _send_with_retries(self, chunk: list[dict], index: str, refresh: bool,
+                                 failed_ids: dict[str, str]) -> None:
+        for attempt in range(MAX_REJECTED_RETRIES + 1):
+            retry = attempt < MAX_REJECTED_RETRIES
+            started = time.monotonic()
+            try:
+                results = [result async for result in helpers.async_streaming_bulk(
+                    self.es_client.options(retry_on_status=BULK_RETRY_ON_STATUS),
+                    chunk, index=index, **bulk_options(refresh, len(chunk)))]
+            except ApiError as error:
+                if error.meta.status != 429 or not retry:
+                    raise
+                await asyncio.sleep(batch_size.reject(retry_after(error)))
+                continue
+
+            batch_size.observe(time.monotonic() - started)
+            chunk = split_rejected(chunk, results, retry, self.logger, failed_ids)
+            if not chunk:
+                return
+            await asyncio.sleep(batch_size.reject())
+
+    async def _stream_parallel(self, actions: Iterable[dict], index: str, refresh: bool, workers: int,
+                               failed_ids: dict[str, str]) -> None:
+        """Параллельная загрузка: действия раскладываются по workers задачам по _id."""
+        lanes = [asyncio.Queue(maxsize=settings.elastic_chunk_size) for _ in range(workers)]
+
+        async def run_lane(lane: asyncio.Queue) -> None:
+            drained = False
+
+            async def lane_actions() -> AsyncIterator[dict]:
+                nonlocal drained
+                while (action := await lane.get()) is not STOP:
+                    yield action
+                drained = True
+
+            try:
+                await self._stream(lane_actions(), index, refresh, failed_ids)
+            except Exception:
+                # Разбираем очередь до конца, чтобы не заблокировать раскладку действий
+                while not drained and await lane.get() is not STOP:
+                    pass
+                raise
+
+        tasks = [asyncio.create_task(run_lane(lane)) for lane in lanes]
+        try:
+            for action in actions:
+                await lanes[lane_for(action, workers)].put(action)
+        finally:
+            for lane in lanes:
+                await lane.put(STOP)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def refresh(self, index: str) -> None:
+        """Сделать загруженные документы видимыми для поиска."""
+        await self.es_client.indices.refresh(index=index)
+
+    @async_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+    async def apply_renames(self, renames: Renames, index: str) -> bool:
+        """Асинхронный вариант ElasticsearchLoader.apply_renames."""
+        try:
+            for request in renames.requests():
+                task = await self.es_client.update_by_query(index=index, wait_for_completion=False, slices="auto",
+                                                            **request)
+                while not (status := await self.es_client.tasks.get(task_id=task["task"]))["completed"]:
+                    await asyncio.sleep(REINDEX_POLL_INTERVAL)
+                log_update_by_query(self.logger, status)
+
+            return True
+        except Exception:
+            self.logger.exception("Ошибка при частичном обновлении документов")
             return False
 
 
-def generate_actions(film_data: list[dict], index: str) -> Iterator[dict]:
+def log_update_by_query(logger, status: dict) -> None:
+    """Итог задачи update_by_query; ошибки в документах превращаются в исключение."""
+    response = status.get("response", {})
+    failures = status.get("error") or response.get("failures")
+    if failures:
+        raise Exception(f"Ошибка в update_by_query: {failures}")
+    logger.info(f"Частично обновлено документов: {response.get('updated')}")
+
+
+def generate_actions(documents: Iterable[Document], index: str) -> Iterator[dict]:
     """
     Генератор действий для bulk-запроса
 
     :param index: Название индекса
-    :param film_data: Список словарей с данными фильмов
+    :param documents: Документы с _source в виде JSON-байтов; без _source - удаление
     :yield: Действия для Elasticsearch в формате bulk API
     """
-    for film in film_data:
+    for document in documents:
+        if document.source is None:
+            yield {"_op_type": "delete", "_index": index, "_id": document.id}
+            continue
         yield {
             "_op_type": "index",  # или "update" для обновления
             "_index": index,
-            "_id": film["id"],
-            "_source": film
+            "_id": document.id,
+            "_source": document.source
         }
@@ -1,12 +1,45 @@
+import argparse
+import asyncio
 import logging
 import os.path
 
+from async_etl import run_etl_async
+from doc_hashes import run_rebuild_hashes
 from etl import run_etl
+from full_reindex import run_full_reindex
+from metrics import start_metrics_server
+from sinks import run_export_bulk, run_replay_bulk
+from config.settings import settings
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Перенос фильмов из PostgreSQL в Elasticsearch")
+    parser.add_argument("--full-reindex", action="store_true",
+                        help="загрузить весь каталог одним проходом и выйти")
+    parser.add_argument("--workers", type=int,
+                        help="число процессов полной переиндексации (по умолчанию ETL_FULL_REINDEX_WORKERS)")
+    parser.add_argument("--rebuild-hashes", action="store_true",
+                        help="пересобрать хеши загруженных документов по индексу Elasticsearch и выйти")
+    parser.add_argument("--export-bulk", metavar="DIR",
+                        help="выгрузить весь каталог из PostgreSQL в файлы _bulk в каталоге DIR и выйти")
+    parser.add_argument("--replay-bulk", metavar="DIR",
+                        help="загрузить в Elasticsearch файлы _bulk из каталога DIR без обращения к PostgreSQL и выйти")
+    args = parser.parse_args()
+
     if not os.path.isdir("logs"):
         os.mkdir("logs")
-    logging.basicConfig(level=logging.INFO, filename="logs/etl.log", filemode="w",
+    logging.basicConfig(level=logging.INFO, filename="logs/etl.log", filemode="a",
                         format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    start_metrics_server()
 
-    run_etl()
+    if args.full_reindex:
+        run_full_reindex(args.workers)
+    elif args.rebuild_hashes:
+        run_rebuild_hashes()
+    elif args.export_bulk:
+        run_export_bulk(args.export_bulk)
+    elif args.replay_bulk:
+        run_replay_bulk(args.replay_bulk)
+    elif settings.etl_async:
+        asyncio.run(run_etl_async())
+    else:
+        run_etl()
@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+from adaptive import batch_size
+from dead_letters import dead_letters_depth
+from state import get_storage
+from config.settings import settings
+
+# Границы корзин гистограммы длительности стадий, секунд
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """Метрика в текстовом формате Prometheus: значения по наборам меток."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(labels)} {value:g}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels: str) -> None:
+        """Значение счётчика, который ведёт сам источник (только растёт, сбрасывается с перезапуском)."""
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        # метки -> (счётчики по корзинам, сумма, число наблюдений)
+        self._series: dict[tuple[tuple[str, str], ...], tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self._series[key] = (counts, total + value, count + 1)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}"
+            yield f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}"
+            yield f"{self.name}_sum{format_labels(labels)} {total:g}"
+            yield f"{self.name}_count{format_labels(labels)} {count}"
+
+
+class Registry:
+    """Метрики процесса и функции, которые снимают значения в момент запроса."""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Ошибка при сборе метрик")
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "etl_stage_duration_seconds", "Длительность стадии ETL (extract, transform, load) на пачку"))
+STAGE_ITEMS = registry.register(Counter(
+    "etl_stage_items_total", "Строки (extract) и документы (transform, load), прошедшие стадию"))
+STAGE_THROUGHPUT = registry.register(Gauge(
+    "etl_stage_items_per_second", "Скорость стадии на последней пачке, строк или документов в секунду"))
+BULK_ERRORS = registry.register(Counter(
+    "etl_bulk_errors_total", "Документы, не принятые Elasticsearch, по индексу и статусу"))
+BACKOFF_RETRIES = registry.register(Counter(
+    "etl_backoff_retries_total", "Повторы вызовов после ошибки в backoff"))
+WATERMARK_LAG = registry.register(Gauge(
+    "etl_watermark_lag_seconds", "Отставание сохранённой отметки modified от текущего времени"))
+DEAD_LETTERS = registry.register(Gauge(
+    "etl_dead_letters", "Документы в очереди недоставленных: pending - ещё повторяются, exhausted - попытки исчерпаны"))
+# Показатели AIMD-контроллера размера пачки (AimdController.metrics)
+BATCH_SIZE_GAUGES = {
+    "size": registry.register(Gauge("etl_batch_size", "Текущий размер пачки")),
+    "last_latency_seconds": registry.register(Gauge(
+        "etl_bulk_last_latency_seconds", "Задержка последнего успешного bulk-запроса")),
+}
+BATCH_SIZE_COUNTERS = {
+    "increases": registry.register(Counter(
+        "etl_batch_size_increases_total", "Сколько раз размер пачки увеличивался")),
+    "decreases": registry.register(Counter(
+        "etl_batch_size_decreases_total", "Сколько раз размер пачки уменьшался")),
+    "rejections": registry.register(Counter("etl_bulk_rejections_total", "Отказы Elasticsearch с кодом 429")),
+}
+
+
+class Measurement:
+    """Число обработанных за замер строк или документов.
+
+    excluded - секунды внутри замера, которые уже учтены другой стадией (например, чтение
+    строк из PostgreSQL по ходу сборки фильмов); elapsed - длительность замера без них.
+    """
+    __slots__ = ("items", "excluded", "elapsed")
+
+    def __init__(self):
+        self.items = 0
+        self.excluded = 0.0
+        self.elapsed = 0.0
+
+
+@contextmanager
+def measure(stage: str, table: str):
+    """
+    Замерить стадию ETL на одной пачке: длительность и число строк или документов.
+
+    Замер, прерванный исключением, не учитывается.
+    """
+    measurement = Measurement()
+    started = time.perf_counter()
+    yield measurement
+    elapsed = measurement.elapsed = time.perf_counter() - started - measurement.excluded
+    STAGE_SECONDS.observe(elapsed, stage=stage, table=table)
+    STAGE_ITEMS.inc(measurement.items, stage=stage, table=table)
+    if elapsed > 0 and measurement.items:
+        STAGE_THROUGHPUT.set(measurement.items / elapsed, stage=stage, table=table)
+
+
+def collect_watermarks() -> None:
+    """Отставание отметок modified из хранилища состояния."""
+    now = datetime.now(timezone.utc)
+    for table_name, value in get_storage(settings.state_storage, settings.state_file_path).retrieve_state().items():
+        if table_name.startswith("temporary_") or table_name.endswith("_id") or not isinstance(value, str):
+            continue
+        try:
+            modified = datetime.fromisoformat(value)
+        except ValueError:
+            continue
+        if modified.tzinfo is None:
+            modified = modified.replace(tzinfo=timezone.utc)
+        WATERMARK_LAG.set((now - modified).total_seconds(), table=table_name)
+
+
+def collect_batch_size() -> None:
+    """Показатели общего размера пачки (adaptive.batch_size)."""
+    for name, value in batch_size.metrics().items():
+        if name in BATCH_SIZE_COUNTERS:
+            BATCH_SIZE_COUNTERS[name].set_total(value, controller=batch_size.name)
+        else:
+            BATCH_SIZE_GAUGES[name].set(value, controller=batch_size.name)
+
+
+def collect_dead_letters() -> None:
+    """Размер очереди недоставленных документов."""
+    depth = dead_letters_depth()
+    # Опустевшая очередь должна показывать 0, а не последнее значение
+    for state in ("pending", "exhausted"):
+        depth.setdefault((settings.elastic_index, state), 0)
+    for (index, state), count in depth.items():
+        DEAD_LETTERS.set(count, index=index, state=state)
+
+
+registry.add_collector(collect_watermarks)
+registry.add_collector(collect_batch_size)
+registry.add_collector(collect_dead_letters)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server() -> ThreadingHTTPServer | None:
+    """
+    Запустить HTTP-эндпоинт /metrics в фоновом потоке (ETL_METRICS_PORT=0 - не запускать).
+    """
+    if not settings.etl_metrics_port:
+        return None
+    server = ThreadingHTTPServer((settings.etl_metrics_host, settings.etl_metrics_port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Метрики доступны на http://{settings.etl_metrics_host}:{settings.etl_metrics_port}/metrics")
+    return server
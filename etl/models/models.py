@@ -1,20 +1,24 @@
+from dataclasses import dataclass
 from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel
 
-
-class Person(BaseModel):
+# Записи без валидации: данные приходят из PostgreSQL уже нужных типов,
+# а __slots__ экономит память и время на создании объектов на каждой пачке
+@dataclass(slots=True)
+class Person:
     id: str
     name: str
 
 
-class Genre(BaseModel):
+@dataclass(slots=True)
+class Genre:
     id: str
     name: str
 
 
-class FilmWork(BaseModel):
+@dataclass(slots=True)
+class FilmWork:
     id: str
     title: str
     description: Optional[str]
@@ -1,15 +1,25 @@
 import logging
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime
 
 import psycopg
-from psycopg import connect, ClientCursor, OperationalError
+from psycopg import connect, OperationalError, AsyncConnection
 from psycopg.rows import dict_row
 
-from backoff_self.backoff import backoff
+from backoff_self.backoff import backoff, async_backoff
+from metrics import measure
 from config.settings import settings
 
 
+def connection_options() -> dict:
+    """
+    Параметры соединения: строки словарями, параметры запросов передаются отдельно от текста
+    (серверная привязка), а запрос готовится (PREPARE) при первом выполнении и дальше
+    выполняется по сохранённому плану. Подготовку нужно выключить за PgBouncer в режиме transaction.
+    """
+    return {"row_factory": dict_row, "prepare_threshold": 0 if settings.postgres_prepared_statements else None}
+
+
 class PostgresConnector:
     """Подключение к PostgreSQL"""
 
@@ -20,7 +30,7 @@ class PostgresConnector:
     @backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
     def _create_connection(self):
         """Функция подключения с повторными попытками"""
-        return connect(**self.dsl, row_factory=dict_row, cursor_factory=ClientCursor)
+        return connect(**self.dsl, **connection_options())
 
     @contextmanager
     def connect(self):
@@ -39,36 +49,78 @@ class PostgresConnector:
                 self.logger.info("Соединение с PostgreSQL закрыто")
 
 
-def get_modified(cursor, state, query, table_name: str) -> tuple[list, bool]:
+class AsyncPostgresConnector:
+    """Асинхронное подключение к PostgreSQL"""
+
+    def __init__(self):
+        self.dsl = settings.postgres_dsl
+        self.logger = logging.getLogger(__name__)
+
+    @async_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+    async def _create_connection(self):
+        """Функция подключения с повторными попытками"""
+        return await AsyncConnection.connect(**self.dsl, **connection_options())
+
+    @asynccontextmanager
+    async def connect(self):
+        """Асинхронный контекстный менеджер для подключения к PostgreSQL."""
+        conn = None
+        try:
+            conn = await self._create_connection()
+            self.logger.info("Асинхронное соединение с PostgreSQL установлено.")
+            yield conn
+        except OperationalError:
+            self.logger.exception("Ошибка при подключении к PostgreSQL")
+            raise
+        finally:
+            if conn:
+                await conn.close()
+                self.logger.info("Асинхронное соединение с PostgreSQL закрыто")
+
+
+# id после любого другого: отметка modified без id (после полной переиндексации или из
+# прежнего состояния) значит, что все записи с этой отметкой уже загружены
+LAST_ID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+
+def get_modified(cursor, state, query, table_name: str, page_size: int) -> tuple[list, bool]:
+    """Страница изменений после отметки (modified, id) из temporary-ключей состояния."""
     modified = state.get_state(f"temporary_{table_name}")
     if modified is None:
         modified = "-infinity"
     else:
         modified = datetime.fromisoformat(modified)
+    last_id = state.get_state(f"temporary_{table_name}_id") or LAST_ID
 
     try:
-        result = cursor.execute(query, (modified,)).fetchall()
+        with measure("extract", table_name) as measurement:
+            result = cursor.execute(query, (modified, last_id, page_size), binary=True).fetchall()
+            measurement.items = len(result)
         return result, False
     except psycopg.Error:
         logging.exception(f"Ошибка при получении пачки изменений в таблице {table_name}")
         return [], True
 
 
-def get_film_works_by_persons_or_genres_modified(cursor, state, query: str, data: list, table_name: str) -> tuple[list, bool]:
-    modified = state.get_state(f"temporary_film_works_by_{table_name}")
-    if modified != "-infinity":
-        modified = datetime.fromisoformat(modified)
-
+def get_results(cursor, query, data, table_name: str):
     try:
-        return cursor.execute(query, (*data, modified)).fetchall(), False
+        with measure("extract", table_name) as measurement:
+            result = cursor.execute(query, data, binary=True).fetchall()
+            measurement.items = len(result)
+        return result, False
     except psycopg.Error:
-        logging.exception(f"Ошибка при получении id фильмов по id измененных в {table_name}")
+        logging.exception(f"Ошибка при получении данных из-за изменений в {table_name}")
         return [], True
 
 
-def get_results(cursor, query, data, table_name: str):
+async def get_results_async(cursor, query, data, table_name: str) -> tuple[list, bool]:
+    """Асинхронный вариант get_results."""
     try:
-        return cursor.execute(query, data).fetchall(), False
+        with measure("extract", table_name) as measurement:
+            await cursor.execute(query, data, binary=True)
+            result = await cursor.fetchall()
+            measurement.items = len(result)
+        return result, False
     except psycopg.Error:
         logging.exception(f"Ошибка при получении данных из-за изменений в {table_name}")
         return [], True
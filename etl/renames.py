@@ -0,0 +1,154 @@
+import sqlite3
+from dataclasses import dataclass, field
+
+from config.settings import settings
+
+# Колонка с именем, которое попадает в документы фильмов
+NAME_COLUMNS = {"person": "full_name", "genre": "name"}
+
+# Новые имена персон во вложенных directors/actors/writers и в массивах *_names
+# (в том же порядке, что и transform.by_name)
+RENAME_PERSONS_SCRIPT = """
+    for (String role : params.roles) {
+        List persons = ctx._source[role];
+        if (persons == null) {
+            continue;
+        }
+        for (Map person : persons) {
+            if (params.names.containsKey(person.id)) {
+                person.name = params.names[person.id];
+            }
+        }
+        persons.sort((a, b) -> {
+            int order = a.name.compareTo(b.name);
+            return order != 0 ? order : a.id.compareTo(b.id);
+        });
+        List names = new ArrayList();
+        for (Map person : persons) {
+            names.add(person.name);
+        }
+        ctx._source[role + '_names'] = names;
+    }
+    """
+
+# Новые названия жанров: в документе хранятся только названия, поэтому замена идёт по старому названию
+RENAME_GENRES_SCRIPT = """
+    List genres = new ArrayList();
+    for (String genre : ctx._source.genres) {
+        genres.add(params.names.getOrDefault(genre, genre));
+    }
+    Collections.sort(genres);
+    ctx._source.genres = genres;
+    """
+
+ROLES = ["directors", "actors", "writers"]
+
+
+@dataclass
+class Renames:
+    """Переименования персон и жанров, которые применяются скриптом к документам в индексе."""
+    # id персоны -> новое имя
+    persons: dict[str, str] = field(default_factory=dict)
+    # старое название жанра -> новое
+    genres: dict[str, str] = field(default_factory=dict)
+    # Фильмы, документы которых изменит скрипт
+    film_ids: set[str] = field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return bool(self.persons or self.genres)
+
+    def requests(self) -> list[dict]:
+        """Параметры update_by_query: запрос к затронутым документам и painless-скрипт."""
+        requests = []
+        if self.persons:
+            ids = list(self.persons)
+            requests.append({
+                "query": {"bool": {"should": [
+                    {"nested": {"path": role, "query": {"terms": {f"{role}.id": ids}}}} for role in ROLES
+                ]}},
+                "script": {"source": RENAME_PERSONS_SCRIPT, "lang": "painless",
+                           "params": {"roles": ROLES, "names": self.persons}},
+            })
+        if self.genres:
+            requests.append({
+                "query": {"terms": {"genres": list(self.genres)}},
+                "script": {"source": RENAME_GENRES_SCRIPT, "lang": "painless", "params": {"names": self.genres}},
+            })
+        return requests
+
+
+class KnownNames:
+    """Имена персон и названия жанров в том виде, в каком они сейчас в индексе.
+
+    По ним отличается переименование от прочих изменений записи. Хранятся в той же
+    базе SQLite, что и хеши документов.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.conn = sqlite3.connect(file_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS known_names '
+            '(table_name TEXT NOT NULL, id TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (table_name, id)) '
+            'WITHOUT ROWID'
+        )
+
+    def split(self, table_name: str, data: list, renames: Renames) -> tuple[list, list]:
+        """
+        Отделить переименования от остальных изменённых записей person или genre.
+
+        Переименованием считается запись, имя которой известно и отличается от текущего:
+        оно добавляется в renames. По новым записям и записям с прежним именем фильмы
+        перечитываются целиком, как раньше.
+
+        :return: Переименованные записи и остальные записи
+        """
+        ids = [str(db_part["id"]) for db_part in data]
+        known = {}
+        for start in range(0, len(ids), 900):
+            part = ids[start:start + 900]
+            known.update(self.conn.execute(
+                f'SELECT id, name FROM known_names WHERE table_name = ? AND id IN ({",".join("?" * len(part))})',
+                (table_name, *part)
+            ))
+
+        renamed, rest = [], []
+        for db_part in data:
+            old_name = known.get(str(db_part["id"]))
+            if old_name is None or old_name == db_part["name"]:
+                rest.append(db_part)
+                continue
+            renamed.append(db_part)
+            if table_name == "person":
+                renames.persons[str(db_part["id"])] = db_part["name"]
+            else:
+                renames.genres[old_name] = db_part["name"]
+
+        self.store(table_name, data)
+        return renamed, rest
+
+    def store(self, table_name: str, data: list) -> None:
+        """Запомнить текущие имена записей."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO known_names (table_name, id, name) VALUES (?, ?, ?) '
+                'ON CONFLICT (table_name, id) DO UPDATE SET name = excluded.name',
+                ((table_name, str(db_part["id"]), db_part["name"]) for db_part in data)
+            )
+
+    def seed(self, cursor) -> None:
+        """Запомнить имена всех персон и жанров (при полной загрузке каталога)."""
+        for table_name, column in NAME_COLUMNS.items():
+            cursor.execute(f"SELECT id, {column} as name FROM content.{table_name}")
+            while data := cursor.fetchmany(10_000):
+                self.store(table_name, data)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_known_names() -> KnownNames | None:
+    """Известные имена, если частичные обновления включены."""
+    if not settings.etl_partial_updates:
+        return None
+    return KnownNames(settings.etl_doc_hashes_path)
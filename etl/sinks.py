@@ -0,0 +1,374 @@
+import abc
+import gzip
+import json
+import logging
+import mmap
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import BinaryIO, Iterable, Iterator
+
+from elasticsearch import ApiError
+from psycopg import IsolationLevel
+
+from adaptive import batch_size
+from backoff_self.backoff import backoff
+from dimensions import DIMENSIONS, stream_documents as stream_dimension_documents
+from doc_hashes import DocumentHashes, rebuild_index_hashes
+from elastic import ElasticConnector
+from extractor import SELECT_ALL_FILM_DATA
+from full_reindex import SELECT_WATERMARKS, stream_documents
+from index_schema import MOVIES_SCHEMA
+from loader import BULK_RETRY_ON_STATUS, MAX_REJECTED_RETRIES, ElasticsearchLoader, generate_actions, retry_after
+from metrics import BULK_ERRORS, measure
+from postgres import PostgresConnector
+from state import State, get_storage
+from transform import Document
+from config.settings import settings
+
+# Описание выгрузки: когда снята и до каких отметок modified в ней данные
+MANIFEST = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(abc.ABC):
+    """Получатель документов, готовых к отправке."""
+
+    @abc.abstractmethod
+    def write(self, documents: list[Document], index: str) -> dict[str, str]:
+        """
+        Записать пачку документов.
+
+        :param documents: Документы с _source в виде JSON-байтов; без _source - удаление
+        :param index: Алиас индекса
+        :return: Id документов, которые получатель не принял, с причиной отказа
+        """
+
+    def flush(self) -> None:
+        """Конец цикла ETL: записанное должно стать доступным читателям."""
+
+    def close(self) -> None:
+        """Освободить ресурсы получателя."""
+
+
+class ElasticsearchSink(Sink):
+    """Загрузка в Elasticsearch через ElasticsearchLoader.bulk_load."""
+
+    def __init__(self, loader: ElasticsearchLoader) -> None:
+        self.loader = loader
+
+    def write(self, documents: list[Document], index: str) -> dict[str, str]:
+        failed_ids = self.loader.bulk_load(generate_actions(documents, index), index)
+        if failed_ids is None:
+            raise Exception("Ошибка при загрузке данных в Elasticsearch")
+        return failed_ids
+
+
+class BulkFileSink(Sink):
+    """
+    Запись документов в файлы формата _bulk API (NDJSON), готовые к отправке как есть.
+
+    Документы каждого индекса пишутся в свой каталог directory/<алиас> сегментами
+    <время запуска>-<номер>.ndjson (.ndjson.gz со сжатием). Сегмент закрывается, когда
+    в него записано segment_bytes байт до сжатия, и при flush в конце цикла. Пока сегмент
+    пишется, у него суффикс .tmp, поэтому replay видит только законченные сегменты, а имена
+    сортируются в порядке записи. В строках действий нет _index: индекс выбирается при загрузке.
+    """
+
+    def __init__(self, directory: str, compress: bool = True, segment_bytes: int = 64 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.compress = compress
+        self.segment_bytes = segment_bytes
+        self.prefix = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.number = 0
+        # индекс -> (открытый файл, путь сегмента, записано байт)
+        self.segments: dict[str, tuple[BinaryIO, str, int]] = {}
+
+    def write(self, documents: list[Document], index: str) -> dict[str, str]:
+        for document in documents:
+            file, path, written = self.segments.get(index) or self._open(index)
+            if document.source is None:
+                line = b'{"delete":{"_id":' + json.dumps(document.id).encode() + b'}}\n'
+            else:
+                line = b'{"index":{"_id":' + json.dumps(document.id).encode() + b'}}\n' + document.source + b'\n'
+            file.write(line)
+            written += len(line)
+            self.segments[index] = (file, path, written)
+            if written >= self.segment_bytes:
+                self._finish(index)
+        return {}
+
+    def flush(self) -> None:
+        for index in list(self.segments):
+            self._finish(index)
+
+    def close(self) -> None:
+        self.flush()
+
+    def _open(self, index: str) -> tuple[BinaryIO, str, int]:
+        directory = os.path.join(self.directory, index)
+        os.makedirs(directory, exist_ok=True)
+        self.number += 1
+        path = os.path.join(directory, f"{self.prefix}-{self.number:06d}.ndjson" + (".gz" if self.compress else ""))
+        file = gzip.open(path + ".tmp", "wb", compresslevel=6) if self.compress else open(path + ".tmp", "wb")
+        return file, path, 0
+
+    def _finish(self, index: str) -> None:
+        """Закрыть сегмент индекса и открыть его для чтения (убрать .tmp)."""
+        file, path, written = self.segments.pop(index)
+        file.close()
+        os.replace(path + ".tmp", path)
+        logger.info(f"Записан сегмент {path}: {written} байт")
+
+
+class FanOutSink(Sink):
+    """Запись одних и тех же документов в несколько получателей по очереди."""
+
+    def __init__(self, sinks: list[Sink]) -> None:
+        self.sinks = sinks
+
+    def write(self, documents: list[Document], index: str) -> dict[str, str]:
+        failed_ids = {}
+        for sink in self.sinks:
+            failed_ids.update(sink.write(documents, index))
+        return failed_ids
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def open_bulk_file_sink(directory: str | None = None) -> BulkFileSink:
+    return BulkFileSink(directory or settings.etl_bulk_file_dir, settings.etl_bulk_file_compress,
+                        settings.etl_bulk_file_segment_bytes)
+
+
+def open_sink(loader: ElasticsearchLoader) -> Sink:
+    """Получатели документов фильмов из настроек (ETL_SINKS)."""
+    sinks = []
+    for name in settings.etl_sinks.split(","):
+        sinks.append(ElasticsearchSink(loader) if name == "elasticsearch" else open_bulk_file_sink())
+    return sinks[0] if len(sinks) == 1 else FanOutSink(sinks)
+
+
+def run_export_bulk(directory: str) -> None:
+    """
+    Выгрузка всего каталога из PostgreSQL в файлы _bulk (--export-bulk).
+
+    Фильмы, персоны и жанры читаются из одного снимка REPEATABLE READ, отметки modified
+    того же снимка записываются в manifest.json, чтобы после восстановления ETL продолжил с них.
+    """
+    sink = open_bulk_file_sink(directory)
+    try:
+        with PostgresConnector().connect() as pg_conn:
+            pg_conn.isolation_level = IsolationLevel.REPEATABLE_READ
+            with pg_conn.cursor() as cursor:
+                watermarks = cursor.execute(SELECT_WATERMARKS).fetchone()
+            with pg_conn.cursor(name="export_bulk") as cursor:
+                cursor.execute(SELECT_ALL_FILM_DATA)
+                write_all(sink, stream_documents(cursor), settings.elastic_index)
+            for dimension in DIMENSIONS:
+                with pg_conn.cursor(name=f"export_bulk_{dimension.table_name}") as cursor:
+                    cursor.execute(dimension.select_all)
+                    write_all(sink, stream_dimension_documents(cursor, dimension), dimension.alias)
+    finally:
+        sink.close()
+
+    manifest = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "watermarks": {table_name: modified.isoformat() for table_name, modified in watermarks.items()
+                       if modified is not None},
+    }
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+    logger.info(f"Каталог выгружен в {directory}")
+
+
+def write_all(sink: Sink, documents: Iterable[Document], index: str) -> None:
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= settings.etl_full_reindex_batch_size:
+            sink.write(batch, index)
+            batch = []
+    sink.write(batch, index)
+
+
+def run_replay_bulk(directory: str) -> None:
+    """
+    Загрузка файлов _bulk из directory в Elasticsearch без обращения к PostgreSQL (--replay-bulk).
+
+    Для каждого алиаса (фильмы, персоны, жанры) готовится версия индекса, как при полной
+    переиндексации, и в неё по порядку отправляются сегменты каталога directory/<алиас>.
+    Отметки modified из manifest.json записываются в состояние. Хеши документов каждого
+    алиаса пересобираются по загруженному индексу, иначе ETL сравнивал бы документы
+    с хешами прежнего содержимого.
+    """
+    es_connector = ElasticConnector()
+    try:
+        targets = [(settings.elastic_index, MOVIES_SCHEMA)]
+        targets += [(dimension.alias, dimension.schema) for dimension in DIMENSIONS]
+        for alias, schema in targets:
+            segments = os.path.join(directory, alias)
+            if not os.path.isdir(segments):
+                continue
+            if not es_connector.ensure_index(partial(replay_segments, es_connector, segments), alias, schema):
+                # Загрузка поверх индекса под алиасом: если она прервётся, хеши уже не совпадут с индексом
+                forget_hashes(alias)
+                replay_segments(es_connector, segments, alias)
+            rebuild_index_hashes(es_connector, alias)
+    finally:
+        es_connector.close()
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as file:
+            watermarks = json.load(file)["watermarks"]
+        state = State(get_storage(settings.state_storage, settings.state_file_path))
+        for table_name, modified in watermarks.items():
+            state.set_state(table_name, modified)
+            # Выгрузка - снимок со всеми записями этой отметки, как у полной переиндексации
+            state.set_state(f"{table_name}_id", None)
+            logger.info(f"Состояние {table_name} установлено на {modified} по {manifest_path}")
+        state.checkpoint()
+
+
+def forget_hashes(index: str) -> None:
+    """Забыть все хеши документов индекса."""
+    hashes = DocumentHashes(settings.etl_doc_hashes_path, index, settings.etl_skip_unchanged)
+    try:
+        hashes.clear()
+    finally:
+        hashes.close()
+
+
+def replay_segments(es_connector: ElasticConnector, directory: str, index: str) -> None:
+    """
+    Отправить законченные сегменты каталога в индекс по порядку имён.
+
+    Если после повторов часть документов сегмента так и не принята, загрузка прерывается:
+    алиас не переключается на неполную версию, а отметки из manifest.json не записываются.
+    """
+    loader = ElasticsearchLoader(es_connector)
+    paths = sorted(name for name in os.listdir(directory) if name.endswith((".ndjson", ".ndjson.gz")))
+    with loader.bulk_profile(index):
+        for name in paths:
+            sent, failed_ids = replay_segment(es_connector, os.path.join(directory, name), index)
+            if failed_ids:
+                raise Exception(f"Ошибка при загрузке сегмента {name} в {index}: не принято документов "
+                                f"{len(failed_ids)} из {sent}")
+            logger.info(f"Сегмент {name} загружен в {index}: документов {sent}")
+
+
+def replay_segment(es_connector: ElasticConnector, path: str, index: str) -> tuple[int, dict[str, str]]:
+    """
+    Загрузка одного сегмента: bulk-запросы собираются из строк сегмента по границам
+    документов и отправляются как есть, без разбора JSON.
+
+    :return: Число отправленных документов и не принятые Elasticsearch id с причиной отказа
+    """
+    sent, failed_ids = 0, {}
+    with open_segment(path) as stream, es_connector.connect() as es_client:
+        for actions in bulk_chunks(stream, settings.elastic_max_chunk_bytes):
+            rejected = send_actions(es_client, actions, index)
+            if rejected is None:
+                raise Exception(f"Ошибка при загрузке сегмента {path} в Elasticsearch")
+            failed_ids.update(rejected)
+            sent += len(actions)
+    return sent, failed_ids
+
+
+@contextmanager
+def open_segment(path: str) -> Iterator:
+    """
+    Сегмент для чтения по строкам.
+
+    Несжатый сегмент отображается в память (mmap) и читается без буферов файла;
+    сжатый (.gz) читается потоком gzip, то есть каждый байт распаковывается и копируется.
+    """
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as stream:
+            yield stream
+        return
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+def bulk_chunks(stream, max_bytes: int) -> Iterator[list[bytes]]:
+    """
+    Пачки действий из строк сегмента: не больше max_bytes байт и batch_size.size документов.
+
+    Действие - строка delete или пара строк index с документом, в том виде, в каком оно
+    записано в сегмент.
+    """
+    actions, size = [], 0
+    while line := stream.readline():
+        if not line.startswith(b'{"delete"'):
+            line += stream.readline()
+        if actions and (size + len(line) > max_bytes or len(actions) >= batch_size.size):
+            yield actions
+            actions, size = [], 0
+        actions.append(line)
+        size += len(line)
+    if actions:
+        yield actions
+
+
+@backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, max_retries=10, jitter=True)
+def send_actions(es_client, actions: list[bytes], index: str) -> dict[str, str]:
+    """
+    Отправить пачку готовых действий одним bulk-запросом.
+
+    Отклонённое с кодом 429 (весь запрос или отдельные документы) повторяется после паузы
+    из Retry-After и уменьшения пачки, как в ElasticsearchLoader.
+
+    :return: Id документов, не принятых Elasticsearch, с причиной отказа (None - запрос не удался после повторов)
+    """
+    failed_ids = {}
+    with measure("load", index) as measurement:
+        measurement.items = len(actions)
+        for attempt in range(MAX_REJECTED_RETRIES + 1):
+            retry = attempt < MAX_REJECTED_RETRIES
+            started = time.monotonic()
+            try:
+                response = es_client.options(retry_on_status=BULK_RETRY_ON_STATUS).bulk(
+                    index=index, operations=b"".join(actions))
+            except ApiError as error:
+                if error.meta.status != 429 or not retry:
+                    raise
+                time.sleep(batch_size.reject(retry_after(error)))
+                continue
+
+            batch_size.observe(time.monotonic() - started)
+            if not response["errors"]:
+                return failed_ids
+            actions = split_rejected_actions(actions, response["items"], retry, index, failed_ids)
+            if not actions:
+                return failed_ids
+            time.sleep(batch_size.reject())
+    return failed_ids
+
+
+def split_rejected_actions(actions: list[bytes], items: list[dict], retry: bool, index: str,
+                           failed_ids: dict[str, str]) -> list[bytes]:
+    """Вариант loader.split_rejected для готовых действий: ответы bulk идут в порядке действий."""
+    rejected = []
+    for action, item in zip(actions, items):
+        result = next(iter(item.values()))
+        if not result.get("error"):
+            continue
+        status = result.get("status")
+        if retry and status == 429:
+            rejected.append(action)
+        else:
+            logger.error(f"Добавление прервано. Не внесён элемент: {item}")
+            failed_ids[result.get("_id")] = str(result["error"])
+            BULK_ERRORS.inc(index=index, status=str(status))
+    return rejected
@@ -1,12 +1,28 @@
+import abc
 import json
 import os
+import sqlite3
+import tempfile
 from typing import Any, Dict
 
 
-class JsonFileStorage:
+class BaseStorage(abc.ABC):
+    """Абстрактное хранилище состояния."""
+
+    @abc.abstractmethod
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+
+    @abc.abstractmethod
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+
+
+class JsonFileStorage(BaseStorage):
     """Реализация хранилища, использующего локальный файл.
 
-    Формат хранения: JSON
+    Формат хранения: JSON. Файл перезаписывается атомарно: состояние пишется во временный
+    файл рядом, сбрасывается на диск и подменяет старый файл через rename.
     """
 
     def __init__(self, file_path: str) -> None:
@@ -14,8 +30,23 @@ class JsonFileStorage:
 
     def save_state(self, state: Dict[str, Any]) -> None:
         """Сохранить состояние в хранилище."""
-        with open(self.file_path, 'w') as f:
-            json.dump(state, f, indent=4)
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.state-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> Dict[str, Any]:
         """Получить состояние из хранилища."""
@@ -29,18 +60,64 @@ class JsonFileStorage:
                 return {}
 
 
+class SqliteStorage(BaseStorage):
+    """Реализация хранилища на SQLite.
+
+    Каждый ключ - отдельная строка таблицы state, значение хранится в JSON.
+    Сохранение выполняется одной транзакцией.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        with sqlite3.connect(self.file_path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+        with sqlite3.connect(self.file_path) as conn:
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.executemany(
+                'INSERT INTO state (key, value) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                [(key, json.dumps(value)) for key, value in state.items()]
+            )
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+        with sqlite3.connect(self.file_path) as conn:
+            return {key: json.loads(value) for key, value in conn.execute('SELECT key, value FROM state')}
+
+
+def get_storage(kind: str, file_path: str) -> BaseStorage:
+    """Хранилище состояния по названию: json или sqlite."""
+    storages = {'json': JsonFileStorage, 'sqlite': SqliteStorage}
+    return storages[kind](file_path)
+
+
 class State:
-    """Класс для работы с состояниями."""
+    """Класс для работы с состояниями.
 
-    def __init__(self, storage: JsonFileStorage) -> None:
+    Состояние читается из хранилища один раз и дальше живёт в памяти. В хранилище
+    оно попадает только при вызове checkpoint.
+    """
+
+    def __init__(self, storage: BaseStorage) -> None:
         self.storage = storage
+        self._state = storage.retrieve_state()
+        self._dirty = False
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа."""
-        state_storage = self.storage.retrieve_state()
-        state_storage[key] = value
-        self.storage.save_state(state_storage)
+        self._state[key] = value
+        self._dirty = True
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу."""
-        return self.storage.retrieve_state().get(key)
+        return self._state.get(key)
+
+    def checkpoint(self) -> None:
+        """Сохранить накопленные изменения в хранилище."""
+        if self._dirty:
+            self.storage.save_state(self._state)
+            self._dirty = False
@@ -0,0 +1,20 @@
+import os
+import sys
+
+# Модули ETL импортируются как в запуске из каталога etl
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Обязательные настройки: модульные тесты не подключаются ни к PostgreSQL, ни к Elasticsearch
+for name, value in {
+    "DB_NAME": "movies_database",
+    "DB_USER": "app",
+    "DB_PASSWORD": "123qwe",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "ELASTIC_HOST": "localhost",
+    "ELASTIC_PORT": "9200",
+    "ELASTIC_SCHEME": "http",
+    "ELASTIC_INDEX": "movies",
+    "STATE_FILE_PATH": "state.json",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,134 @@
+"""
+Равенство документов режимов ETL_FILM_QUERY на одних и тех же данных без базы:
+строки каждого запроса собираются вручную из одного описания каталога.
+Сверка на живой базе - checks/compare_film_queries.py.
+"""
+import uuid
+from datetime import datetime, timezone
+
+from dimension_cache import DimensionCache, SELECT_FILM_GENRE_LINKS, SELECT_FILM_PERSON_LINKS, SELECT_NAMES_BY_IDS, \
+    SELECT_NAMES_MODIFIED
+from extractor import build_film_works, build_film_works_aggregated, build_film_works_linked
+from transform import transformation
+
+MODIFIED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+ANN, BOB, CID = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+DRAMA, ACTION = uuid.uuid4(), uuid.uuid4()
+PERSONS = {ANN: "Ann", BOB: "Bob", CID: "Cid"}
+GENRES = {DRAMA: "Drama", ACTION: "Action"}
+
+FILM, EMPTY_FILM = uuid.uuid4(), uuid.uuid4()
+# id фильма -> связи (персона, роль) и жанры; персона может быть в фильме в нескольких ролях
+FILMS = {
+    FILM: {
+        "persons": [(ANN, "actor"), (ANN, "writer"), (BOB, "director"), (CID, "actor")],
+        "genres": [DRAMA, ACTION],
+    },
+    EMPTY_FILM: {"persons": [], "genres": []},
+}
+
+
+def film_fields(film_id: uuid.UUID) -> dict:
+    return {
+        "fw_id": film_id,
+        "title": f"Film {film_id}",
+        "description": None,
+        "rating": 7.5,
+        "type": "movie",
+        "created": MODIFIED,
+        "modified": MODIFIED,
+    }
+
+
+def join_rows() -> list[dict]:
+    """Строки SELECT_FILM_DATA: по строке на каждую пару персона × жанр, у фильма без связей - NULL."""
+    rows = []
+    for film_id, links in FILMS.items():
+        persons = links["persons"] or [(None, None)]
+        genres = links["genres"] or [None]
+        for person_id, role in persons:
+            for genre_id in genres:
+                rows.append(dict(film_fields(film_id), role=role, id=person_id,
+                                 full_name=PERSONS.get(person_id), g_id=genre_id, name=GENRES.get(genre_id)))
+    return rows
+
+
+def aggregated_rows() -> list[dict]:
+    """Строки SELECT_FILM_DATA_AGGREGATED: json-массивы приходят списками словарей со строковыми id."""
+    rows = []
+    for film_id, links in FILMS.items():
+        row = dict(film_fields(film_id), genres=[{"id": str(genre_id), "name": GENRES[genre_id]}
+                                                 for genre_id in links["genres"]])
+        for role, persons_field in (("director", "directors"), ("actor", "actors"), ("writer", "writers")):
+            row[persons_field] = [{"id": str(person_id), "name": PERSONS[person_id]}
+                                  for person_id, person_role in links["persons"] if person_role == role]
+        rows.append(row)
+    return rows
+
+
+class StubCursor:
+    """Курсор, который отвечает на запросы DimensionCache строками из описания каталога."""
+
+    def __init__(self, results: dict) -> None:
+        # запрос -> функция от параметров, возвращающая строки
+        self.results = results
+        self.rows = []
+
+    def execute(self, query: str, params=None, binary: bool = False) -> "StubCursor":
+        self.rows = self.results[query](params)
+        return self
+
+    def fetchall(self) -> list[dict]:
+        return self.rows
+
+
+def name_rows(names: dict) -> list[dict]:
+    return [{"id": record_id, "name": name, "modified": MODIFIED} for record_id, name in names.items()]
+
+
+def linked_rows() -> list[dict]:
+    """Строки SELECT_FILMS, дополненные DimensionCache.film_rows после обновления кеша."""
+    person_links = [{"film_work_id": film_id, "person_id": person_id, "role": role}
+                    for film_id, links in FILMS.items() for person_id, role in links["persons"]]
+    genre_links = [{"film_work_id": film_id, "genre_id": genre_id}
+                   for film_id, links in FILMS.items() for genre_id in links["genres"]]
+
+    def by_film_ids(links):
+        return lambda params: [link for link in links if str(link["film_work_id"]) in params[0]]
+
+    def by_ids(names):
+        return lambda params: [row for row in name_rows(names) if str(row["id"]) in params[0]]
+
+    # Жанров нет среди изменённых записей: кеш дочитывает их по id из связей
+    cursor = StubCursor({
+        SELECT_NAMES_MODIFIED["person"]: lambda params: name_rows(PERSONS),
+        SELECT_NAMES_MODIFIED["genre"]: lambda params: [],
+        SELECT_NAMES_BY_IDS["person"]: by_ids(PERSONS),
+        SELECT_NAMES_BY_IDS["genre"]: by_ids(GENRES),
+        SELECT_FILM_PERSON_LINKS: by_film_ids(person_links),
+        SELECT_FILM_GENRE_LINKS: by_film_ids(genre_links),
+    })
+    cache = DimensionCache()
+    cache.refresh(cursor)
+    return cache.film_rows(cursor, [film_fields(film_id) for film_id in FILMS])
+
+
+def test_film_query_modes_build_equal_documents():
+    joined = transformation(build_film_works(join_rows()))
+    aggregated = transformation(build_film_works_aggregated(aggregated_rows()))
+    linked = transformation(build_film_works_linked(linked_rows()))
+
+    assert joined == aggregated == linked
+
+
+def test_join_rows_are_deduplicated():
+    documents = {document["id"]: document for document in transformation(build_film_works(join_rows()))}
+
+    film = documents[str(FILM)]
+    assert film["genres"] == ["Action", "Drama"]
+    assert film["actors"] == [{"id": str(ANN), "name": "Ann"}, {"id": str(CID), "name": "Cid"}]
+    assert film["directors_names"] == ["Bob"]
+    assert film["writers_names"] == ["Ann"]
+    empty_film = documents[str(EMPTY_FILM)]
+    assert empty_film["genres"] == empty_film["actors"] == empty_film["directors"] == empty_film["writers"] == []
@@ -0,0 +1,52 @@
+import json
+from typing import NamedTuple
+
+from models.models import FilmWork
+
+# Каноничная форма документа: сортированные ключи, без пробелов, UTF-8 без экранирования.
+# Одинаковые документы дают одинаковые байты
+encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+class Document(NamedTuple):
+    """Документ, готовый к отправке: id и _source в виде JSON-байтов (None - документ удаляется)."""
+    id: str
+    source: bytes | None
+
+
+def by_name(items: list) -> list:
+    """Жанры или персоны в постоянном порядке, чтобы документ не зависел от порядка строк запроса."""
+    return sorted(items, key=lambda item: (item.name, item.id))
+
+
+def to_document(film: FilmWork) -> dict:
+    """Документ индекса movies для фильма."""
+    directors, actors, writers = by_name(film.directors), by_name(film.actors), by_name(film.writers)
+    return {
+        "id": film.id,
+        "imdb_rating": film.imdb_rating,
+        "genres": [genre.name for genre in by_name(film.genres)],
+        "title": film.title,
+        "description": film.description,
+        "directors_names": [d.name for d in directors],
+        "actors_names": [a.name for a in actors],
+        "writers_names": [w.name for w in writers],
+        "directors": [{"id": d.id, "name": d.name} for d in directors],
+        "actors": [{"id": a.id, "name": a.name} for a in actors],
+        "writers": [{"id": w.id, "name": w.name} for w in writers],
+    }
+
+
+def transformation(film_works: dict[str, FilmWork]) -> list[dict]:
+    """Преобразование данных перед загрузкой в Elasticsearch."""
+    return [to_document(film) for film in film_works.values()]
+
+
+def serialize(film_works: dict[str, FilmWork]) -> list[Document]:
+    """
+    Преобразование фильмов сразу в JSON-байты документов.
+
+    Словарь документа живёт только до кодирования, поэтому в пачке не копятся
+    одновременно записи, словари и байты; клиент Elasticsearch отправляет байты как есть.
+    """
+    return [Document(film.id, encoder.encode(to_document(film)).encode()) for film in film_works.values()]
@@ -0,0 +1,97 @@
+from django.db import migrations
+
+# Очередь изменений для ETL: триггеры пишут в неё id фильмов, документы которых
+# в Elasticsearch нужно обновить. ETL забирает записи через DELETE ... RETURNING
+# с FOR UPDATE SKIP LOCKED, поэтому несколько процессов разбирают очередь параллельно.
+CREATE_OUTBOX = """
+CREATE TABLE IF NOT EXISTS content.etl_outbox (
+    id bigserial PRIMARY KEY,
+    film_work_id uuid NOT NULL,
+    created timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION content.etl_outbox_film_work() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_outbox (film_work_id) VALUES (NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION content.etl_outbox_person() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_outbox (film_work_id)
+    SELECT DISTINCT pfw.film_work_id
+    FROM content.person_film_work pfw
+    WHERE pfw.person_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION content.etl_outbox_genre() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_outbox (film_work_id)
+    SELECT DISTINCT gfw.film_work_id
+    FROM content.genre_film_work gfw
+    WHERE gfw.genre_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION content.etl_outbox_link() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO content.etl_outbox (film_work_id) VALUES (OLD.film_work_id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.film_work_id IS DISTINCT FROM OLD.film_work_id) THEN
+        INSERT INTO content.etl_outbox (film_work_id) VALUES (NEW.film_work_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER etl_outbox_film_work
+    AFTER INSERT OR UPDATE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_outbox_film_work();
+
+CREATE TRIGGER etl_outbox_person
+    AFTER UPDATE ON content.person
+    FOR EACH ROW WHEN (OLD.full_name IS DISTINCT FROM NEW.full_name)
+    EXECUTE FUNCTION content.etl_outbox_person();
+
+CREATE TRIGGER etl_outbox_genre
+    AFTER UPDATE ON content.genre
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION content.etl_outbox_genre();
+
+CREATE TRIGGER etl_outbox_person_film_work
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_outbox_link();
+
+CREATE TRIGGER etl_outbox_genre_film_work
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_outbox_link();
+"""
+
+DROP_OUTBOX = """
+DROP TRIGGER IF EXISTS etl_outbox_genre_film_work ON content.genre_film_work;
+DROP TRIGGER IF EXISTS etl_outbox_person_film_work ON content.person_film_work;
+DROP TRIGGER IF EXISTS etl_outbox_genre ON content.genre;
+DROP TRIGGER IF EXISTS etl_outbox_person ON content.person;
+DROP TRIGGER IF EXISTS etl_outbox_film_work ON content.film_work;
+DROP FUNCTION IF EXISTS content.etl_outbox_link();
+DROP FUNCTION IF EXISTS content.etl_outbox_genre();
+DROP FUNCTION IF EXISTS content.etl_outbox_person();
+DROP FUNCTION IF EXISTS content.etl_outbox_film_work();
+DROP TABLE IF EXISTS content.etl_outbox;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_alter_person_options_filmwork_file_path'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_OUTBOX, reverse_sql=DROP_OUTBOX),
+    ]
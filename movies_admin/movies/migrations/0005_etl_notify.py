@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# Уведомления ETL об изменениях в content: NOTIFY etl_changes с именем таблицы.
+# Триггеры уровня оператора, а одинаковые уведомления внутри транзакции PostgreSQL
+# схлопывает, так что массовое изменение даёт одно уведомление на таблицу.
+CREATE_NOTIFY = """
+CREATE OR REPLACE FUNCTION content.etl_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER etl_notify_film_work
+    AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+CREATE TRIGGER etl_notify_person
+    AFTER INSERT OR UPDATE OR DELETE ON content.person
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+CREATE TRIGGER etl_notify_genre
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+CREATE TRIGGER etl_notify_person_film_work
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+CREATE TRIGGER etl_notify_genre_film_work
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+"""
+
+DROP_NOTIFY = """
+DROP TRIGGER IF EXISTS etl_notify_genre_film_work ON content.genre_film_work;
+DROP TRIGGER IF EXISTS etl_notify_person_film_work ON content.person_film_work;
+DROP TRIGGER IF EXISTS etl_notify_genre ON content.genre;
+DROP TRIGGER IF EXISTS etl_notify_person ON content.person;
+DROP TRIGGER IF EXISTS etl_notify_film_work ON content.film_work;
+DROP FUNCTION IF EXISTS content.etl_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_etl_outbox'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NOTIFY, reverse_sql=DROP_NOTIFY),
+    ]
@@ -0,0 +1,124 @@
+from django.db import migrations, models
+
+# Индексы путей доступа ETL. Строятся CONCURRENTLY, чтобы не блокировать запись в таблицы,
+# поэтому миграция не атомарная, а каждый индекс - отдельный запрос вне транзакции.
+# Если построение прервалось, невалидный индекс нужно удалить (DROP INDEX CONCURRENTLY)
+# и повторить миграцию: IF NOT EXISTS его не перестраивает.
+#
+# - (modified, id) - страницы изменений WHERE (modified, id) > (%s, %s) ORDER BY modified, id LIMIT %s;
+# - уникальные (film_work_id, person_id, role) и (film_work_id, genre_id) - связи фильма
+#   (WHERE film_work_id = ANY(...)) и защита от повторных связей;
+# - (person_id, film_work_id) и (genre_id, film_work_id) - фильмы персоны или жанра.
+CREATE_INDEXES = [
+    (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_modified_id_idx "
+        "ON content.film_work (modified, id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.film_work_modified_id_idx;",
+    ),
+    (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS person_modified_id_idx "
+        "ON content.person (modified, id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.person_modified_id_idx;",
+    ),
+    (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_modified_id_idx "
+        "ON content.genre (modified, id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.genre_modified_id_idx;",
+    ),
+    (
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS film_work_person_role_uniq "
+        "ON content.person_film_work (film_work_id, person_id, role);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.film_work_person_role_uniq;",
+    ),
+    (
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS film_work_genre_uniq "
+        "ON content.genre_film_work (film_work_id, genre_id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.film_work_genre_uniq;",
+    ),
+    (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS person_film_work_person_idx "
+        "ON content.person_film_work (person_id, film_work_id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.person_film_work_person_idx;",
+    ),
+    (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_film_work_genre_idx "
+        "ON content.genre_film_work (genre_id, film_work_id);",
+        "DROP INDEX CONCURRENTLY IF EXISTS content.genre_film_work_genre_idx;",
+    ),
+]
+
+# Уникальные индексы становятся ограничениями, как их описывает UniqueConstraint моделей.
+# ADD CONSTRAINT не знает IF NOT EXISTS, поэтому проверка наличия ограничения - в блоке DO:
+# повтор прерванной миграции не падает на уже добавленном ограничении.
+# Ограничение забирает индекс себе, поэтому при откате сначала снимается оно
+ADD_CONSTRAINT = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = '{name}' AND conrelid = 'content.{table}'::regclass
+    ) THEN
+        ALTER TABLE content.{table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name};
+    END IF;
+END
+$$;
+"""
+
+ADD_CONSTRAINTS = [
+    (
+        ADD_CONSTRAINT.format(table="person_film_work", name="film_work_person_role_uniq"),
+        "ALTER TABLE content.person_film_work DROP CONSTRAINT IF EXISTS film_work_person_role_uniq;",
+    ),
+    (
+        ADD_CONSTRAINT.format(table="genre_film_work", name="film_work_genre_uniq"),
+        "ALTER TABLE content.genre_film_work DROP CONSTRAINT IF EXISTS film_work_genre_uniq;",
+    ),
+]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('movies', '0005_etl_notify'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                *(migrations.RunSQL(sql, reverse_sql=reverse_sql) for sql, reverse_sql in CREATE_INDEXES),
+                *(migrations.RunSQL(sql, reverse_sql=reverse_sql) for sql, reverse_sql in ADD_CONSTRAINTS),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='filmwork',
+                    index=models.Index(fields=['modified', 'id'], name='film_work_modified_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='person',
+                    index=models.Index(fields=['modified', 'id'], name='person_modified_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='genre',
+                    index=models.Index(fields=['modified', 'id'], name='genre_modified_id_idx'),
+                ),
+                migrations.AddConstraint(
+                    model_name='personfilmwork',
+                    constraint=models.UniqueConstraint(fields=('film_work', 'person', 'role'),
+                                                       name='film_work_person_role_uniq'),
+                ),
+                migrations.AddConstraint(
+                    model_name='genrefilmwork',
+                    constraint=models.UniqueConstraint(fields=('film_work', 'genre'), name='film_work_genre_uniq'),
+                ),
+                migrations.AddIndex(
+                    model_name='personfilmwork',
+                    index=models.Index(fields=['person', 'film_work'], name='person_film_work_person_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='genrefilmwork',
+                    index=models.Index(fields=['genre', 'film_work'], name='genre_film_work_genre_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -32,6 +32,7 @@ class Genre(UUIDMixin, TimeStampedMixin):
         db_table = "content\".\"genre"
         verbose_name = _('genre')
         verbose_name_plural = _('genre')
+        indexes = [models.Index(fields=['modified', 'id'], name='genre_modified_id_idx')]
 
 
 class Person(UUIDMixin, TimeStampedMixin):
@@ -44,6 +45,7 @@ class Person(UUIDMixin, TimeStampedMixin):
         db_table = "content\".\"person"
         verbose_name = _('role')
         verbose_name_plural = _('role')
+        indexes = [models.Index(fields=['modified', 'id'], name='person_modified_id_idx')]
 
 
 class FilmTypes(models.TextChoices):
@@ -76,6 +78,8 @@ class Filmwork(UUIDMixin, TimeStampedMixin):
         db_table = "content\".\"film_work"
         verbose_name = _('movies')
         verbose_name_plural = _('movies')
+        # Страницы изменений для ETL: WHERE modified > %s ORDER BY modified
+        indexes = [models.Index(fields=['modified', 'id'], name='film_work_modified_id_idx')]
 
 
 class GenreFilmwork(UUIDMixin):
@@ -85,6 +89,8 @@ class GenreFilmwork(UUIDMixin):
 
     class Meta:
         db_table = "content\".\"genre_film_work"
+        constraints = [models.UniqueConstraint(fields=('film_work', 'genre'), name='film_work_genre_uniq')]
+        indexes = [models.Index(fields=['genre', 'film_work'], name='genre_film_work_genre_idx')]
 
 
 class PersonFilmwork(UUIDMixin):
@@ -95,3 +101,6 @@ class PersonFilmwork(UUIDMixin):
 
     class Meta:
         db_table = "content\".\"person_film_work"
+        constraints = [models.UniqueConstraint(fields=('film_work', 'person', 'role'),
+                                               name='film_work_person_role_uniq')]
+        indexes = [models.Index(fields=['person', 'film_work'], name='person_film_work_person_idx')]